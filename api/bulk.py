@@ -0,0 +1,309 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from collections import defaultdict, deque
+import cStringIO
+import csv
+import itertools
+import json
+
+import metrics
+from fragments import fragment_cache
+from models import ImportJob
+from worx.geo import encode_geohash
+from worx.models import Report, Message, ReportSubscription
+
+# Bulk import and export of reports and messages, as NDJSON (one object a
+# line) or CSV (with a header), both with these columns:
+#   kind        "report" or "message"
+#   ref         a report's identifier in the file; messages name it in
+#               `report`, in a row after it or in an earlier import
+#   title, latitude, longitude    of a report
+#   report, text                  of a message
+#   date_time   exported only; imported rows are dated when imported
+# Exported reports keep the ref they were imported with, or else their id.
+# Imported reports are by the importing account, which follows each one,
+# and imported messages are top level (exports don't keep threads).
+COLUMNS = ('kind', 'ref', 'title', 'latitude', 'longitude', 'report', 'text', 'date_time')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Most refs looked up in one query (SQLite allows 999 parameters)
+LOOKUP_SIZE = 500
+
+ROWS = metrics.registry.counter('cwx_import_rows_total',
+    'Rows bulk imported, by whether they were valid', labels=('outcome',))
+
+
+# A row that can't be imported, saying why
+class InvalidRow(ValueError):
+    pass
+
+
+# ********* READING ROWS                   *********
+
+# Read the rows of an import from a file-like source (a file, or the
+# request itself) as it arrives, so however large it is only the rows
+# being written are in memory. Yields a dict for each row, or an
+# InvalidRow for one that can't be parsed.
+def read_rows(source, fmt):
+    if fmt == 'csv':
+        return read_csv(read_lines(source))
+    return read_ndjson(read_lines(source))
+
+# Helper to split a file-like source into lines, reading blocks of `size`
+# (a request's own readline takes several times longer than the import)
+def read_lines(source, size=65536):
+    tail = ''
+    while True:
+        block = source.read(size)
+        if not block:
+            break
+        lines = (tail + block).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if tail:
+        yield tail
+
+def read_ndjson(source):
+    for line in source:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield InvalidRow('not JSON')
+            continue
+        yield row if isinstance(row, dict) else InvalidRow('not a JSON object')
+
+def read_csv(source):
+    reader = csv.reader(source)
+    header = None
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield InvalidRow('bad CSV: %s' % e)
+            continue
+        if not fields:
+            continue
+        try:
+            fields = [f.decode('utf-8') for f in fields]
+        except UnicodeDecodeError:
+            yield InvalidRow('not UTF-8')
+            continue
+        if header is None:
+            header = [f.strip().lower() for f in fields]
+        else:
+            yield dict(zip(header, fields))
+
+# Helper to get a field of a row as text ('' if missing)
+def text_field(row, name):
+    value = row.get(name)
+    if value is None:
+        return u''
+    if isinstance(value, (dict, list, bool)):
+        raise InvalidRow('%s is not text' % name)
+    return unicode(value).strip()
+
+# Helper to get a coordinate field of a row within +/- limit degrees
+def coordinate_field(row, name, limit):
+    try:
+        value = float(row.get(name))
+    except (TypeError, ValueError):
+        raise InvalidRow('%s is not a number' % name)
+    if not -limit <= value <= limit: # NaN fails too
+        raise InvalidRow('%s is out of range' % name)
+    return value
+
+# Check a row, returning ('report', ref, title, latitude, longitude) or
+# ('message', report ref, text), or raising InvalidRow
+def clean_row(row):
+    if isinstance(row, InvalidRow):
+        raise row
+    kind = text_field(row, 'kind') or 'report'
+    if kind == 'report':
+        ref, title = text_field(row, 'ref'), text_field(row, 'title')
+        if not title:
+            raise InvalidRow('title is missing')
+        if len(title) > Report._meta.get_field('title').max_length:
+            raise InvalidRow('title is too long')
+        if len(ref) > Report._meta.get_field('external_ref').max_length:
+            raise InvalidRow('ref is too long')
+        return ('report', ref, title, coordinate_field(row, 'latitude', 90),
+            coordinate_field(row, 'longitude', 180))
+    if kind == 'message':
+        report, body = text_field(row, 'report'), text_field(row, 'text')
+        if not report:
+            raise InvalidRow('report is missing')
+        if not body:
+            raise InvalidRow('text is missing')
+        return ('message', report, body)
+    raise InvalidRow('unknown kind %r' % kind)
+
+
+# ********* IMPORT                         *********
+
+# Import the rows of `source` for the job, IMPORT_CHUNK_SIZE at a time,
+# skipping the rows an earlier run of the job committed. Each chunk is
+# written in one transaction, so if the import fails part way (and the
+# error is raised) running it again with the same input carries on after
+# the last chunk written. Invalid rows are counted and skipped.
+# Returns the job, updated.
+def run_import(job, source, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+    rows = read_rows(source, job.format)
+    deque(itertools.islice(rows, job.rows_done), maxlen=0) # already imported
+    number = job.rows_done
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if chunk:
+            import_chunk(job, [(number + i + 1, row) for i, row in enumerate(chunk)])
+            number += len(chunk)
+        if len(chunk) < chunk_size:
+            break
+    job.finished = True
+    job.save(update_fields=['finished', 'updated_on'])
+    return job
+
+# Write a chunk of (row number, row) in one transaction: the new reports,
+# their authors' subscriptions and the messages are each one bulk insert,
+# and reports from earlier chunks or imports that get messages one update
+# each. The job's progress is saved in the same transaction. The database
+# gives out the ids; the reports are tagged with the job, and the ones
+# after the highest id the job had before the insert are this chunk's,
+# read back in one query.
+def import_chunk(job, chunk):
+    cleaned, errors = [], []
+    for number, row in chunk:
+        try:
+            cleaned.append(clean_row(row))
+        except InvalidRow as e:
+            errors.append((number, u'%s' % e))
+            cleaned.append(None)
+    now = timezone.now()
+    with transaction.atomic():
+        # a write first takes the lock (a DEFERRED transaction only takes
+        # it at its first write), so a second run of the job waits for this
+        ImportJob.objects.filter(id=job.id).update(updated_on=now)
+        # refs the account's earlier imports gave reports
+        refs, known = sorted(set(c[1] for c in cleaned if c and c[1])), {}
+        for i in range(0, len(refs), LOOKUP_SIZE):
+            known.update(Report.objects.filter(reported_by=job.account_id,
+                external_ref__in=refs[i:i + LOOKUP_SIZE]).values_list('external_ref', 'id'))
+
+        # new reports are known by their ref (None until they're written),
+        # messages by the ref of their report
+        reports, messages, new = [], [], {}
+        for (number, row), c in zip(chunk, cleaned):
+            if c is None:
+                continue
+            if c[0] == 'report':
+                kind, ref, title, lat, lng = c
+                if ref in known:
+                    errors.append((number, u'report %s was already imported' % ref))
+                    continue
+                report = Report(reported_by_id=job.account_id, title=title,
+                    latitude=lat, longitude=lng, geohash=encode_geohash(lat, lng),
+                    last_activity=now, subscriber_count=1, external_ref=ref, import_job=job)
+                reports.append(report)
+                if ref:
+                    known[ref], new[ref] = None, report
+            else:
+                kind, ref, body = c
+                if ref not in known:
+                    errors.append((number, u'no report %s' % ref))
+                    continue
+                messages.append((ref, body))
+                if ref in new:
+                    new[ref].message_count += 1
+
+        last = Report.objects.filter(import_job=job).aggregate(m=Max('id'))['m'] or 0
+        Report.objects.bulk_create(reports)
+        written = list(Report.objects.filter(import_job=job, id__gt=last)
+            .values_list('id', 'external_ref'))
+        known.update((ref, r_id) for r_id, ref in written if ref)
+        ReportSubscription.objects.bulk_create([ReportSubscription(
+            account_id=job.account_id, report_id=r_id) for r_id, ref in written])
+        Message.objects.bulk_create([Message(about_report_id=known[ref],
+            written_by_id=job.account_id, message_text=body) for ref, body in messages])
+        added = defaultdict(int)
+        for ref, body in messages:
+            if ref not in new:
+                added[known[ref]] += 1
+        for r_id, n in added.items():
+            Report.objects.filter(id=r_id).update(last_activity=now, updated_on=now,
+                message_count=F('message_count') + n)
+
+        kept = job.errors.splitlines()
+        kept += [u'row %d: %s' % e for e in sorted(errors)[:max(0,
+            getattr(settings, 'IMPORT_MAX_ERRORS', 100) - len(kept))]]
+        progress = {
+            'rows_done': job.rows_done + len(chunk),
+            'rows_failed': job.rows_failed + len(errors),
+            'reports': job.reports + len(reports),
+            'messages': job.messages + len(messages),
+            'errors': u'\n'.join(kept),
+            'updated_on': now,
+        }
+        ImportJob.objects.filter(id=job.id).update(**progress)
+    for name, value in progress.items():
+        setattr(job, name, value)
+    for r_id in added:
+        fragment_cache.invalidate('report', r_id)
+    ROWS.inc('imported', len(chunk) - len(errors))
+    ROWS.inc('failed', len(errors))
+
+
+# ********* EXPORT                         *********
+
+# Every report after the id `after`, in id order, each followed by its
+# messages oldest first, as row dicts; read chunk_size reports (and their
+# messages) at a time
+def export_rows(after=0, chunk_size=1000):
+    while True:
+        reports = list(Report.objects.filter(id__gt=after).order_by('id').values_list('id',
+            'external_ref', 'title', 'latitude', 'longitude', 'reported_on')[:chunk_size])
+        if not reports:
+            return
+        messages = defaultdict(list)
+        for r_id, body, written_on in Message.objects.filter(
+                about_report__range=(reports[0][0], reports[-1][0])).order_by('id') \
+                .values_list('about_report', 'message_text', 'written_on').iterator():
+            messages[r_id].append((body, written_on))
+        for r_id, ref, title, lat, lng, reported_on in reports:
+            ref = ref or u'%d' % r_id
+            yield {'kind': 'report', 'ref': ref, 'title': title, 'latitude': lat,
+                'longitude': lng, 'date_time': reported_on.isoformat()}
+            for body, written_on in messages[r_id]:
+                yield {'kind': 'message', 'report': ref, 'text': body,
+                    'date_time': written_on.isoformat()}
+        if len(reports) < chunk_size:
+            return
+        after = reports[-1][0]
+
+# Encode rows in the format, a line (or for CSV, a record) at a time
+def format_rows(rows, fmt):
+    if fmt != 'csv':
+        for row in rows:
+            yield json.dumps(row, sort_keys=True) + '\n'
+        return
+    buf = cStringIO.StringIO()
+    writer = csv.writer(buf)
+    def record(values):
+        writer.writerow([unicode(v).encode('utf-8') for v in values])
+        line = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return line
+    yield record(COLUMNS)
+    for row in rows:
+        yield record([row.get(name, u'') for name in COLUMNS])
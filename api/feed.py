@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+import logging
+import threading
+import time
+
+from worx.models import Message
+
+logger = logging.getLogger(__name__)
+
+# Wakes up requests waiting for new messages
+# One background thread per process polls the highest message id (a single
+# index lookup) and wakes the waiters when it moves, so idle feed
+# connections cost nothing but a sleeping thread/greenlet and never touch
+# the database. Messages posted by this process wake them straight away.
+class MessageWatcher(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.latest = None
+        self.thread = None
+
+    # Highest message id currently known
+    def latest_id(self):
+        if self.latest is None:
+            self.latest = Message.objects.aggregate(top=Max('id'))['top'] or 0
+        return self.latest
+
+    # Record a message posted by this process and wake the waiters
+    def notify(self, message_id):
+        with self.cond:
+            if message_id > self.latest_id():
+                self.latest = message_id
+            self.cond.notify_all()
+
+    # Block until a message newer than seen exists (or timeout seconds pass)
+    # Returns the highest message id known on waking.
+    def wait(self, seen, timeout):
+        self.start()
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.latest_id() <= seen:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.latest_id()
+
+    def start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='message-watcher')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                top = Message.objects.aggregate(top=Max('id'))['top'] or 0
+                connection.close()
+            except Exception:
+                logger.exception('message watcher poll failed')
+                continue
+            if top > self.latest_id():
+                self.notify(top)
+
+
+watcher = MessageWatcher(getattr(settings, 'FEED_POLL_INTERVAL', 1.0))
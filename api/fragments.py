@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from collections import OrderedDict
+import random
+import threading
+import time
+
+from serializers import FORMATS
+
+# Minimal in-process LRU with the parts of Django's cache API used below
+# Entries also expire `ttl` seconds after they're set, which bounds how
+# long a change made in another process (a management command, another
+# worker) can go unseen here, as its invalidations only reach its own
+# process.
+class LocalLRU(object):
+
+    def __init__(self, size, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None and entry[0] > now:
+                    self.entries[key] = entry # move to the most recent end
+                    found[key] = entry[1]
+        return found
+
+    def set_many(self, values):
+        expires = time.time() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.entries.pop(key, None)
+                self.entries[key] = (expires, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# Cache of the serialized JSON (or other format) of individual reports and
+# messages. Entries are keyed "<kind>:<id>:<format>" and dropped when that
+# report or message changes. Each entry also records its author's generation at the time it
+# was stored; changing a profile gives the author a new generation, which
+# turns every fragment they wrote stale at once without finding them.
+class FragmentCache(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.stale = self.invalidations = 0
+
+    # Valid cached fragments for the given ids, as a dict of id -> data
+    def get(self, kind, ids, fmt='json'):
+        entries = self.backend.get_many(['%s:%d:%s' % (kind, i, fmt) for i in ids])
+        gens = self.backend.get_many(set('author:%d' % e[0] for e in entries.values()))
+        found = {}
+        for key, (author_id, gen, data) in entries.items():
+            if gens.get('author:%d' % author_id) == gen:
+                found[int(key.split(':')[1])] = data
+        with self.lock:
+            self.hits += len(found)
+            self.stale += len(entries) - len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    # Store freshly encoded fragments, given as (id, author id, data)
+    def put(self, kind, fragments, fmt='json'):
+        keys = set('author:%d' % f[1] for f in fragments)
+        gens = self.backend.get_many(keys)
+        new_gens = dict((k, '%x' % random.getrandbits(64)) for k in keys if k not in gens)
+        if new_gens:
+            self.backend.set_many(new_gens)
+            gens.update(new_gens)
+        self.backend.set_many(dict(('%s:%d:%s' % (kind, f_id, fmt), (a_id, gens['author:%d' % a_id], data))
+            for f_id, a_id, data in fragments))
+
+    # Drop the fragments for a report or message that has changed
+    def invalidate(self, kind, obj_id):
+        for fmt in FORMATS:
+            self.backend.delete('%s:%d:%s' % (kind, obj_id, fmt))
+        with self.lock:
+            self.invalidations += 1
+
+    # Turn stale everything written by an author whose profile changed
+    def invalidate_author(self, author_id):
+        self.backend.set('author:%d' % author_id, '%x' % random.getrandbits(64))
+        with self.lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+        with self.lock:
+            self.hits = self.misses = self.stale = self.invalidations = 0
+
+    # Counters for judging how well the cache is working
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'invalidations': self.invalidations,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+        if isinstance(self.backend, LocalLRU):
+            stats['size'] = len(self.backend.entries)
+            stats['max_size'] = self.backend.size
+            stats['ttl'] = self.backend.ttl
+            stats['evictions'] = self.backend.evictions
+        return stats
+
+
+# FRAGMENT_CACHE_SHARED names an entry in CACHES to use instead of the
+# in-process LRU, so that invalidations reach every worker process
+def get_backend():
+    shared = getattr(settings, 'FRAGMENT_CACHE_SHARED', None)
+    if shared:
+        return caches[shared]
+    return LocalLRU(getattr(settings, 'FRAGMENT_CACHE_SIZE', 50000),
+        getattr(settings, 'FRAGMENT_CACHE_TTL', 30))
+
+fragment_cache = FragmentCache(get_backend())
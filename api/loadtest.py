@@ -0,0 +1,307 @@
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from collections import defaultdict
+from contextlib import nested
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+
+from api.models import Session
+from api.passwords import make_password
+from api.v1 import session_hash
+from worx.blobs import blob_store
+from worx.counters import recount_reports
+from worx.geo import encode_geohash
+from worx.models import Account, Profile, Report, Message, MessageImage, ReportSubscription, \
+    thread_segment
+
+# Centres the synthetic reports cluster around, with their spread in degrees
+CLUSTERS = [
+    ('london', 51.5074, -0.1278, 0.08),
+    ('manchester', 53.4808, -2.2426, 0.05),
+    ('birmingham', 52.4862, -1.8904, 0.05),
+    ('leeds', 53.8008, -1.5491, 0.04),
+    ('glasgow', 55.8642, -4.2518, 0.04),
+]
+
+WORDS = ('pothole broken street light graffiti flooding drain blocked bin overflowing tree '
+    'fallen sign missing pavement cracked bench park bus stop shelter damaged noise dumping '
+    'rubbish leak water main road crossing').split()
+
+PASSWORD = 'loadtest'
+
+
+# ********* SYNTHETIC DATA                 *********
+
+# A small noisy PNG, different for every seed
+def synthetic_png(seed, size=24):
+    rnd = random.Random(seed)
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = ''.join('\x00' + ''.join(chr(rnd.randint(0, 255)) for x in range(size * 3))
+        for y in range(size))
+    return '\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) + \
+        chunk('IDAT', zlib.compress(rows)) + chunk('IEND', '')
+
+def _title(rnd):
+    return ' '.join(rnd.choice(WORDS) for w in range(rnd.randint(2, 6)))
+
+# Fill the database with a synthetic community: accounts with profiles and
+# sessions, reports clustered around a few city centres, threaded message
+# conversations (some with images) and subscriptions. Rows are bulk inserted,
+# so the model save() hooks are done here by hand (and reports counted after).
+# Returns a dict of the ids the workloads pick from.
+def generate(accounts=200, reports=1000, messages=10, image_ratio=0.1, seed=1):
+    rnd = random.Random(seed)
+    passphrase = make_password(PASSWORD) # one salt, hashed once, for speed
+    Account.objects.bulk_create([Account(account_key='load-%d' % i, passphrase=passphrase,
+        public_id='%064x' % rnd.getrandbits(256)) for i in range(accounts)], batch_size=500)
+    account_ids = list(Account.objects.filter(account_key__startswith='load-')
+        .order_by('id').values_list('id', flat=True))
+    Profile.objects.bulk_create([Profile(account_id=a, name='Person %d' % a)
+        for a in account_ids], batch_size=500)
+    Session.objects.bulk_create([Session(key=session_hash(), account_id=a)
+        for a in account_ids], batch_size=500)
+
+    now = timezone.now()
+    batch = []
+    for i in range(reports):
+        name, lat, lng, spread = rnd.choice(CLUSTERS)
+        lat, lng = rnd.gauss(lat, spread), rnd.gauss(lng, spread)
+        batch.append(Report(reported_by_id=rnd.choice(account_ids), title=_title(rnd),
+            latitude=lat, longitude=lng, geohash=encode_geohash(lat, lng), last_activity=now))
+    first = Report.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    Report.objects.bulk_create(batch, batch_size=500)
+    report_ids = list(Report.objects.filter(id__gt=first).order_by('id').values_list('id', flat=True))
+
+    # the author and a few others follow each report
+    subs = set()
+    for r_id, report in zip(report_ids, batch):
+        subs.add((report.reported_by_id, r_id))
+        for s in range(rnd.randint(0, 5)):
+            subs.add((rnd.choice(account_ids), r_id))
+    ReportSubscription.objects.bulk_create([ReportSubscription(account_id=a, report_id=r)
+        for a, r in subs], batch_size=500)
+
+    # messages per report vary around the mean; about 40% reply to an
+    # earlier message in the same report, making threads
+    store = blob_store()
+    images = [store.put(synthetic_png(seed * 1000 + i)) for i in range(20)]
+    first = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    next_id = first + 1
+    batch, image_batch, message_ids = [], [], []
+    for r_id in report_ids:
+        earlier, threads = [], {}
+        for m in range(int(rnd.expovariate(1.0 / messages)) if messages else 0):
+            reply = rnd.choice(earlier) if earlier and rnd.random() < 0.4 else None
+            path, depth = threads[reply] if reply else ('', -1)
+            threads[next_id] = (path + thread_segment(next_id), depth + 1)
+            batch.append(Message(id=next_id, about_report_id=r_id, reply_to_id=reply,
+                written_by_id=rnd.choice(account_ids), message_text=_title(rnd),
+                thread_path=path, thread_depth=depth + 1))
+            if rnd.random() < image_ratio:
+                blob = rnd.choice(images)
+                image_batch.append(MessageImage(on_message_id=next_id, img_blob=blob,
+                    thumb_blob=blob, large_blob=blob))
+            earlier.append(next_id)
+            message_ids.append((r_id, next_id))
+            next_id += 1
+    Message.objects.bulk_create(batch, batch_size=500)
+    MessageImage.objects.bulk_create(image_batch, batch_size=500)
+    recount_reports()
+    return {
+        'accounts': account_ids,
+        'sessions': dict(Session.objects.filter(account_id__in=account_ids)
+            .values_list('account_id', 'key')),
+        'reports': report_ids,
+        'messages': message_ids,
+        'images': images,
+    }
+
+
+# ********* WORKLOADS                      *********
+
+# Each request kind builds (method, url, data) from the generated ids
+def _report_details(data, rnd):
+    return 'GET', '/api/report/%d/' % rnd.choice(data['reports']), None
+
+def _message_list(data, rnd):
+    return 'GET', '/api/report/%d/messages/?limit=50' % rnd.choice(data['reports']), None
+
+def _message_details(data, rnd):
+    r_id, m_id = rnd.choice(data['messages'])
+    return 'GET', '/api/report/%d/message/%d/' % (r_id, m_id), None
+
+def _message_thread(data, rnd):
+    r_id, m_id = rnd.choice(data['messages'])
+    return 'GET', '/api/report/%d/message/%d/thread/' % (r_id, m_id), None
+
+def _subscribed(data, rnd):
+    return 'GET', '/api/reports/subscribed/?limit=50', None
+
+def _area_search(data, rnd):
+    name, lat, lng, spread = rnd.choice(CLUSTERS)
+    return 'GET', '/api/reports/search/area/%.4f/%.4f/%.1f/' % (lat, lng, rnd.choice([1.0, 5.0])), None
+
+def _title_search(data, rnd):
+    return 'GET', '/api/reports/search/title/%s/' % rnd.choice(WORDS), None
+
+def _post_message(data, rnd):
+    return 'POST', '/api/report/%d/messages/' % rnd.choice(data['reports']), \
+        {'message_text': _title(rnd)}
+
+def _post_image(data, rnd):
+    r_id, m_id = rnd.choice(data['messages'])
+    return 'POST', '/api/report/%d/message/%d/images/' % (r_id, m_id), \
+        {'img_data': synthetic_png(rnd.random()).encode('base64')}
+
+def _login(data, rnd):
+    return 'POST', '/api/auth/session/', {'username': 'load-%d' % rnd.randint(0, 9),
+        'password': PASSWORD}
+
+REQUESTS = {
+    'report-details': _report_details,
+    'report-messages': _message_list,
+    'message-details': _message_details,
+    'message-thread': _message_thread,
+    'subscribed-reports': _subscribed,
+    'search-area': _area_search,
+    'search-title': _title_search,
+    'post-message': _post_message,
+    'post-image': _post_image,
+    'login': _login,
+}
+
+# Workloads: request kind -> weight
+WORKLOADS = {
+    'browse': {'report-details': 20, 'report-messages': 25, 'message-details': 10,
+        'message-thread': 10, 'subscribed-reports': 15, 'search-area': 10, 'search-title': 10},
+    'mixed': {'report-details': 15, 'report-messages': 20, 'message-details': 10,
+        'message-thread': 5, 'subscribed-reports': 10, 'search-area': 8, 'search-title': 7,
+        'post-message': 15, 'post-image': 5, 'login': 5},
+    'write': {'post-message': 60, 'post-image': 20, 'login': 10, 'report-messages': 10},
+}
+
+
+# ********* RUNNER                         *********
+
+# Run a workload from `clients` threads, each a logged in account making
+# `count` requests one after another. Returns a list of (kind, seconds,
+# queries, status) for every request.
+def run(data, workload, clients=1, count=200, seed=1):
+    weights = sorted(WORKLOADS[workload].items())
+    total = float(sum(w for k, w in weights))
+    results = []
+    lock = threading.Lock()
+
+    def client(n):
+        rnd = random.Random(seed * 100 + n)
+        c = Client()
+        key = data['sessions'][data['accounts'][n % len(data['accounts'])]]
+        mine = []
+        for i in range(count):
+            pick, kind = rnd.random() * total, weights[-1][0]
+            for k, w in weights:
+                pick -= w
+                if pick < 0:
+                    kind = k
+                    break
+            method, url, body = REQUESTS[kind](data, rnd)
+            # queries on every alias, reads may go to replicas
+            captured = [CaptureQueriesContext(conn) for conn in connections.all()]
+            with nested(*captured):
+                start = time.time()
+                try:
+                    if method == 'GET':
+                        response = c.get(url, HTTP_X_CWX_SESSION_KEY=key)
+                    else:
+                        response = c.post(url, body or {}, HTTP_X_CWX_SESSION_KEY=key)
+                    if response.streaming:
+                        ''.join(response.streaming_content)
+                    status = response.status_code
+                except Exception:
+                    # the test client re-raises what the view raised, e.g.
+                    # "database is locked" with several clients writing
+                    status = 500
+                took = time.time() - start
+            mine.append((kind, took, sum(len(c.captured_queries) for c in captured), status))
+            close_old_connections()
+        for conn in connections.all():
+            conn.close()
+        with lock:
+            results.extend(mine)
+
+    if clients == 1:
+        client(0) # on this thread, e.g. inside a transaction
+    else:
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return results
+
+# Nearest rank percentile of sorted values
+def percentile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+# Summarize results per request kind (and '*' for all of them)
+# `elapsed` is the wall time of the whole run, for throughput.
+def summarize(results, elapsed):
+    kinds = defaultdict(list)
+    for r in results:
+        kinds[r[0]].append(r)
+        kinds['*'].append(r)
+    summary = {}
+    for kind, rows in kinds.items():
+        times = sorted(r[1] for r in rows)
+        summary[kind] = {
+            'requests': len(rows),
+            'per_second': len(rows) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(times, 0.50) * 1000,
+            'p95_ms': percentile(times, 0.95) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+            'queries': float(sum(r[2] for r in rows)) / len(rows),
+            'errors': sum(1 for r in rows if r[3] >= 400),
+        }
+    return summary
+
+# Compare a summary with a baseline one, returning a list of
+# (kind, measure, baseline, now, regressed)
+# Latency (p50 and p95; p99 is too noisy over a few hundred requests)
+# regresses by exceeding the baseline by more than `tolerance` (a fraction);
+# query counts and errors by going up at all.
+def compare(summary, baseline, tolerance=0.5):
+    rows = []
+    for kind in sorted(summary):
+        if kind not in baseline:
+            continue
+        for measure in ('p50_ms', 'p95_ms', 'queries', 'errors'):
+            was, now = baseline[kind][measure], summary[kind][measure]
+            if measure.endswith('_ms'):
+                regressed = now > was * (1 + tolerance)
+            else:
+                regressed = now > was + 1e-9
+            rows.append((kind, measure, was, now, regressed))
+    return rows
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(path, workload, summary):
+    baselines = load_baseline(path) if os.path.exists(path) else {}
+    baselines[workload] = dict((kind, dict((k, round(v, 2) if isinstance(v, float) else v)
+        for k, v in s.items()))
+        for kind, s in summary.items())
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
@@ -0,0 +1,71 @@
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import serializers
+from api.v1 import encode_report, encode_message, with_report_details, with_message_details
+from worx.models import Account, Profile, Report, Message, MessageImage
+
+
+class Command(BaseCommand):
+    args = '<list length> [...]'
+    help = 'Benchmark encode time and payload size of JSON against MessagePack for report ' \
+        'and message lists, and for a single image. Synthetic data is written inside a ' \
+        'transaction that is rolled back.'
+
+    REPEAT = 20
+    AUTHORS = 20
+    IMAGE_SIZE = 200 * 1024
+
+    def handle(self, *args, **options):
+        sizes = [int(a) for a in args] or [50, 200]
+        self.stdout.write('%10s %10s %10s %12s %12s %10s' % ('payload', 'items', 'format',
+            'encode ms', 'bytes', 'vs json'))
+        for size in sizes:
+            with transaction.atomic():
+                self.run_size(size)
+                transaction.set_rollback(True)
+        # an image as message_image sends it: base64 in JSON, raw in MessagePack
+        image = {'id': 1, 'blob': '%064x' % 1, 'url': '/api/blob/%064x/' % 1,
+            'data': serializers.Binary(os.urandom(self.IMAGE_SIZE))}
+        self.measure('image', 1, image)
+
+    def run_size(self, size):
+        rnd = random.Random(size)
+        authors = []
+        for i in range(self.AUTHORS):
+            account = Account.objects.create(account_key='bench-fmt-%d' % i, passphrase='')
+            Profile.objects.create(account=account, name='Author %d' % i, img_blob='%064x' % i)
+            authors.append(account)
+        reports = []
+        for i in range(size):
+            report = Report(reported_by=rnd.choice(authors), title='Broken street light %d' % i,
+                latitude=rnd.uniform(-60, 60), longitude=rnd.uniform(-180, 180))
+            report.save()
+            reports.append(report)
+        for i in range(size):
+            msg = Message.objects.create(about_report=reports[0], written_by=rnd.choice(authors),
+                message_text='message %d ' % i * rnd.randint(1, 10))
+            for j in range(rnd.randint(0, 2)):
+                MessageImage.objects.create(on_message=msg, img_blob='%064x' % rnd.getrandbits(128))
+
+        r_list = [encode_report(r) for r in
+            with_report_details(Report.objects.filter(id__in=[r.id for r in reports]))]
+        m_list = [encode_message(m) for m in
+            with_message_details(Message.objects.filter(about_report=reports[0]))]
+        self.measure('reports', size, r_list)
+        self.measure('messages', size, m_list)
+
+    def measure(self, name, items, data):
+        sizes = {}
+        for fmt in ('json', 'msgpack'):
+            start = time.time()
+            for r in range(self.REPEAT):
+                body = serializers.dumps(fmt, data)
+            took = (time.time() - start) * 1000 / self.REPEAT
+            sizes[fmt] = len(body)
+            self.stdout.write('%10s %10d %10s %12.3f %12d %9.0f%%' % (name, items, fmt, took,
+                len(body), 100.0 * len(body) / sizes['json']))
@@ -0,0 +1,64 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from api.fragments import fragment_cache
+from api.models import Session
+from worx.models import Account, Profile, Report, Message, MessageImage
+
+
+class Command(BaseCommand):
+    args = '<messages per report> [...]'
+    help = 'Benchmark message list latency with the JSON fragment cache cold and warm. ' \
+        'Synthetic data is written inside a transaction that is rolled back.'
+
+    REPEAT = 20
+    AUTHORS = 50
+
+    def handle(self, *args, **options):
+        sizes = [int(a) for a in args] or [50, 200]
+        self.stdout.write('%10s %12s %12s %10s' % ('messages', 'cold ms', 'warm ms', 'hit rate'))
+        for size in sizes:
+            with transaction.atomic():
+                self.run_size(size)
+                transaction.set_rollback(True)
+
+    def run_size(self, size):
+        rnd = random.Random(size)
+        authors = []
+        for i in range(self.AUTHORS):
+            account = Account.objects.create(account_key='bench-frag-%d' % i, passphrase='')
+            Profile.objects.create(account=account, name='Author %d' % i, img_blob='%064x' % i)
+            authors.append(account)
+        session = Session.objects.create(key='%064x' % rnd.getrandbits(128), account=authors[0])
+        report = Report(reported_by=authors[0], title='bench', latitude=0, longitude=0)
+        report.save()
+        for i in range(size):
+            msg = Message.objects.create(about_report=report, written_by=rnd.choice(authors),
+                message_text='message %d ' % i * rnd.randint(1, 10))
+            for j in range(rnd.randint(0, 2)):
+                MessageImage.objects.create(on_message=msg, img_blob='%064x' % rnd.getrandbits(128))
+
+        client = Client()
+        url = '/api/report/%d/messages/?limit=%d' % (report.id, size)
+        def fetch():
+            response = client.get(url, HTTP_X_CWX_SESSION_KEY=session.key)
+            return ''.join(response.streaming_content)
+
+        start = time.time()
+        for r in range(self.REPEAT):
+            fragment_cache.clear()
+            fetch()
+        cold = (time.time() - start) * 1000 / self.REPEAT
+
+        fragment_cache.clear()
+        fetch()
+        start = time.time()
+        for r in range(self.REPEAT):
+            fetch()
+        warm = (time.time() - start) * 1000 / self.REPEAT
+        self.stdout.write('%10d %12.3f %12.3f %10.2f' % (size, cold, warm,
+            fragment_cache.stats()['hit_rate']))
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from api import thumbnails
+from api.fragments import fragment_cache
+from api.models import Session
+from worx import images
+from worx.blobs import blob_store
+from worx.models import Account, Profile, Report, MessageImage
+
+
+# A PNG of random noise (so it doesn't compress away) of the given size
+def noise_png(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = ''.join('\x00' + os.urandom(width * 3) for y in range(height))
+    return '\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk('IDAT', zlib.compress(rows)) + chunk('IEND', '')
+
+
+class Command(BaseCommand):
+    args = '<image width> [...]'
+    help = 'Benchmark message upload latency with image variants made inline and off the ' \
+        'request thread, and the bytes a message list makes clients download. Synthetic ' \
+        'data is written inside a transaction that is rolled back.'
+
+    REPEAT = 10
+    LIST_SIZE = 50
+
+    def handle(self, *args, **options):
+        widths = [int(a) for a in args] or [640, 2048]
+        if images.Image is None:
+            self.stdout.write('Pillow is not installed: no variants are made, originals are used')
+        self.stdout.write('%8s %10s %12s %12s %10s %12s %12s %12s' % ('width', 'upload KB',
+            'inline ms', 'deferred ms', 'job ms', 'list bytes', 'thumbs KB', 'originals KB'))
+        blob_root = tempfile.mkdtemp()
+        try:
+            with override_settings(BLOB_ROOT=blob_root):
+                for width in widths:
+                    with transaction.atomic():
+                        self.run_width(width)
+                        transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(blob_root)
+
+    def run_width(self, width):
+        account = Account.objects.create(account_key='bench-images', passphrase='')
+        Profile.objects.create(account=account, name='Bench')
+        session = Session.objects.create(key='%064x' % width, account=account)
+        report = Report(reported_by=account, title='bench', latitude=0, longitude=0)
+        report.save()
+        client = Client()
+        url = '/api/report/%d/messages/' % report.id
+        uploads = [noise_png(width, width * 3 / 4) for r in range(self.REPEAT)]
+
+        def post(data):
+            response = client.post(url, {'message_text': 'photo', 'img_data': data.encode('base64')},
+                HTTP_X_CWX_SESSION_KEY=session.key)
+            assert response.status_code == 302, response.content
+
+        # variants made on the request thread
+        with override_settings(IMAGE_PIPELINE_THREADS=0):
+            start = time.time()
+            for data in uploads:
+                post(data)
+            inline = (time.time() - start) * 1000 / self.REPEAT
+
+        # only queued on the request thread; the jobs are then run (and
+        # timed) separately, as the pipeline's threads would
+        queued = []
+        submit, thumbnails.pipeline.submit = thumbnails.pipeline.submit, \
+            lambda job, *args: queued.append((job, args))
+        try:
+            start = time.time()
+            for data in uploads:
+                post(data)
+            deferred = (time.time() - start) * 1000 / self.REPEAT
+        finally:
+            thumbnails.pipeline.submit = submit
+        start = time.time()
+        for job, args in queued:
+            job(*args)
+        job_time = (time.time() - start) * 1000 / max(len(queued), 1)
+
+        # a list page, and what fetching the images it references costs
+        with override_settings(IMAGE_PIPELINE_THREADS=0):
+            for r in range(self.LIST_SIZE - 2 * self.REPEAT):
+                post(uploads[r % self.REPEAT])
+        fragment_cache.clear()
+        response = client.get(url + '?limit=%d' % self.LIST_SIZE, HTTP_X_CWX_SESSION_KEY=session.key)
+        body = ''.join(response.streaming_content)
+        store = blob_store()
+        thumbs = originals = 0
+        for message in json.loads(body):
+            for image in message['images']:
+                thumbs += store.size(image['thumb_url'].rstrip('/').split('/')[-1])
+                originals += store.size(MessageImage.objects.get(id=image['id']).img_blob)
+        self.stdout.write('%8d %10.1f %12.3f %12.3f %10.3f %12d %12.1f %12.1f' % (width,
+            len(uploads[0]) / 1024.0, inline, deferred, job_time, len(body),
+            thumbs / 1024.0, originals / 1024.0))
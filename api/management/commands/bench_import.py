@@ -0,0 +1,102 @@
+import io
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from api import bulk
+from api.models import ImportJob, Session
+from worx.db import temporary_database
+from worx.models import Account, Profile
+
+WORDS = ('pothole', 'streetlight', 'graffiti', 'bin', 'bench', 'flooding', 'crossing',
+    'broken', 'missing', 'overflowing', 'park', 'road', 'bridge', 'library')
+
+
+class Command(BaseCommand):
+    args = '<chunk size> [...]'
+    help = 'Benchmark rows per second of bulk importing synthetic reports and messages ' \
+        'as NDJSON and CSV at each chunk size, through the import function and the ' \
+        'endpoint, against posting them one at a time through the API, and of ' \
+        'exporting them again. Each run is on a fresh temporary database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--reports', type='int', default=10000),
+        make_option('--messages', type='int', default=4, help='Messages per report'),
+        make_option('--posted', type='int', default=200,
+            help='Reports posted one at a time, for comparison'),
+    )
+
+    SESSION = 'b' * 64
+
+    def handle(self, *args, **options):
+        chunks = [int(a) for a in args] or [100, 1000, 5000]
+        rows = list(self.rows(options['reports'], options['messages']))
+        files = dict((fmt, ''.join(bulk.format_rows(rows, fmt))) for fmt in bulk.CONTENT_TYPES)
+        self.stdout.write('%d rows: %s' % (len(rows), ', '.join('%s %.1f MB' % (fmt,
+            len(data) / 1e6) for fmt, data in sorted(files.items()))))
+        self.stdout.write('%10s %8s %7s %10s %10s' % ('how', 'format', 'chunk', 'seconds',
+            'rows/s'))
+
+        with override_settings(RATE_LIMIT_ENABLED=False, ADMIN_ACCOUNTS=['bench-import']):
+            with temporary_database():
+                self.posted(rows, options['posted'], options['messages'])
+            for chunk in chunks:
+                for fmt in sorted(files):
+                    with temporary_database():
+                        job = ImportJob.objects.create(account=self.account(), format=fmt)
+                        start = time.time()
+                        bulk.run_import(job, io.BytesIO(files[fmt]), chunk)
+                        self.report('function', fmt, chunk, len(rows), time.time() - start)
+                        if fmt == 'ndjson' and chunk == chunks[-1]:
+                            start = time.time()
+                            exported = sum(1 for row in bulk.export_rows())
+                            self.report('export', fmt, '', exported, time.time() - start)
+                with override_settings(IMPORT_CHUNK_SIZE=chunk):
+                    with temporary_database():
+                        self.account()
+                        start = time.time()
+                        response = Client().post('/api/reports/import/', files['ndjson'],
+                            content_type='application/x-ndjson',
+                            HTTP_X_CWX_SESSION_KEY=self.SESSION)
+                        assert response.status_code == 200, response.content
+                        self.report('endpoint', 'ndjson', chunk, len(rows), time.time() - start)
+
+    def account(self):
+        account = Account.objects.create(account_key='bench-import', passphrase='')
+        Profile.objects.create(account=account, name='Bench')
+        Session.objects.create(key=self.SESSION, account=account)
+        return account
+
+    def report(self, how, fmt, chunk, rows, seconds):
+        self.stdout.write('%10s %8s %7s %10.2f %10.0f' % (how, fmt, chunk, seconds,
+            rows / seconds))
+
+    # each report followed by its messages
+    def rows(self, reports, messages):
+        rnd = random.Random(1)
+        for i in range(reports):
+            ref = 'partner-%d' % i
+            yield {'kind': 'report', 'ref': ref, 'title': ' '.join(rnd.sample(WORDS, 3)),
+                'latitude': round(rnd.uniform(51.3, 51.7), 6),
+                'longitude': round(rnd.uniform(-0.5, 0.3), 6)}
+            for m in range(messages):
+                yield {'kind': 'message', 'report': ref, 'text': ' '.join(rnd.sample(WORDS, 6))}
+
+    # the same rows, a request each, for the first `reports` reports
+    def posted(self, rows, reports, messages):
+        self.account()
+        c = Client()
+        count, start = 0, time.time()
+        for row in rows[:reports * (messages + 1)]:
+            if row['kind'] == 'report':
+                response = c.post('/api/reports/', {'title': row['title'],
+                    'latitude': row['latitude'], 'longitude': row['longitude']},
+                    HTTP_X_CWX_SESSION_KEY=self.SESSION)
+                url = response['Location'] + 'messages/'
+            else:
+                c.post(url, {'message_text': row['text']}, HTTP_X_CWX_SESSION_KEY=self.SESSION)
+            count += 1
+        self.report('per row', 'post', '', count, time.time() - start)
@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from api import passwords
+from api.models import Session
+from worx.db import temporary_database
+from worx.models import Account, Profile, Report
+
+
+class Command(BaseCommand):
+    args = '<iterations> [...]'
+    help = 'Benchmark password hashing: the time of one hash at each work factor, then ' \
+        'login throughput through the API with concurrent clients, and the latency of ' \
+        'other requests served meanwhile, with hashing inline and on the hashing pool. ' \
+        'Runs on a fresh temporary database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--clients', type='int', default=8, help='Concurrent clients logging in'),
+        make_option('--seconds', type='float', default=5.0, help='Run time per configuration'),
+    )
+
+    PASSWORD = 'bench-password'
+
+    def handle(self, *args, **options):
+        factors = [int(a) for a in args] or [passwords.work_factor()]
+        self.stdout.write('%10s %10s' % ('iterations', 'hash ms'))
+        for iterations in sorted(set(factors + [10000, 100000, 600000])):
+            start = time.time()
+            for i in range(3):
+                passwords.make_password(self.PASSWORD, iterations=iterations)
+            self.stdout.write('%10d %10.1f' % (iterations, (time.time() - start) / 3 * 1000))
+
+        self.stdout.write('\n%10s %8s %8s %9s %9s %9s %6s %10s %10s' % ('iterations',
+            'hashers', 'clients', 'logins/s', 'p50 ms', 'p95 ms', '503s', 'other p50',
+            'other p95'))
+        for iterations in factors:
+            for hashers in (0, 1, 2, 4):
+                # no rate limits, as every client logs in from one address
+                with override_settings(PASSWORD_ITERATIONS=iterations,
+                        PASSWORD_HASH_THREADS=hashers, RATE_LIMIT_ENABLED=False):
+                    with temporary_database():
+                        self.run(iterations, hashers, options['clients'], options['seconds'])
+
+    def run(self, iterations, hashers, clients, seconds):
+        account = Account.objects.create(account_key='bench-passwords',
+            passphrase=passwords.make_password(self.PASSWORD))
+        Profile.objects.create(account=account, name='Bench')
+        session = Session.objects.create(key='%064x' % random.getrandbits(128), account=account)
+        report = Report(reported_by=account, title='bench', latitude=0, longitude=0)
+        report.save()
+        close_old_connections()
+        logins, others = [], []
+        lock = threading.Lock()
+        deadline = time.time() + seconds
+
+        # log in as fast as possible
+        def login():
+            c = Client()
+            mine = []
+            while time.time() < deadline:
+                start = time.time()
+                response = c.post('/api/auth/session/', {'username': 'bench-passwords',
+                    'password': self.PASSWORD})
+                close_old_connections()
+                mine.append((time.time() - start, response.status_code))
+            for conn in connections.all():
+                conn.close()
+            with lock:
+                logins.extend(mine)
+
+        # meanwhile, a client reading a report a few times a second
+        def other():
+            c = Client()
+            while time.time() < deadline:
+                start = time.time()
+                c.get('/api/report/%d/' % report.id, HTTP_X_CWX_SESSION_KEY=session.key)
+                close_old_connections()
+                others.append(time.time() - start)
+                time.sleep(0.05)
+            for conn in connections.all():
+                conn.close()
+
+        threads = [threading.Thread(target=login) for i in range(clients)] + \
+            [threading.Thread(target=other)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        ok = sorted(r[0] for r in logins if r[1] == 302)
+        others.sort()
+        pick = lambda values, q: values[min(int(q * len(values)), len(values) - 1)] * 1000 \
+            if values else 0.0
+        self.stdout.write('%10d %8s %8d %9.1f %9.1f %9.1f %6d %10.1f %10.1f' % (iterations,
+            hashers or 'inline', clients, len(ok) / seconds, pick(ok, 0.5), pick(ok, 0.95),
+            sum(1 for r in logins if r[1] == 503), pick(others, 0.5), pick(others, 0.95)))
@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from api import bulk
+
+
+class Command(BaseCommand):
+    help = 'Export every report and its messages as NDJSON or CSV, in the form ' \
+        'import_reports takes, streamed a chunk of reports at a time.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=sorted(bulk.CONTENT_TYPES), default='ndjson'),
+        make_option('--after', type='int', default=0, help='Only reports after this id'),
+        make_option('--output', help='File to write (default stdout)'),
+    )
+
+    def handle(self, *args, **options):
+        lines = bulk.format_rows(bulk.export_rows(after=options['after']), options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'wb') as out:
+            for line in lines:
+                out.write(line)
@@ -0,0 +1,51 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from api import bulk
+from api.models import ImportJob
+from worx.models import Account
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Bulk import reports and messages from an NDJSON or CSV file ("-" for stdin), ' \
+        'by the given account, a chunk of rows per transaction. If the import fails part ' \
+        'way, run it again with --job to carry on after the rows already written.'
+    option_list = BaseCommand.option_list + (
+        make_option('--account', help='Account key of the author'),
+        make_option('--format', choices=sorted(bulk.CONTENT_TYPES),
+            help='ndjson or csv (default from the file name)'),
+        make_option('--job', type='int', help='Resume this import job'),
+        make_option('--chunk', type='int', help='Rows per transaction'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the file to import')
+        if options['job']:
+            try:
+                job = ImportJob.objects.get(id=options['job'])
+            except ImportJob.DoesNotExist:
+                raise CommandError('No import job %d' % options['job'])
+        else:
+            try:
+                account = Account.objects.filter(account_key=options['account']).get()
+            except (Account.DoesNotExist, Account.MultipleObjectsReturned):
+                raise CommandError('Give the account key of one account with --account')
+            fmt = options['format'] or ('csv' if args[0].endswith('.csv') else 'ndjson')
+            job = ImportJob.objects.create(account=account, format=fmt)
+        source = sys.stdin if args[0] == '-' else open(args[0], 'rb')
+        try:
+            bulk.run_import(job, source, options['chunk'])
+        except DatabaseError as e:
+            raise CommandError('Import job %d failed after %d rows (%s); resume with --job %d' %
+                (job.id, job.rows_done, e, job.id))
+        finally:
+            source.close()
+        self.stdout.write('Import job %d: %d rows, %d reports, %d messages, %d invalid rows' % (
+            job.id, job.rows_done, job.reports, job.messages, job.rows_failed))
+        for error in job.errors.splitlines():
+            self.stdout.write('  ' + error)
@@ -0,0 +1,86 @@
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api import loadtest
+from worx.db import temporary_database
+
+
+class Command(BaseCommand):
+    args = '[<workload> ...]'
+    help = 'Load test the API: generate a synthetic community in a fresh temporary ' \
+        'database, run scripted workloads (%s) against the real endpoints through the ' \
+        'test client and report latency percentiles, throughput and queries per endpoint. ' \
+        'Optionally save the results as a baseline or compare them with one.' % \
+        ', '.join(sorted(loadtest.WORKLOADS))
+    option_list = BaseCommand.option_list + (
+        make_option('--accounts', type='int', default=200),
+        make_option('--reports', type='int', default=1000),
+        make_option('--messages', type='int', default=10, help='Mean messages per report'),
+        make_option('--clients', type='int', default=1, help='Concurrent clients'),
+        make_option('--requests', type='int', default=300, help='Requests per client'),
+        make_option('--seed', type='int', default=1),
+        make_option('--baseline', help='Compare with the baselines in this file'),
+        make_option('--save-baseline', help='Save the results as baselines in this file'),
+        make_option('--tolerance', type='float', default=0.5,
+            help='Latency increase over the baseline counted as a regression'),
+    )
+
+    def handle(self, *args, **options):
+        workloads = args or ['browse', 'mixed']
+        for w in workloads:
+            if w not in loadtest.WORKLOADS:
+                raise CommandError('Unknown workload %r' % w)
+        baselines = loadtest.load_baseline(options['baseline']) if options['baseline'] else {}
+        blob_root = tempfile.mkdtemp()
+        regressions = []
+        try:
+            # image variants inline, so the measured requests include them,
+            # and no rate limits, as every client logs in from one address
+            with override_settings(BLOB_ROOT=blob_root, IMAGE_PIPELINE_THREADS=0,
+                    RATE_LIMIT_ENABLED=False):
+                with temporary_database():
+                    start = time.time()
+                    data = loadtest.generate(options['accounts'], options['reports'],
+                        options['messages'], seed=options['seed'])
+                    self.stdout.write('Generated %d accounts, %d reports, %d messages in %.1fs' % (
+                        len(data['accounts']), len(data['reports']), len(data['messages']),
+                        time.time() - start))
+                    for workload in workloads:
+                        regressions += self.run_workload(workload, data, baselines, options)
+        finally:
+            shutil.rmtree(blob_root)
+        if regressions:
+            raise CommandError('%d regressions against the baseline:\n%s' % (len(regressions),
+                '\n'.join('  %s %s %s: %.2f -> %.2f' % r for r in regressions)))
+
+    def run_workload(self, workload, data, baselines, options):
+        start = time.time()
+        results = loadtest.run(data, workload, options['clients'], options['requests'],
+            options['seed'])
+        summary = loadtest.summarize(results, time.time() - start)
+
+        self.stdout.write('\n%s: %d clients x %d requests' % (workload, options['clients'],
+            options['requests']))
+        self.stdout.write('%20s %8s %8s %9s %9s %9s %8s %7s' % ('endpoint', 'requests',
+            'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors'))
+        for kind in sorted(summary, key=lambda k: (k == '*', k)):
+            s = summary[kind]
+            self.stdout.write('%20s %8d %8.1f %9.2f %9.2f %9.2f %8.1f %7d' % (
+                'all' if kind == '*' else kind, s['requests'], s['per_second'], s['p50_ms'],
+                s['p95_ms'], s['p99_ms'], s['queries'], s['errors']))
+
+        if options['save_baseline']:
+            loadtest.save_baseline(options['save_baseline'], workload, summary)
+        regressions = []
+        if workload in baselines:
+            for kind, measure, was, now, regressed in loadtest.compare(summary,
+                    baselines[workload], options['tolerance']):
+                if regressed:
+                    regressions.append((workload, kind, measure, was, now))
+            self.stdout.write('%d regressions against the baseline' % len(regressions))
+        return regressions
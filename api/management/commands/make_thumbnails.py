@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api import thumbnails
+from worx.models import MessageImage, Profile
+
+
+class Command(BaseCommand):
+    help = 'Make any missing thumbnail and capped resolution image variants, e.g. for ' \
+        'images uploaded before variants existed or whose job was lost with its process.'
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        jobs = [(thumbnails.message_image_variants, i) for i in
+            MessageImage.objects.filter(thumb_blob='').values_list('id', flat=True)]
+        jobs += [(thumbnails.profile_variants, a) for a in Profile.objects.filter(thumb_blob='')
+            .exclude(img_blob='').values_list('account_id', flat=True)]
+        for job, arg in jobs:
+            try:
+                job(arg)
+                done += 1
+            except Exception as e:
+                self.stderr.write('%s(%d) failed: %s' % (job.__name__, arg, e))
+                failed += 1
+        self.stdout.write('%d images processed, %d failed' % (done, failed))
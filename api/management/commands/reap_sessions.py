@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from optparse import make_option
+import time
+
+from api.session_cache import reap_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in batches, once or every --interval seconds.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch', type='int', dest='batch', default=1000,
+            help='Sessions deleted per statement'),
+        make_option('--pause', type='float', dest='pause', default=0.1,
+            help='Seconds to wait between batches, letting other writers in'),
+        make_option('--interval', type='float', dest='interval', default=3600.0,
+            help='Seconds between passes over the session table'),
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='Reap once and exit'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                reaped = reap_expired(options['batch'], options['pause'])
+            except Exception as e:
+                self.stderr.write('session reaping failed: %s' % e)
+                reaped = 0
+            if reaped or options['once']:
+                self.stdout.write('reaped %d expired sessions' % reaped)
+            if options['once']:
+                return
+            connection.close() # don't hold it while sleeping
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+
+from worx.counters import recount_reports
+
+
+class Command(BaseCommand):
+    help = 'Recount the message, image and subscriber counts (and latest activity) of ' \
+        'every report, correcting any that have drifted, e.g. after rows were deleted ' \
+        'or bulk loaded. Web workers show the new counts once their cached fragments ' \
+        'expire (FRAGMENT_CACHE_TTL).'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch', type='int', dest='batch', default=1000,
+            help='Reports recounted per transaction'),
+    )
+
+    def handle(self, *args, **options):
+        checked, corrected = recount_reports(options['batch'])
+        self.stdout.write('%d reports checked, %d corrected' % (checked, len(corrected)))
@@ -0,0 +1,161 @@
+from collections import defaultdict
+import bisect
+import threading
+import time
+
+# Default upper bounds of histogram buckets, by what they measure
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# A Prometheus style histogram: per label set, the count of observations
+# at or below each bucket bound, plus their count and sum
+class Histogram(object):
+
+    def __init__(self, name, doc, buckets, labels=()):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {} # label values -> [bucket counts..., count, sum]
+
+    def observe(self, value, *label_values):
+        pos = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i in range(pos, len(self.buckets)):
+                series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            items = sorted(self.series.items())
+        for label_values, series in items:
+            labels = _labels(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                lines.append('%s_bucket{%s} %d' % (self.name,
+                    _join(labels, 'le="%s"' % _number(bound)), count))
+            lines.append('%s_bucket{%s} %d' % (self.name, _join(labels, 'le="+Inf"'), series[-2]))
+            lines.append('%s_count%s %d' % (self.name, _braced(labels), series[-2]))
+            lines.append('%s_sum%s %s' % (self.name, _braced(labels), _number(series[-1])))
+        return lines
+
+# A Prometheus style counter, per label set
+class Counter(object):
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = defaultdict(float)
+
+    def inc(self, *label_values, **kwargs):
+        with self.lock:
+            self.series[label_values] += kwargs.get('by', 1)
+
+    def value(self, *label_values):
+        with self.lock:
+            return self.series.get(label_values, 0)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s counter' % self.name]
+        with self.lock:
+            items = sorted(self.series.items())
+        for label_values, value in items:
+            lines.append('%s%s %s' % (self.name, _braced(_labels(self.labels, label_values)),
+                _number(value)))
+        return lines
+
+# A gauge read from a function when the metrics are rendered
+class Gauge(object):
+
+    def __init__(self, name, doc, read):
+        self.name = name
+        self.doc = doc
+        self.read = read
+
+    def render(self):
+        return ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s gauge' % self.name,
+            '%s %s' % (self.name, _number(self.read()))]
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (n, unicode(v).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')) for n, v in zip(names, values))
+
+def _join(*parts):
+    return ','.join(p for p in parts if p)
+
+def _braced(labels):
+    return '{%s}' % labels if labels else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and value != int(value) else \
+        '%d' % value
+
+
+# Every metric of this process, by name
+class Registry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, doc, buckets=SECONDS_BUCKETS, labels=()):
+        return self.add(Histogram(name, doc, buckets, labels))
+
+    def counter(self, name, doc, labels=()):
+        return self.add(Counter(name, doc, labels))
+
+    def gauge(self, name, doc, read):
+        return self.add(Gauge(name, doc, read))
+
+    # Everything in the Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+
+# Time spent on parts of the current request (e.g. serializing), added to by
+# the code doing them and read by the instrumentation middleware
+_request = threading.local()
+
+def start_request():
+    _request.timings = defaultdict(float)
+
+def end_request():
+    timings = getattr(_request, 'timings', None)
+    _request.timings = None
+    return timings or {}
+
+def track(kind, seconds):
+    timings = getattr(_request, 'timings', None)
+    if timings is not None:
+        timings[kind] += seconds
+
+# Context manager timing a block of the current request
+class timed(object):
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        track(self.kind, time.time() - self.start)
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.db import connections
+
+import logging
+import random
+import time
+
+import metrics
+import ratelimit
+
+slow_logger = logging.getLogger('api.slow')
+
+REQUEST_SECONDS = metrics.registry.histogram('cwx_request_seconds',
+    'Wall time of requests, to the last byte sent', labels=('view',))
+DB_QUERIES = metrics.registry.histogram('cwx_db_queries',
+    'Database queries run per request', metrics.COUNT_BUCKETS, labels=('view',))
+DB_SECONDS = metrics.registry.histogram('cwx_db_seconds',
+    'Time per request spent in database queries', labels=('view',))
+SERIALIZE_SECONDS = metrics.registry.histogram('cwx_serialize_seconds',
+    'Time per request spent serializing responses', labels=('view',))
+RESPONSE_BYTES = metrics.registry.histogram('cwx_response_bytes',
+    'Size of response bodies', metrics.BYTES_BUCKETS, labels=('view',))
+REQUESTS = metrics.registry.counter('cwx_requests_total',
+    'Requests answered, by view and status', labels=('view', 'status'))
+SLOW_REQUESTS = metrics.registry.counter('cwx_slow_requests_total',
+    'Requests slower than METRICS_SLOW_REQUEST_SECONDS', labels=('view',))
+
+# Records the time, database queries, serialization time and response size
+# of every request into histograms per view (see api/metrics.py). Streamed
+# responses are measured when their last chunk has been sent. A sample of
+# requests slower than METRICS_SLOW_REQUEST_SECONDS have their queries
+# logged to "api.slow". Should come first in MIDDLEWARE_CLASSES.
+class InstrumentationMiddleware(object):
+
+    def process_request(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return
+        # query logging is normally only on with DEBUG
+        state = {'start': time.time(), 'view': 'unresolved', 'queries': {}, 'debug': {}}
+        for conn in connections.all():
+            state['debug'][conn.alias] = conn.use_debug_cursor
+            state['queries'][conn.alias] = len(conn.queries)
+            conn.use_debug_cursor = True
+        request.cwx_metrics = state
+        metrics.start_request()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = getattr(request, 'cwx_metrics', None)
+        if state is not None:
+            match = getattr(request, 'resolver_match', None)
+            state['view'] = (match.url_name if match else None) or view_func.__name__
+
+    def process_response(self, request, response):
+        state = getattr(request, 'cwx_metrics', None)
+        if state is None:
+            return response
+        del request.cwx_metrics
+        if not response.streaming:
+            self.finish(request, state, response.status_code, len(response.content))
+            return response
+        def measured(content):
+            sent = 0
+            try:
+                for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                self.finish(request, state, response.status_code, sent)
+        response.streaming_content = measured(response.streaming_content)
+        return response
+
+    def finish(self, request, state, status, sent):
+        elapsed = time.time() - state['start']
+        queries = []
+        for alias, start in state['queries'].items():
+            conn = connections[alias]
+            queries.extend(conn.queries[start:])
+            conn.use_debug_cursor = state['debug'][alias]
+        timings = metrics.end_request()
+        view = state['view']
+        REQUEST_SECONDS.observe(elapsed, view)
+        DB_QUERIES.observe(len(queries), view)
+        DB_SECONDS.observe(sum(float(q['time']) for q in queries), view)
+        SERIALIZE_SECONDS.observe(timings.get('serialize', 0.0), view)
+        RESPONSE_BYTES.observe(sent, view)
+        REQUESTS.inc(view, status)
+        if elapsed >= getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1.0):
+            SLOW_REQUESTS.inc(view)
+            if random.random() < getattr(settings, 'METRICS_SLOW_SAMPLE_RATE', 0.0):
+                slow_logger.warning('slow request %s %s (%s) took %.3fs, %d queries:\n%s',
+                    request.method, request.path, view, elapsed, len(queries),
+                    '\n'.join('  %ss %s' % (q['time'], q['sql']) for q in queries))
+
+
+# Applies the "session" rate limit to every request made with a session
+# key, before the view (or the session lookup) touches the database. Login
+# and sign up are limited by address and account in their views.
+class RateLimitMiddleware(object):
+
+    def process_request(self, request):
+        key = request.META.get('HTTP_X_CWX_SESSION_KEY', None)
+        if key is not None:
+            return ratelimit.check(('session', key[:64]))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+import api.models
+
+
+# Existing sessions get a full SESSION_TTL from when this runs
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_auto_20141009_0330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='expires_on',
+            field=models.DateTimeField(default=api.models.session_expiry, db_index=True),
+            preserve_default=True,
+        ),
+    ]
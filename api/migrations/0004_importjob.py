@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0014_report_external_ref'),
+        ('api', '0003_session_expires_on'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('format', models.CharField(max_length=10)),
+                ('started_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('rows_done', models.PositiveIntegerField(default=0)),
+                ('rows_failed', models.PositiveIntegerField(default=0)),
+                ('reports', models.PositiveIntegerField(default=0)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('errors', models.TextField(blank=True)),
+                ('finished', models.BooleanField(default=False)),
+                ('account', models.ForeignKey(related_name='+', to='worx.Account')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -1,20 +1,82 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import F
+from django.core.urlresolvers import reverse
+from django.utils import timezone
 from worx.models import Account, Profile
 
+from datetime import timedelta
 import json
 
+# When a session made (or renewed) now expires
+def session_expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'SESSION_TTL', 30 * 86400))
+
 class Session(models.Model):
     key = models.CharField(max_length=64, unique=True) # SHA256
     account = models.ForeignKey(Account, related_name='+')
+    expires_on = models.DateTimeField(default=session_expiry, db_index=True)
 
-    def to_json(self):
-        parts = { 'session_key': self.key, 'id': self.account.id }
+    def to_dict(self):
+        parts = { 'session_key': self.key, 'id': self.account.id,
+            'expires_on': self.expires_on.isoformat() }
         try:
             parts['name'] = self.account.profile.name
             parts['location'] = self.account.profile.location
             parts['bio'] = self.account.profile.bio
-            parts['img_data'] = self.account.profile.img_data
+            img_blob = self.account.profile.img_blob
+            parts['img_url'] = reverse('blob', kwargs={'blob_id': img_blob}) if img_blob else None
         except Profile.DoesNotExist:
         	pass # don't worry about that
-        return json.dumps(parts)
+        return parts
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+# A bulk import of reports and messages (see api/bulk.py)
+# rows_done counts the rows of the input committed so far, in the same
+# transaction as them, so a failed import resumes by skipping that many.
+class ImportJob(models.Model):
+    account = models.ForeignKey(Account, related_name='+') # the author of what's imported
+    format = models.CharField(max_length=10) # ndjson or csv
+    started_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    reports = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    errors = models.TextField(blank=True) # the first IMPORT_MAX_ERRORS, one per line
+    finished = models.BooleanField(default=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'format': self.format,
+            'started_on': self.started_on.isoformat(),
+            'updated_on': self.updated_on.isoformat(),
+            'rows_done': self.rows_done,
+            'rows_failed': self.rows_failed,
+            'reports': self.reports,
+            'messages': self.messages,
+            'errors': self.errors.splitlines(),
+            'finished': self.finished,
+        }
+
+
+# A running total kept by a management command (e.g. sessions reaped), in
+# the database so the web processes can report it in their metrics
+class StoredCounter(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+# Add to the named stored counter, starting it if it's new
+def add_to_counter(name, by=1):
+    if not StoredCounter.objects.filter(name=name).update(value=F('value') + by,
+            updated_on=timezone.now()):
+        StoredCounter.objects.create(name=name, value=by)
 
+# The value of the named stored counter (0 until it's started)
+def counter_value(name):
+    return StoredCounter.objects.filter(name=name).values_list('value', flat=True).first() or 0
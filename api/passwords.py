@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.db import connection
+from django.utils.crypto import constant_time_compare, get_random_string
+
+import base64
+import hashlib
+import logging
+import Queue
+import threading
+
+try:
+    from hashlib import pbkdf2_hmac
+except ImportError: # before Python 2.7.8
+    from django.utils.crypto import pbkdf2
+    def pbkdf2_hmac(name, password, salt, iterations):
+        return pbkdf2(password, salt, iterations, digest=getattr(hashlib, name))
+
+from worx.models import Account
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = 'pbkdf2_sha256'
+
+
+# ********* HASHES                         *********
+
+# PBKDF2 iterations for new hashes
+def work_factor():
+    return getattr(settings, 'PASSWORD_ITERATIONS', 100000)
+
+# Hash a plain text password as "pbkdf2_sha256$<iterations>$<salt>$<hash>"
+def make_password(plain_text, salt=None, iterations=None):
+    salt = salt or get_random_string(12)
+    iterations = iterations or work_factor()
+    digest = pbkdf2_hmac('sha256', plain_text.encode('utf-8'), salt.encode('utf-8'), iterations)
+    return '%s$%d$%s$%s' % (ALGORITHM, iterations, salt, base64.b64encode(digest))
+
+# Check a plain text password against a stored hash, either one from
+# make_password or a legacy unsalted SHA-256 hex digest
+def check_password(plain_text, encoded):
+    if encoded.startswith(ALGORITHM + '$'):
+        algorithm, iterations, salt, digest = encoded.split('$', 3)
+        expected = make_password(plain_text, salt, int(iterations))
+    else:
+        expected = hashlib.sha256(plain_text.encode('utf-8')).hexdigest()
+    return constant_time_compare(expected, encoded)
+
+# Whether a stored hash is legacy or made with another work factor
+def needs_rehash(encoded):
+    parts = encoded.split('$')
+    return len(parts) != 4 or parts[0] != ALGORITHM or \
+        parts[1] != '%d' % work_factor()
+
+
+# ********* HASHING POOL                   *********
+
+# The hashing pool has more waiting jobs than PASSWORD_HASH_QUEUE, or one
+# waited longer than PASSWORD_HASH_TIMEOUT
+class Busy(Exception):
+    pass
+
+# Runs password hashing on a few threads, so however many logins arrive at
+# once only PASSWORD_HASH_THREADS hashes use the CPU together and the rest
+# of the requests keep being served. Request threads wait for their result;
+# when too many are waiting new ones are turned away rather than queued.
+# PASSWORD_HASH_THREADS = 0 hashes on the request thread (e.g. for tests).
+class HashPool(object):
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.done = self.rejected = 0
+
+    def start(self):
+        workers = getattr(settings, 'PASSWORD_HASH_THREADS', 2)
+        with self.lock:
+            while len(self.threads) < workers:
+                thread = threading.Thread(target=self.work, name='password-hashing')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return workers
+
+    # Run func(*args) on the pool and return what it returns
+    def call(self, func, *args):
+        if self.start() <= 0:
+            return func(*args)
+        if self.queue.qsize() >= getattr(settings, 'PASSWORD_HASH_QUEUE', 100):
+            with self.lock:
+                self.rejected += 1
+            raise Busy
+        job = {'done': threading.Event()}
+        self.queue.put((func, args, job))
+        if not job['done'].wait(getattr(settings, 'PASSWORD_HASH_TIMEOUT', 10)):
+            with self.lock:
+                self.rejected += 1
+            raise Busy
+        if 'error' in job:
+            raise job['error']
+        return job['result']
+
+    # Run func(*args) on the pool without waiting for it
+    def submit(self, func, *args):
+        if self.start() <= 0:
+            self.run(func, args, None)
+        else:
+            self.queue.put((func, args, None))
+
+    def work(self):
+        while True:
+            func, args, job = self.queue.get()
+            self.run(func, args, job)
+            if job is None:
+                connection.close()
+
+    def run(self, func, args, job):
+        try:
+            result = func(*args)
+        except Exception as e:
+            if job is None:
+                logger.exception('password job %s failed', func.__name__)
+            else:
+                job['error'] = e
+        else:
+            if job is not None:
+                job['result'] = result
+        finally:
+            with self.lock:
+                self.done += 1
+            if job is not None:
+                job['done'].set()
+
+    def stats(self):
+        with self.lock:
+            return {'queued': self.queue.qsize(), 'done': self.done,
+                'rejected': self.rejected, 'threads': len(self.threads)}
+
+
+pool = HashPool()
+
+# Hash a new password on the pool (Busy if it's overloaded)
+def hash_password(plain_text):
+    return pool.call(make_password, plain_text)
+
+# Find which of the accounts (all with the same account key) the password
+# is for, checking on the pool (Busy if it's overloaded)
+# Returns None if it matches none of them; with no accounts a made up hash
+# is checked so unknown accounts don't answer faster.
+def authenticate(accounts, plain_text):
+    for account in accounts:
+        if pool.call(check_password, plain_text, account.passphrase):
+            if needs_rehash(account.passphrase):
+                pool.submit(upgrade, account.id, account.passphrase, plain_text)
+            return account
+    if not accounts:
+        pool.call(check_password, plain_text, '%s$%d$unknown$' % (ALGORITHM, work_factor()))
+    return None
+
+# Replace an account's legacy (or weaker) hash after a successful login,
+# unless the password was changed meanwhile
+def upgrade(account_id, old, plain_text):
+    Account.objects.filter(id=account_id, passphrase=old) \
+        .update(passphrase=make_password(plain_text))
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from collections import OrderedDict
+import hashlib
+import math
+import threading
+import time
+
+import metrics
+
+# Prefix for keys written to the shared backend
+SHARED_PREFIX = 'cwx-bucket:'
+
+# In-process token buckets, keyed by "<limit>:<key>"
+# Each bucket holds up to `burst` tokens and refills at `rate` tokens a
+# second; it's stored as (tokens, when) and topped up lazily when next
+# taken from, so a check is a dict lookup and some arithmetic however many
+# keys are tracked. The least recently used buckets are dropped beyond
+# `size` (a dropped bucket starts again full). If a shared backend (an
+# entry in CACHES) is configured the buckets live there instead, so worker
+# processes count together; those updates aren't atomic, so concurrent
+# workers may let a few extra requests through.
+class TokenBucketStore(object):
+
+    def __init__(self, size=100000, shared=None):
+        self.size = size
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict() # key -> (tokens, when)
+        self.evictions = 0
+
+    def shared_backend(self):
+        return caches[self.shared] if self.shared else None
+
+    # Take `cost` tokens from the bucket if it has them
+    # Returns 0 if it did, otherwise the seconds until it will.
+    def take(self, key, rate, burst, cost=1, now=None):
+        now = time.time() if now is None else now
+        backend = self.shared_backend()
+        if backend:
+            shared_key = SHARED_PREFIX + hashlib.md5(key.encode('utf-8')).hexdigest()
+            tokens, wait = self.refill(backend.get(shared_key), rate, burst, cost, now)
+            # an untouched bucket is full again after burst / rate seconds
+            backend.set(shared_key, (tokens, now), int(math.ceil(burst / rate)) + 1)
+            return wait
+        with self.lock:
+            tokens, wait = self.refill(self.buckets.pop(key, None), rate, burst, cost, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+                self.evictions += 1
+        return wait
+
+    # The tokens left in the bucket and the wait, after taking from it
+    def refill(self, bucket, rate, burst, cost, now):
+        tokens = burst if bucket is None else \
+            min(burst, bucket[0] + max(0.0, now - bucket[1]) * rate)
+        if tokens >= cost:
+            return tokens - cost, 0.0
+        return tokens, (cost - tokens) / rate
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.evictions = 0
+
+
+store = TokenBucketStore(
+    size=getattr(settings, 'RATE_LIMIT_SIZE', 100000),
+    shared=getattr(settings, 'RATE_LIMIT_SHARED', None))
+
+CHECKS = metrics.registry.counter('cwx_ratelimit_checks_total',
+    'Rate limit checks, by limit and whether they were allowed', labels=('limit', 'outcome'))
+metrics.registry.gauge('cwx_ratelimit_buckets',
+    'Token buckets held in this process', lambda: len(store.buckets))
+
+# Helper to get the address the request came from
+# Behind a proxy set RATE_LIMIT_FORWARDED so the last X-Forwarded-For entry
+# (the one the proxy added) is used instead of the proxy's own address.
+def client_ip(request):
+    if getattr(settings, 'RATE_LIMIT_FORWARDED', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+# Take a token for each (limit, key) in turn, as named in RATE_LIMITS
+# Returns None if all allowed the request, otherwise a 429 response saying
+# when to retry. Limits not in RATE_LIMITS are not enforced.
+def check(*limits):
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return None
+    configured = getattr(settings, 'RATE_LIMITS', {})
+    for name, key in limits:
+        if name not in configured:
+            continue
+        rate, burst = configured[name]
+        wait = store.take(u'%s:%s' % (name, key), float(rate), burst)
+        CHECKS.inc(name, 'rejected' if wait else 'allowed')
+        if wait:
+            response = HttpResponse(content='Too many requests', status=429,
+                reason='Too Many Requests')
+            response['Retry-After'] = '%d' % math.ceil(wait)
+            return response
+    return None
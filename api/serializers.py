@@ -0,0 +1,194 @@
+from django.http import HttpResponse
+
+import base64
+import json
+import struct
+
+import metrics
+
+# Response formats: name -> (content type, other accepted media types)
+# JSON stays the default; clients opt in to MessagePack with an Accept
+# header (e.g. "Accept: application/msgpack").
+FORMATS = {
+    'json': ('application/json', ()),
+    'msgpack': ('application/msgpack', ('application/x-msgpack', 'application/vnd.msgpack')),
+}
+DEFAULT_FORMAT = 'json'
+
+# Bytes that are data rather than text (e.g. image contents)
+# MessagePack carries them as raw binary; JSON has to base64 encode them.
+class Binary(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def __eq__(self, other):
+        return isinstance(other, Binary) and other.data == self.data
+
+    def __ne__(self, other):
+        return not self == other
+
+# Pick the response format from the request's Accept header
+# The most preferred media type we can produce wins; wildcards and headers
+# naming nothing we know get the default. Remembered on the request, as the
+# conditional GET functions ask too.
+def negotiate(request):
+    fmt = getattr(request, 'cwx_format', None)
+    if fmt is None:
+        fmt = DEFAULT_FORMAT
+        ranges = []
+        for pos, part in enumerate(request.META.get('HTTP_ACCEPT', '').split(',')):
+            params = part.strip().lower().split(';')
+            q = 1.0
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            if q > 0:
+                ranges.append((-q, pos, params[0].strip()))
+        for _, _, media in sorted(ranges):
+            match = [name for name, (ctype, aliases) in FORMATS.items()
+                if media == ctype or media in aliases]
+            if match or media in ('*/*', 'application/*'):
+                fmt = match[0] if match else DEFAULT_FORMAT
+                break
+        request.cwx_format = fmt
+    return fmt
+
+# Serialize data in the named format
+def dumps(fmt, data):
+    with metrics.timed('serialize'):
+        if fmt == 'msgpack':
+            return packb(data)
+        return json.dumps(data, default=_json_default)
+
+def _json_default(obj):
+    if isinstance(obj, Binary):
+        return base64.b64encode(obj.data)
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+# The start of an array of n items, to be followed by their serializations
+# joined with array_separator() and closed with array_end()
+def array_start(fmt, n):
+    return _pack_header(n, 0x90, 16, '\xdc', '\xdd') if fmt == 'msgpack' else '['
+
+def array_separator(fmt):
+    return '' if fmt == 'msgpack' else ', '
+
+def array_end(fmt):
+    return '' if fmt == 'msgpack' else ']'
+
+# Build a response holding data in the format the request asked for
+def render(request, data, status=200):
+    fmt = negotiate(request)
+    return render_serialized(request, dumps(fmt, data), status)
+
+# Build a response from an already serialized body (e.g. a cached fragment)
+def render_serialized(request, content, status=200):
+    response = HttpResponse(content=content, status=status,
+        content_type=FORMATS[negotiate(request)][0])
+    response['Vary'] = 'Accept'
+    return response
+
+
+# ********* MESSAGEPACK                    *********
+# A small pure Python packer covering the types the API emits:
+# None, bools, ints, floats, text, Binary, lists/tuples and dicts. Text
+# (unicode, or str holding UTF-8) is packed as str and Binary as bin.
+
+def packb(obj):
+    out = []
+    _pack(obj, out.append)
+    return ''.join(out)
+
+def _pack_header(n, fix_base, fix_limit, code16, code32):
+    if n < fix_limit:
+        return chr(fix_base | n)
+    if n < 0x10000:
+        return code16 + struct.pack('>H', n)
+    return code32 + struct.pack('>I', n)
+
+def _pack_text(obj, write):
+    if isinstance(obj, unicode):
+        obj = obj.encode('utf-8')
+    n = len(obj)
+    if n < 32:
+        write(chr(0xa0 | n))
+    elif n < 0x100:
+        write('\xd9' + chr(n))
+    elif n < 0x10000:
+        write('\xda' + struct.pack('>H', n))
+    else:
+        write('\xdb' + struct.pack('>I', n))
+    write(obj)
+
+def _pack_int(obj, write):
+    if 0 <= obj < 0x80:
+        write(chr(obj))
+    elif -32 <= obj < 0:
+        write(struct.pack('b', obj))
+    elif obj >= 0:
+        for code, fmt, limit in (('\xcc', '>B', 1 << 8), ('\xcd', '>H', 1 << 16),
+                ('\xce', '>I', 1 << 32), ('\xcf', '>Q', 1 << 64)):
+            if obj < limit:
+                write(code + struct.pack(fmt, obj))
+                return
+        raise ValueError('Integer too large to pack')
+    else:
+        for code, fmt, limit in (('\xd0', '>b', 1 << 7), ('\xd1', '>h', 1 << 15),
+                ('\xd2', '>i', 1 << 31), ('\xd3', '>q', 1 << 63)):
+            if obj >= -limit:
+                write(code + struct.pack(fmt, obj))
+                return
+        raise ValueError('Integer too large to pack')
+
+def _pack_float(obj, write):
+    write('\xcb' + struct.pack('>d', obj))
+
+def _pack_none(obj, write):
+    write('\xc0')
+
+def _pack_bool(obj, write):
+    write('\xc3' if obj else '\xc2')
+
+def _pack_binary(obj, write):
+    n = len(obj.data)
+    if n < 0x100:
+        write('\xc4' + chr(n))
+    elif n < 0x10000:
+        write('\xc5' + struct.pack('>H', n))
+    else:
+        write('\xc6' + struct.pack('>I', n))
+    write(obj.data)
+
+def _pack_list(obj, write):
+    write(_pack_header(len(obj), 0x90, 16, '\xdc', '\xdd'))
+    for item in obj:
+        _PACKERS.get(type(item), _pack)(item, write)
+
+def _pack_dict(obj, write):
+    write(_pack_header(len(obj), 0x80, 16, '\xde', '\xdf'))
+    for key, value in obj.iteritems():
+        _PACKERS.get(type(key), _pack)(key, write)
+        _PACKERS.get(type(value), _pack)(value, write)
+
+# Packers by exact type, so the common cases skip the isinstance() chain
+_PACKERS = {
+    type(None): _pack_none, bool: _pack_bool, int: _pack_int, long: _pack_int,
+    float: _pack_float, str: _pack_text, unicode: _pack_text, Binary: _pack_binary,
+    list: _pack_list, tuple: _pack_list, dict: _pack_dict,
+}
+
+# Fallback for subclasses of the types above (e.g. SafeText, OrderedDict)
+def _pack(obj, write):
+    for types, packer in ((bool, _pack_bool), ((int, long), _pack_int), (float, _pack_float),
+            (Binary, _pack_binary), (basestring, _pack_text), ((list, tuple), _pack_list),
+            (dict, _pack_dict)):
+        if isinstance(obj, types):
+            return packer(obj, write)
+    if obj is None:
+        return _pack_none(obj, write)
+    raise TypeError('%r cannot be packed' % (obj,))
@@ -0,0 +1,191 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from collections import OrderedDict
+import calendar
+import threading
+import time
+
+from models import Session, session_expiry, add_to_counter, counter_value
+from worx.models import Account
+import metrics
+
+# Prefix for keys written to the shared backend
+SHARED_PREFIX = 'cwx-session:v2:'
+
+# Prefix for the shared backend's marks of sessions logged out
+REVOKED_PREFIX = 'cwx-session-revoked:'
+
+RENEWED = metrics.registry.counter('cwx_sessions_renewed_total',
+    'Sessions whose expiry was pushed back as they were used')
+EXPIRED = metrics.registry.counter('cwx_sessions_expired_total',
+    'Requests turned away for using an expired session')
+metrics.registry.gauge('cwx_sessions_live', 'Sessions not yet expired',
+    lambda: Session.objects.filter(expires_on__gt=timezone.now()).count())
+metrics.registry.gauge('cwx_sessions_awaiting_reaping', 'Expired sessions not yet deleted',
+    lambda: Session.objects.filter(expires_on__lte=timezone.now()).count())
+# reap_sessions runs in its own process, so its total is kept in the database
+metrics.registry.gauge('cwx_sessions_reaped', 'Expired sessions deleted by reap_sessions',
+    lambda: counter_value('sessions_reaped'))
+
+# Helper to get a datetime as seconds since the epoch
+def timestamp(when):
+    return calendar.timegm(when.utctimetuple()) + when.microsecond / 1e6
+
+# In-process LRU cache of session key -> account, with a TTL on each entry
+# Only the account's column values are kept, so every hit hands back a fresh
+# Account instance with nothing (e.g. the profile) cached on it. If a shared
+# backend (an entry in CACHES) is configured it is checked between the local
+# cache and the database, letting worker processes warm each other, and
+# logging out marks the session revoked there for as long as any process
+# may still hold it, so local hits are refused in every process once the
+# mark is seen. Without one, other processes go on accepting a logged out
+# session until their entry's `ttl` runs out, so keep it to a few seconds.
+# Entries also hold when their session expires, so an expired session is
+# refused even while cached. Using a session pushes its expiry back to
+# SESSION_TTL from now, but only once SESSION_RENEW_INTERVAL has passed
+# since it was last pushed back, so active sessions cost a write now and
+# then rather than on every request.
+class SessionCache(object):
+
+    def __init__(self, size=10000, ttl=5, shared=None):
+        self.size = size
+        self.ttl = ttl
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (cached until, account fields, session expires)
+        self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def shared_backend(self):
+        return caches[self.shared] if self.shared else None
+
+    # Look up the account for the session key (Account.DoesNotExist if none,
+    # or if the session has expired)
+    def account(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            cached = entry is not None and entry[0] > now
+        if cached and self.revoked(key):
+            raise Account.DoesNotExist
+        if cached:
+            with self.lock:
+                self.entries[key] = entry # move to the most recent end
+                self.hits += 1
+        fields, expires = (entry[1], entry[2]) if cached else self.load(key)
+        if expires <= now:
+            self.invalidate(key)
+            EXPIRED.inc()
+            raise Account.DoesNotExist
+        ttl = getattr(settings, 'SESSION_TTL', 30 * 86400)
+        if expires - now < ttl - getattr(settings, 'SESSION_RENEW_INTERVAL', 86400):
+            expires = self.renew(key, fields)
+            cached = False
+        if not cached:
+            self.store(key, fields, expires, now)
+        return Account(**fields)
+
+    # Push the session's expiry back to SESSION_TTL from now
+    def renew(self, key, fields):
+        expires_on = session_expiry()
+        Session.objects.filter(key=key).update(expires_on=expires_on)
+        RENEWED.inc()
+        expires = timestamp(expires_on)
+        self.share(key, fields, expires)
+        return expires
+
+    # The account fields and expiry of a session from the shared backend,
+    # or failing that the database
+    def load(self, key):
+        backend = self.shared_backend()
+        found = backend.get(SHARED_PREFIX + key) if backend else None
+        if found is not None:
+            with self.lock:
+                self.shared_hits += 1
+            return found
+        with self.lock:
+            self.misses += 1
+        try:
+            s_obj = Session.objects.select_related('account').get(key=key)
+        except Session.DoesNotExist:
+            raise Account.DoesNotExist
+        fields = dict((f.attname, getattr(s_obj.account, f.attname))
+            for f in Account._meta.concrete_fields)
+        expires = timestamp(s_obj.expires_on)
+        self.share(key, fields, expires)
+        return fields, expires
+
+    def share(self, key, fields, expires):
+        backend = self.shared_backend()
+        if backend:
+            backend.set(SHARED_PREFIX + key, (fields, expires), self.ttl)
+
+    def store(self, key, fields, expires, now):
+        with self.lock:
+            self.entries[key] = (now + self.ttl, fields, expires)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Whether another process has logged the session out
+    def revoked(self, key):
+        backend = self.shared_backend()
+        return bool(backend) and backend.get(REVOKED_PREFIX + key) is not None
+
+    # Forget the session, e.g. once it has been logged out
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        backend = self.shared_backend()
+        if backend:
+            backend.delete(SHARED_PREFIX + key)
+            backend.set(REVOKED_PREFIX + key, True, self.ttl)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    # Counters for sizing the cache
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+session_cache = SessionCache(
+    size=getattr(settings, 'SESSION_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'SESSION_CACHE_TTL', 5),
+    shared=getattr(settings, 'SESSION_CACHE_SHARED', None))
+
+
+# Delete sessions that expired before now, `batch_size` at a time (found
+# through the expires_on index), pausing between batches so other writers
+# get the database. Each batch adds to the stored 'sessions_reaped' counter
+# as it is deleted. Returns how many were deleted.
+def reap_expired(batch_size=1000, pause=0.0):
+    now = timezone.now()
+    reaped = 0
+    while True:
+        ids = list(Session.objects.filter(expires_on__lte=now)
+            .values_list('id', flat=True)[:batch_size])
+        if ids:
+            with transaction.atomic():
+                Session.objects.filter(id__in=ids).delete()
+                add_to_counter('sessions_reaped', len(ids))
+            reaped += len(ids)
+        if len(ids) < batch_size:
+            return reaped
+        if pause:
+            time.sleep(pause)
@@ -1,3 +1,1368 @@
+from django.core.cache import caches
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, DatabaseError
+from django.utils import timezone
 
-# Create your tests here.
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import os
+import shutil
+import StringIO
+import struct
+import tempfile
+import urllib
+import zlib
+
+from api import v1, serializers, metrics, middleware, loadtest, passwords, ratelimit, bulk
+from api.models import Session, ImportJob
+from api.session_cache import session_cache, SessionCache, reap_expired
+from api import session_cache as session_cache_module
+from api.fragments import fragment_cache, LocalLRU
+from api.thumbnails import pipeline, message_image_variants
+from worx import images
+from worx.models import *
+
+
+# A real (greyscale gradient) PNG of the given size
+def png(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = ''.join('\x00' + ''.join(chr((x + y) % 256) for x in range(width))
+        for y in range(height))
+    return '\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) + \
+        chunk('IDAT', zlib.compress(rows)) + chunk('IEND', '')
+
+
+# Unpack one MessagePack value (str as unicode, bin as Binary), to read
+# back what serializers.packb wrote. Raises ValueError if data isn't exactly
+# one well formed value.
+def unpackb(data):
+    try:
+        obj, pos = _unpack(data, 0)
+    except (IndexError, struct.error):
+        raise ValueError('Truncated MessagePack data')
+    if pos != len(data):
+        raise ValueError('Extra data after MessagePack value')
+    return obj
+
+_FIXED = {
+    '\xcc': '>B', '\xcd': '>H', '\xce': '>I', '\xcf': '>Q',
+    '\xd0': '>b', '\xd1': '>h', '\xd2': '>i', '\xd3': '>q',
+    '\xca': '>f', '\xcb': '>d',
+}
+_LENGTHS = {
+    '\xc4': ('>B', 'bin'), '\xc5': ('>H', 'bin'), '\xc6': ('>I', 'bin'),
+    '\xd9': ('>B', 'str'), '\xda': ('>H', 'str'), '\xdb': ('>I', 'str'),
+    '\xdc': ('>H', 'array'), '\xdd': ('>I', 'array'),
+    '\xde': ('>H', 'map'), '\xdf': ('>I', 'map'),
+}
+
+def _unpack(data, pos):
+    code = data[pos]
+    byte = ord(code)
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+    if byte >= 0xe0:
+        return byte - 0x100, pos
+    if code == '\xc0':
+        return None, pos
+    if code in ('\xc2', '\xc3'):
+        return code == '\xc3', pos
+    if code in _FIXED:
+        fmt = _FIXED[code]
+        size = struct.calcsize(fmt)
+        return struct.unpack(fmt, data[pos:pos + size])[0], pos + size
+    if 0xa0 <= byte < 0xc0:
+        kind, n = 'str', byte & 0x1f
+    elif 0x90 <= byte < 0xa0:
+        kind, n = 'array', byte & 0x0f
+    elif 0x80 <= byte < 0x90:
+        kind, n = 'map', byte & 0x0f
+    elif code in _LENGTHS:
+        fmt, kind = _LENGTHS[code]
+        size = struct.calcsize(fmt)
+        n = struct.unpack(fmt, data[pos:pos + size])[0]
+        pos += size
+    else:
+        raise ValueError('Unsupported MessagePack type 0x%02x' % byte)
+    if kind in ('str', 'bin'):
+        if pos + n > len(data):
+            raise IndexError()
+        raw = data[pos:pos + n]
+        return (raw.decode('utf-8') if kind == 'str' else serializers.Binary(raw)), pos + n
+    if kind == 'array':
+        items = []
+        for i in range(n):
+            item, pos = _unpack(data, pos)
+            items.append(item)
+        return items, pos
+    result = {}
+    for i in range(n):
+        key, pos = _unpack(data, pos)
+        result[key], pos = _unpack(data, pos)
+    return result, pos
+
+
+# Shared fixtures for exercising the API through the test client
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        blob_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blob_root)
+        # image variants and password hashes are made inline so tests can
+        # see them, and hashes are cheap
+        blob_settings = self.settings(BLOB_ROOT=blob_root, IMAGE_PIPELINE_THREADS=0,
+            PASSWORD_HASH_THREADS=0, PASSWORD_ITERATIONS=1000)
+        blob_settings.enable()
+        self.addCleanup(blob_settings.disable)
+        self.account = self.make_account('tester')
+        self.session = Session.objects.create(key='a' * 64, account=self.account)
+        # start every test with the session resolved and cached
+        session_cache.clear()
+        session_cache.account(self.session.key)
+        fragment_cache.clear()
+        ratelimit.store.clear()
+
+    def make_account(self, name):
+        account = Account.objects.create(account_key=name, passphrase='')
+        Profile.objects.create(account=account, name=name, img_blob='%064x' % account.id)
+        return account
+
+    def get(self, url, **extra):
+        return self.client.get(url, HTTP_X_CWX_SESSION_KEY=self.session.key, **extra)
+
+    # the body of a plain or streamed response
+    def body(self, response):
+        if response.streaming:
+            return ''.join(response.streaming_content)
+        return response.content
+
+    # follow the next page links, returning the ids seen and page count
+    def walk(self, url):
+        seen, pages = [], 0
+        while url:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in json.loads(self.body(response)))
+            link = response.get('Link', None)
+            url = link[1:link.index('>')] if link else None
+            pages += 1
+        return seen, pages
+
+    def count_queries(self, url):
+        fragment_cache.clear() # measure the cold path
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get(url)
+            self.body(response) # streamed rows are loaded as they're sent
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+
+# Each list endpoint must run the same number of queries however long
+# the list is, so a reintroduced N+1 shows up as a failure here
+class QueryCountTests(ApiTestCase):
+
+    def add_reports(self, count):
+        for i in range(count):
+            author = self.make_account('author%d' % Report.objects.count())
+            report = Report(reported_by=author, title='pothole %d' % i,
+                latitude=51.5, longitude=-0.1)
+            report.save()
+            ReportSubscription.objects.create(account=self.account, report=report)
+
+    def add_messages(self, report, count):
+        for i in range(count):
+            author = self.make_account('writer%d' % Message.objects.count())
+            msg = Message.objects.create(about_report=report, written_by=author,
+                reply_to=Message.objects.filter(about_report=report).first(),
+                message_text='msg %d' % i)
+            MessageImage.objects.create(on_message=msg, img_blob='%064x' % 1)
+            MessageImage.objects.create(on_message=msg, img_blob='%064x' % 2)
+
+    def assertConstantQueries(self, url, grow):
+        grow(2)
+        self.count_queries(url) # warm any per-process caches
+        small = self.count_queries(url)
+        grow(10)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_search_report_title(self):
+        self.assertConstantQueries('/api/reports/search/title/pothole/', self.add_reports)
+
+    def test_search_report_location(self):
+        self.assertConstantQueries('/api/reports/search/area/51.5/-0.1/1.0/', self.add_reports)
+
+    def test_subscribed_reports(self):
+        self.assertConstantQueries('/api/reports/subscribed/', self.add_reports)
+
+    def test_messages(self):
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        url = '/api/report/%d/messages/' % report.id
+        self.assertConstantQueries(url, lambda n: self.add_messages(report, n))
+
+    def test_message_thread(self):
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        root = Message.objects.create(about_report=report, written_by=self.account, message_text='root')
+        url = '/api/report/%d/message/%d/thread/?depth=50' % (report.id, root.id)
+        self.assertConstantQueries(url, lambda n: self.add_messages(report, n))
+
+
+class PaginationTests(ApiTestCase):
+
+    def test_messages_newest_first(self):
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        ids = [Message.objects.create(about_report=report, written_by=self.account,
+            message_text='m%d' % i).id for i in range(7)]
+        # force ties on written_on so the id tie-break is exercised
+        Message.objects.filter(id__in=ids[2:5]).update(
+            written_on=Message.objects.get(id=ids[2]).written_on)
+        seen, pages = self.walk('/api/report/%d/messages/?limit=3' % report.id)
+        expected = [m.id for m in Message.objects.order_by('-written_on', '-id')]
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+
+    def test_subscribed_reports(self):
+        for i in range(5):
+            Report(reported_by=self.account, title='r%d' % i, latitude=0, longitude=0).save()
+        seen, pages = self.walk('/api/reports/subscribed/?limit=2')
+        self.assertEqual(seen, sorted(Report.objects.values_list('id', flat=True)))
+        self.assertEqual(pages, 3)
+
+    def test_page_size_capped(self):
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        for i in range(3):
+            Message.objects.create(about_report=report, written_by=self.account, message_text='m')
+        max_size, v1.MAX_PAGE_SIZE = v1.MAX_PAGE_SIZE, 2
+        try:
+            response = self.get('/api/report/%d/messages/?limit=100000' % report.id)
+        finally:
+            v1.MAX_PAGE_SIZE = max_size
+        self.assertEqual(len(json.loads(self.body(response))), 2)
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_bad_cursor(self):
+        response = self.get('/api/reports/subscribed/?after=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamingTests(ApiTestCase):
+
+    def test_stream_matches_json_dumps(self):
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        for i in range(5):
+            msg = Message.objects.create(about_report=report, written_by=self.account,
+                message_text='m%d' % i)
+            MessageImage.objects.create(on_message=msg, img_blob='%064x' % i)
+        chunk, v1.STREAM_CHUNK = v1.STREAM_CHUNK, 2
+        try:
+            response = self.get('/api/report/%d/messages/' % report.id)
+            body = self.body(response)
+        finally:
+            v1.STREAM_CHUNK = chunk
+        self.assertTrue(response.streaming)
+        expected = [v1.encode_message(m) for m in report.messages.order_by('-written_on', '-id')]
+        self.assertEqual(body, json.dumps(expected))
+
+
+class SearchTests(ApiTestCase):
+
+    def search(self, url):
+        return [r['id'] for r in json.loads(self.body(self.get(url)))]
+
+    def test_ranked_prefix_search(self):
+        ids = {}
+        for title in ('pothole on main street', 'broken street light',
+                'pothole pothole everywhere', 'graffiti'):
+            report = Report(reported_by=self.account, title=title, latitude=0, longitude=0)
+            report.save()
+            ids[title] = report.id
+        self.assertEqual(self.search('/api/reports/search/title/pothole/'),
+            [ids['pothole pothole everywhere'], ids['pothole on main street']])
+        self.assertEqual(self.search('/api/reports/search/title/street%20pot/'),
+            [ids['pothole on main street']])
+        self.assertEqual(self.search('/api/reports/search/title/gra/'), [ids['graffiti']])
+
+    def test_index_follows_edits_and_deletes(self):
+        report = Report(reported_by=self.account, title='pothole', latitude=0, longitude=0)
+        report.save()
+        report.title = 'flooding'
+        report.save()
+        self.assertEqual(self.search('/api/reports/search/title/pothole/'), [])
+        self.assertEqual(self.search('/api/reports/search/title/flooding/'), [report.id])
+        report.delete()
+        self.assertEqual(self.search('/api/reports/search/title/flooding/'), [])
+
+    def test_message_search_within_report(self):
+        reports = []
+        for i in range(2):
+            report = Report(reported_by=self.account, title='r', latitude=0, longitude=0)
+            report.save()
+            reports.append(report)
+        msgs = [Message.objects.create(about_report=r, written_by=self.account,
+            message_text='council fixed it') for r in reports]
+        url = '/api/report/%d/messages/search/council/' % reports[1].id
+        self.assertEqual(self.search(url), [msgs[1].id])
+
+    def test_ranked_paging(self):
+        for i in range(5):
+            Report(reported_by=self.account, title='pothole %d' % i, latitude=0, longitude=0).save()
+        seen = self.walk('/api/reports/search/title/pothole/?limit=2')[0]
+        self.assertEqual(sorted(seen), sorted(Report.objects.values_list('id', flat=True)))
+
+
+# Every query an endpoint runs must be answered from an index: a plain
+# "SCAN <table>" in SQLite's query plan means a full table scan
+class QueryPlanTests(ApiTestCase):
+
+    def setUp(self):
+        super(QueryPlanTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='pothole', latitude=51.5, longitude=-0.1)
+        self.report.save()
+        self.msg = Message.objects.create(about_report=self.report, written_by=self.account,
+            message_text='still there')
+        self.img = MessageImage.objects.create(on_message=self.msg, img_blob='%064x' % 1)
+
+    # run the request, recording each query with its parameters
+    def capture(self, method, url, **extra):
+        ops = connection.ops
+        ops.last_executed_query = lambda cursor, sql, params: (sql, params)
+        try:
+            with CaptureQueriesContext(connection) as ctx:
+                response = getattr(self.client, method)(url,
+                    HTTP_X_CWX_SESSION_KEY=self.session.key, **extra)
+                self.body(response)
+        finally:
+            del ops.last_executed_query
+        self.assertTrue(response.status_code < 400, url)
+        return [q['sql'] for q in ctx.captured_queries]
+
+    def assertIndexed(self, method, url, **extra):
+        cursor = connection.cursor()
+        for sql, params in self.capture(method, url, **extra):
+            if not sql.startswith('SELECT'):
+                continue
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                scan = detail.startswith('SCAN') and 'INDEX' not in detail \
+                    and 'VIRTUAL TABLE' not in detail and 'sqlite_master' not in detail
+                self.assertFalse(scan, '%s: %s\n%s' % (url, detail, sql))
+
+    def test_login(self):
+        Account.objects.create(account_key='login', passphrase=passwords.make_password('pw'))
+        self.assertIndexed('post', '/api/auth/session/', data={'username': 'login', 'password': 'pw'})
+
+    def test_message_thread(self):
+        reply = Message.objects.create(about_report=self.report, written_by=self.account,
+            reply_to=self.msg, message_text='reply')
+        self.assertIndexed('get', '/api/report/%d/message/%d/thread/' % (self.report.id, self.msg.id))
+
+    def test_report_endpoints(self):
+        self.assertIndexed('get', '/api/report/%d/' % self.report.id)
+        self.assertIndexed('put', '/api/report/%d/subscribe/' % self.report.id)
+        self.assertIndexed('get', '/api/reports/subscribed/')
+        self.assertIndexed('get', '/api/reports/search/title/pothole/')
+        self.assertIndexed('get', '/api/reports/search/area/51.5/-0.1/1.0/')
+
+    def test_message_endpoints(self):
+        base = '/api/report/%d/' % self.report.id
+        self.assertIndexed('get', base + 'messages/')
+        self.assertIndexed('get', base + 'messages/?after=%d' % self.msg.id)
+        self.assertIndexed('get', base + 'messages/search/still/')
+        self.assertIndexed('get', base + 'message/%d/' % self.msg.id)
+        self.assertIndexed('get', base + 'message/%d/images/' % self.msg.id)
+
+
+class FeedTests(ApiTestCase):
+
+    def setUp(self):
+        super(FeedTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        self.other = Report(reported_by=self.account, title='y', latitude=0, longitude=0)
+        self.other.save()
+        self.old = self.post(self.report, 'old')
+
+    def post(self, report, text):
+        return Message.objects.create(about_report=report, written_by=self.account, message_text=text)
+
+    def test_long_poll_returns_only_new_messages(self):
+        new = self.post(self.report, 'new')
+        self.post(self.other, 'elsewhere')
+        url = '/api/report/%d/feed/?after=%d&timeout=0' % (self.report.id, self.old.id)
+        self.assertEqual([m['id'] for m in json.loads(self.body(self.get(url)))], [new.id])
+
+    def test_long_poll_times_out_empty(self):
+        url = '/api/report/%d/feed/?timeout=0' % self.report.id
+        self.assertEqual(json.loads(self.body(self.get(url))), [])
+
+    def test_subscribed_feed(self):
+        first, second = self.post(self.report, 'a'), self.post(self.other, 'b')
+        ReportSubscription.objects.filter(account=self.account, report=self.other).delete()
+        url = '/api/reports/subscribed/feed/?after=%d&timeout=0' % self.old.id
+        self.assertEqual([m['id'] for m in json.loads(self.body(self.get(url)))], [first.id])
+
+    def test_event_stream_resumes_from_last_event_id(self):
+        first, second = self.post(self.report, 'a'), self.post(self.report, 'b')
+        with self.settings(FEED_STREAM_SECONDS=0):
+            response = self.get('/api/report/%d/feed/' % self.report.id,
+                HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(first.id))
+            body = self.body(response)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('id: %d\nevent: message\ndata: ' % second.id, body)
+        self.assertNotIn('id: %d\n' % first.id, body)
+
+
+class ConditionalGetTests(ApiTestCase):
+
+    def setUp(self):
+        super(ConditionalGetTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        self.msg = Message.objects.create(about_report=self.report, written_by=self.account,
+            message_text='hi')
+        self.url = '/api/report/%d/' % self.report.id
+
+    def revalidate(self, url, response):
+        # a 304 is answered from the version stamps alone
+        with self.assertNumQueries(1):
+            return self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_report_not_modified(self):
+        response = self.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(self.revalidate(self.url, response).status_code, 304)
+
+    def test_new_message_changes_report(self):
+        response = self.get(self.url)
+        Report.objects.filter(id=self.report.id).update(last_activity=None)
+        Message.objects.create(about_report=self.report, written_by=self.account, message_text='2')
+        self.assertEqual(self.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_profile_change_changes_message(self):
+        url = '/api/report/%d/message/%d/' % (self.report.id, self.msg.id)
+        response = self.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.client.put('/api/auth/profile/me/', 'real_name=renamed',
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_new_image_changes_image_list(self):
+        url = '/api/report/%d/message/%d/images/' % (self.report.id, self.msg.id)
+        response = self.get(url)
+        Report.objects.filter(id=self.report.id).update(last_activity=None)
+        MessageImage(on_message=self.msg, img_blob='%064x' % 1).save()
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_no_session_no_304(self):
+        response = self.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 401)
+
+
+class FragmentCacheTests(ApiTestCase):
+
+    def setUp(self):
+        super(FragmentCacheTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        self.msg = Message.objects.create(about_report=self.report, written_by=self.account,
+            message_text='hi')
+        self.url = '/api/report/%d/messages/' % self.report.id
+
+    def test_warm_list_served_from_cache(self):
+        cold = self.body(self.get(self.url))
+        with CaptureQueriesContext(connection) as ctx:
+            warm = self.body(self.get(self.url))
+        self.assertEqual(cold, warm)
+        # only the page of ids is read from the database
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(fragment_cache.stats()['hits'], 1)
+
+    def test_profile_change_invalidates_author(self):
+        self.body(self.get(self.url))
+        self.client.put('/api/auth/profile/me/', 'real_name=renamed',
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        messages = json.loads(self.body(self.get(self.url)))
+        self.assertEqual(messages[0]['author'][1], 'renamed')
+        self.assertEqual(fragment_cache.stats()['stale'], 1)
+
+    def test_new_image_invalidates_message(self):
+        self.body(self.get(self.url))
+        self.client.post(self.url.replace('messages/', 'message/%d/images/' % self.msg.id),
+            {'img_data': png(2, 2).encode('base64')}, HTTP_X_CWX_SESSION_KEY=self.session.key)
+        messages = json.loads(self.body(self.get(self.url)))
+        self.assertEqual(len(messages[0]['images']), 1)
+
+    def test_local_entries_expire(self):
+        lru = LocalLRU(10, ttl=60)
+        lru.set_many({'a': 1, 'b': 2})
+        self.assertEqual(lru.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        lru = LocalLRU(10, ttl=-1)
+        lru.set('a', 1)
+        self.assertEqual(lru.get_many(['a']), {})
+
+    def test_stats_admin_only(self):
+        url = '/api/fragments/stats/'
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.get(url).status_code, 403)
+        with self.settings(ADMIN_ACCOUNTS=['tester']):
+            self.assertIn('hits', json.loads(self.body(self.get(url))))
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class SessionCacheTests(ApiTestCase):
+
+    def test_hit_after_miss(self):
+        cache = SessionCache(size=10, ttl=60)
+        self.assertEqual(cache.account(self.session.key).id, self.account.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.account(self.session.key).id, self.account.id)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_expired_entries_reloaded(self):
+        cache = SessionCache(size=10, ttl=-1)
+        cache.account(self.session.key)
+        with self.assertNumQueries(1):
+            cache.account(self.session.key)
+
+    def test_lru_eviction(self):
+        cache = SessionCache(size=1, ttl=60)
+        Session.objects.create(key='b' * 64, account=self.account)
+        cache.account(self.session.key)
+        cache.account('b' * 64)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_logout_reaches_other_processes(self):
+        # two processes' caches, sharing the default cache
+        ours, theirs = SessionCache(size=10, ttl=60, shared='default'), \
+            SessionCache(size=10, ttl=60, shared='default')
+        try:
+            theirs.account(self.session.key)
+            ours.invalidate(self.session.key)
+            with self.assertRaises(Account.DoesNotExist):
+                theirs.account(self.session.key)
+        finally:
+            caches['default'].clear()
+
+    def test_logout_invalidates(self):
+        url = '/api/auth/session/%s/' % self.session.key
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        response = self.get('/api/reports/subscribed/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_stats_admin_only(self):
+        url = '/api/auth/session/cache/'
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.get(url).status_code, 403)
+        with self.settings(ADMIN_ACCOUNTS=['tester']):
+            self.assertIn('hits', json.loads(self.body(self.get(url))))
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class ThreadTests(ApiTestCase):
+
+    def setUp(self):
+        super(ThreadTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        # a - b - d - e
+        #   \ c
+        self.a = self.post(None)
+        self.b = self.post(self.a)
+        self.c = self.post(self.a)
+        self.d = self.post(self.b)
+        self.e = self.post(self.d)
+
+    def post(self, reply_to):
+        response = self.client.post('/api/report/%d/messages/' % self.report.id,
+            {'message_text': 'm', 'reply_to': reply_to or ''},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(response.status_code, 302)
+        return int(response['Location'].rstrip('/').split('/')[-1])
+
+    def thread(self, root, query=''):
+        response = self.get('/api/report/%d/message/%d/thread/%s' % (self.report.id, root, query))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def shape(self, node):
+        return (node['id'], [self.shape(r) for r in node['replies']])
+
+    def test_paths(self):
+        e = Message.objects.get(id=self.e)
+        self.assertEqual(e.thread_depth, 3)
+        self.assertEqual(e.thread_path, ''.join('%010d/' % m for m in (self.a, self.b, self.d)))
+
+    def test_whole_thread(self):
+        thread = self.thread(self.a)
+        self.assertEqual(self.shape(thread['thread']), (self.a, [(self.b, [(self.d, [(self.e, [])])]),
+            (self.c, [])]))
+        self.assertEqual((thread['size'], thread['truncated']), (5, False))
+        self.assertEqual(thread['thread']['replies'][0]['reply_to'], self.a)
+
+    def test_subtree(self):
+        self.assertEqual(self.shape(self.thread(self.b)['thread']),
+            (self.b, [(self.d, [(self.e, [])])]))
+        self.assertEqual(self.shape(self.thread(self.e)['thread']), (self.e, []))
+
+    def test_limits(self):
+        self.assertEqual(self.shape(self.thread(self.a, '?depth=1')['thread']),
+            (self.a, [(self.b, []), (self.c, [])]))
+        thread = self.thread(self.a, '?limit=3')
+        self.assertEqual(self.shape(thread['thread']), (self.a, [(self.b, []), (self.c, [])]))
+        self.assertEqual((thread['size'], thread['truncated']), (3, True))
+        self.assertEqual(self.get('/api/report/%d/message/%d/thread/?depth=x' % (
+            self.report.id, self.a)).status_code, 400)
+        self.assertEqual(self.get('/api/report/%d/message/%d/thread/' % (
+            self.report.id + 1, self.a)).status_code, 404)
+
+    def test_reply_depth_limited(self):
+        Message.objects.filter(id=self.e).update(thread_depth=THREAD_MAX_DEPTH)
+        response = self.client.post('/api/report/%d/messages/' % self.report.id,
+            {'message_text': 'm', 'reply_to': self.e}, HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportCounterTests(ApiTestCase):
+
+    def setUp(self):
+        super(ReportCounterTests, self).setUp()
+        response = self.client.post('/api/reports/', {'title': 'pothole', 'latitude': '51.5',
+            'longitude': '-0.1'}, HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.report_id = int(response['Location'].rstrip('/').split('/')[-1])
+        self.url = '/api/report/%d/' % self.report_id
+        self.other = self.make_account('other')
+        self.other_key = 'b' * 64
+        Session.objects.create(key=self.other_key, account=self.other)
+
+    def counts(self):
+        report = json.loads(self.get(self.url).content)
+        return report['message_count'], report['image_count'], report['subscriber_count']
+
+    def test_counted_as_they_happen(self):
+        self.assertEqual(self.counts(), (0, 0, 1)) # the author follows their report
+        response = self.client.post(self.url + 'messages/', {'message_text': 'hi'},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.client.post(response['Location'] + 'images/', {'img_data': png(4, 4).encode('base64')},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(self.counts(), (1, 1, 1))
+        subscribe = self.url + 'subscribe/'
+        for i in range(2): # subscribing twice counts once
+            self.client.put(subscribe, HTTP_X_CWX_SESSION_KEY=self.other_key)
+        self.assertEqual(self.counts(), (1, 1, 2))
+        for i in range(2):
+            self.client.delete(subscribe, HTTP_X_CWX_SESSION_KEY=self.other_key)
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_etag_follows_subscribers(self):
+        response = self.get(self.url)
+        etag, active = response['ETag'], json.loads(response.content)['last_activity']
+        self.assertEqual(self.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.put(self.url + 'subscribe/', HTTP_X_CWX_SESSION_KEY=self.other_key)
+        response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # following a report isn't activity on it
+        self.assertEqual(json.loads(response.content)['last_activity'], active)
+
+    def test_saving_stale_report_keeps_counts(self):
+        report = Report.objects.get(id=self.report_id)
+        ReportSubscription.objects.create(account=self.other, report_id=self.report_id)
+        report.title = 'renamed'
+        report.save()
+        self.assertEqual(Report.objects.get(id=self.report_id).subscriber_count, 2)
+
+    def test_repair(self):
+        Message.objects.create(about_report_id=self.report_id, written_by=self.account,
+            message_text='m')
+        self.assertEqual(self.counts(), (1, 0, 1)) # and cached
+        Report.objects.filter(id=self.report_id).update(message_count=7, image_count=3,
+            subscriber_count=0)
+        with self.assertNumQueries(7): # one batch: 4 reads and an update, in a savepoint
+            call_command('repair_report_counts', stdout=open(os.devnull, 'w'))
+        fragment_cache.clear() # as the cached report expires
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+
+class BulkTests(ApiTestCase):
+
+    ROWS = [
+        {'kind': 'report', 'ref': 'p-1', 'title': 'pothole', 'latitude': 51.5, 'longitude': -0.1},
+        {'kind': 'message', 'report': 'p-1', 'text': 'still there'},
+        {'kind': 'report', 'ref': 'p-2', 'title': 'streetlight', 'latitude': 51.6,
+            'longitude': -0.2},
+        {'kind': 'message', 'report': 'p-1', 'text': 'and deeper'},
+        {'kind': 'report', 'ref': 'p-3', 'title': 'far away', 'latitude': 91, 'longitude': 0},
+        {'kind': 'message', 'report': 'p-3', 'text': 'lost'},
+        {'kind': 'message', 'report': 'p-2', 'text': 'flickering'},
+    ]
+
+    def setUp(self):
+        super(BulkTests, self).setUp()
+        admin = self.settings(ADMIN_ACCOUNTS=['tester'])
+        admin.enable()
+        self.addCleanup(admin.disable)
+
+    def ndjson(self, rows):
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+
+    def post(self, body, query='', content_type='application/x-ndjson'):
+        response = self.client.post('/api/reports/import/' + query, body,
+            content_type=content_type, HTTP_X_CWX_SESSION_KEY=self.session.key)
+        return response, json.loads(response.content)
+
+    def imported(self):
+        return [(r.external_ref, r.title, r.message_count, r.subscriber_count,
+            sorted(r.messages.values_list('message_text', flat=True)),
+            list(r.observers.values_list('account_id', flat=True)))
+            for r in Report.objects.order_by('id')]
+
+    def test_import(self):
+        response, job = self.post(self.ndjson(self.ROWS) + '{not json\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((job['rows_done'], job['rows_failed'], job['reports'],
+            job['messages'], job['finished']), (8, 3, 2, 3, True))
+        self.assertEqual(job['errors'], ['row 5: latitude is out of range',
+            'row 6: no report p-3', 'row 8: not JSON'])
+        self.assertEqual(self.imported(), [
+            ('p-1', 'pothole', 2, 1, ['and deeper', 'still there'], [self.account.id]),
+            ('p-2', 'streetlight', 1, 1, ['flickering'], [self.account.id]),
+        ])
+        report = Report.objects.get(external_ref='p-1')
+        self.assertEqual(report.geohash, encode_geohash(51.5, -0.1))
+
+    def test_later_import_adds_to_earlier_reports(self):
+        self.post(self.ndjson(self.ROWS[:2]))
+        report = Report.objects.get()
+        url = '/api/report/%d/' % report.id
+        self.assertEqual(json.loads(self.get(url).content)['message_count'], 1) # and cached
+        response, job = self.post(self.ndjson(self.ROWS[:4]))
+        self.assertEqual(job['errors'], ['row 1: report p-1 was already imported'])
+        self.assertEqual(json.loads(self.get(url).content)['message_count'], 3)
+
+    def test_queries_per_chunk(self):
+        rows = lambda n: self.ndjson([{'ref': 'r%d-%d' % (n, i), 'title': 't', 'latitude': 0,
+            'longitude': 0} for i in range(n)] + [{'kind': 'message', 'report': 'r%d-0' % n,
+            'text': 'm'}] * n)
+        for n in (5, 50): # same number of queries however many rows
+            with self.assertNumQueries(12):
+                self.post(rows(n))
+
+    def test_reports_posted_meanwhile_not_taken_as_imported(self):
+        manager = Report.objects
+        posted = []
+        def post_first(objs, **kwargs):
+            # the same account posts a report just before the insert
+            report = Report(reported_by=self.account, title='posted', latitude=0, longitude=0)
+            report.save()
+            posted.append(report)
+            return type(manager).bulk_create(manager, objs, **kwargs)
+        manager.bulk_create = post_first
+        try:
+            response, job = self.post(self.ndjson(self.ROWS))
+        finally:
+            del manager.bulk_create
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((job['reports'], job['messages']), (2, 3))
+        self.assertEqual(ReportSubscription.objects.filter(report=posted[0]).count(), 1)
+        self.assertEqual([r[:3] for r in self.imported()], [('', 'posted', 0),
+            ('p-1', 'pothole', 2), ('p-2', 'streetlight', 1)])
+
+    def test_resume_after_failure(self):
+        manager = Message.objects
+        calls = []
+        def fail_second_chunk(objs, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise DatabaseError('disk I/O error')
+            return type(manager).bulk_create(manager, objs, **kwargs)
+        manager.bulk_create = fail_second_chunk
+        try:
+            with self.settings(IMPORT_CHUNK_SIZE=3):
+                response, job = self.post(self.ndjson(self.ROWS))
+        finally:
+            del manager.bulk_create
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((job['rows_done'], job['reports'], job['finished']), (3, 2, False))
+        self.assertEqual(Report.objects.count(), 2) # the second chunk was rolled back
+        with self.settings(IMPORT_CHUNK_SIZE=3):
+            response, job = self.post(self.ndjson(self.ROWS), '?job=%d' % job['id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((job['rows_done'], job['rows_failed'], job['reports'],
+            job['messages'], job['finished']), (7, 2, 2, 3, True))
+        self.assertEqual([r[:3] for r in self.imported()], [('p-1', 'pothole', 2),
+            ('p-2', 'streetlight', 1)])
+
+    def test_export_round_trip(self):
+        csv_in = 'kind,ref,title,latitude,longitude,report,text\r\n' \
+            'report,a,"pothole, deep",51.5,-0.1,,\r\n' \
+            'message,,,,,a,"first line\nsecond line"\r\n' \
+            'report,,caf\xc3\xa9,1.5,2.5,,\r\n'
+        response, job = self.post(csv_in, content_type='text/csv')
+        self.assertEqual((job['format'], job['reports'], job['messages']), ('csv', 2, 1))
+        second = Report.objects.order_by('id').last().id
+        exported = [json.loads(line) for line in
+            self.body(self.get('/api/reports/export/')).splitlines()]
+        for row in exported:
+            del row['date_time']
+        self.assertEqual(exported, [
+            {'kind': 'report', 'ref': 'a', 'title': 'pothole, deep', 'latitude': 51.5,
+                'longitude': -0.1},
+            {'kind': 'message', 'report': 'a', 'text': 'first line\nsecond line'},
+            {'kind': 'report', 'ref': '%d' % second, 'title': u'caf\xe9', 'latitude': 1.5,
+                'longitude': 2.5},
+        ])
+        csv_out = self.body(self.get('/api/reports/export/?format=csv'))
+        Report.objects.all().delete()
+        response, job = self.post(csv_out, content_type='text/csv')
+        self.assertEqual((job['rows_failed'], job['reports'], job['messages']), (0, 2, 1))
+        self.assertEqual([r[:3] for r in self.imported()], [('a', 'pothole, deep', 1),
+            ('%d' % second, u'caf\xe9', 0)])
+
+    def test_lines_across_blocks(self):
+        source = StringIO.StringIO('a\r\nbc\n\nd')
+        self.assertEqual(list(bulk.read_lines(source, size=2)), ['a\r\n', 'bc\n', '\n', 'd'])
+
+    def test_administrators_only(self):
+        with self.settings(ADMIN_ACCOUNTS=[]):
+            self.assertEqual(self.client.post('/api/reports/import/', '',
+                content_type='application/x-ndjson',
+                HTTP_X_CWX_SESSION_KEY=self.session.key).status_code, 403)
+            self.assertEqual(self.get('/api/reports/export/').status_code, 403)
+        self.assertEqual(self.client.get('/api/reports/export/').status_code, 401)
+        with self.settings(METRICS_TOKEN='secret'): # the scrape token exports nothing
+            self.assertEqual(self.client.get('/api/reports/export/',
+                HTTP_AUTHORIZATION='Bearer secret').status_code, 401)
+
+    def test_commands(self):
+        path = tempfile.mktemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with open(path, 'wb') as f:
+            f.write('kind,ref,title,latitude,longitude\nreport,x,bench,1,2\n')
+        call_command('import_reports', path, account='tester', stdout=open(os.devnull, 'w'))
+        self.assertEqual(ImportJob.objects.get().reports, 1)
+        call_command('export_reports', output=path, format='csv')
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines()[1].split(',')[:5],
+                ['report', 'x', 'bench', '1.0', '2.0'])
+
+
+class SessionExpiryTests(ApiTestCase):
+
+    def expire_in(self, seconds):
+        expires_on = timezone.now() + timedelta(seconds=seconds)
+        Session.objects.filter(key=self.session.key).update(expires_on=expires_on)
+        session_cache.invalidate(self.session.key)
+        return expires_on
+
+    def test_expired_session_refused(self):
+        session_cache.account(self.session.key) # cached while it expires
+        Session.objects.filter(key=self.session.key).update(expires_on=timezone.now())
+        self.assertEqual(self.get('/api/reports/subscribed/').status_code, 200)
+        self.expire_in(-1)
+        before = session_cache_module.EXPIRED.value()
+        self.assertEqual(self.get('/api/reports/subscribed/').status_code, 401)
+        self.assertEqual(session_cache_module.EXPIRED.value() - before, 1)
+        url = '/api/auth/session/%s/' % self.session.key
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_renewal_throttled(self):
+        cache = SessionCache(size=10, ttl=-1) # always to the database
+        with self.settings(SESSION_TTL=1000, SESSION_RENEW_INTERVAL=100):
+            self.expire_in(950)
+            with self.assertNumQueries(1):
+                cache.account(self.session.key)
+            old = self.expire_in(850)
+            with self.assertNumQueries(2): # lookup, renewal
+                cache.account(self.session.key)
+            renewed = Session.objects.get(id=self.session.id).expires_on
+            self.assertTrue(renewed - old > timedelta(seconds=140))
+            with self.assertNumQueries(1):
+                cache.account(self.session.key)
+
+    def test_reaper(self):
+        Session.objects.bulk_create([Session(key='%064x' % i, account=self.account,
+            expires_on=timezone.now() - timedelta(seconds=i)) for i in range(1, 6)])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(reap_expired(batch_size=2), 5)
+        deletes = [q for q in ctx.captured_queries if 'DELETE FROM "api_session"' in q['sql']]
+        self.assertEqual(len(deletes), 3) # in batches
+        self.assertEqual(list(Session.objects.values_list('key', flat=True)), [self.session.key])
+        rendered = metrics.registry.render()
+        self.assertIn('cwx_sessions_live 1', rendered)
+        self.assertIn('cwx_sessions_reaped 5', rendered)
+        Session.objects.create(key='f' * 64, account=self.account,
+            expires_on=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reap_expired(batch_size=2), 1)
+        self.assertIn('cwx_sessions_reaped 6', metrics.registry.render())
+
+
+class BlobTests(ApiTestCase):
+
+    IMAGE = png(40, 30)
+
+    def setUp(self):
+        super(BlobTests, self).setUp()
+        report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        report.save()
+        self.msg = Message.objects.create(about_report=report, written_by=self.account,
+            message_text='hi')
+        self.url = '/api/report/%d/message/%d/images/' % (report.id, self.msg.id)
+
+    def upload(self):
+        return self.client.post(self.url, {'img_data': self.IMAGE.encode('base64')},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+
+    def test_identical_uploads_share_a_blob(self):
+        self.upload()
+        self.upload()
+        images = json.loads(self.body(self.get(self.url)))
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images[0]['thumb_url'], images[1]['thumb_url'])
+        self.assertNotIn('data', images[0])
+        self.assertEqual(len(set(self.msg.images.values_list('img_blob', flat=True))), 1)
+
+    def test_fetch_blob_with_etag_and_range(self):
+        self.upload()
+        blob_id = self.msg.images.get().img_blob
+        url = '/api/blob/%s/' % blob_id
+        response = self.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(''.join(response.streaming_content), self.IMAGE)
+
+        response = self.get(url, HTTP_IF_NONE_MATCH='"%s"' % blob_id)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get(url, HTTP_RANGE='bytes=12-15')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(''.join(response.streaming_content), 'IHDR')
+        self.assertEqual(response['Content-Range'], 'bytes 12-15/%d' % len(self.IMAGE))
+
+    def test_invalid_base64_rejected(self):
+        response = self.client.post(self.url, {'img_data': '***'},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchTests(ApiTestCase):
+
+    def setUp(self):
+        super(BatchTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='Broken bench', latitude=1, longitude=1)
+        self.report.save()
+
+    def batch(self, *items):
+        response = self.client.post('/api/batch/', json.dumps({'requests': list(items)}),
+            content_type='application/json', HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_runs_each_request_in_order(self):
+        url = 'report/%d/' % self.report.id
+        results = self.batch(
+            {'method': 'POST', 'path': url + 'messages/', 'body': {'message_text': 'first'}},
+            {'path': '/api/' + url + 'messages/?limit=1'},
+            {'path': url})
+        self.assertEqual([r['status'] for r in results], [302, 200, 200])
+        self.assertIn('Location', results[0]['headers'])
+        self.assertEqual(results[1]['body'][0]['text'], 'first')
+        self.assertIn('ETag', results[2]['headers'])
+        self.assertEqual(results[2]['body']['title'], 'Broken bench')
+
+    def test_session_resolved_once(self):
+        url = 'report/%d/' % self.report.id
+        session_cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            self.batch({'path': url}, {'path': url})
+        session_queries = [q for q in ctx.captured_queries if 'api_session' in q['sql']]
+        self.assertEqual(len(session_queries), 1)
+
+    def test_per_item_errors(self):
+        results = self.batch({'path': 'nowhere/'}, {'path': 'batch/', 'method': 'POST'}, {})
+        self.assertEqual([r['status'] for r in results], [404, 400, 400])
+
+    def test_excluded_endpoints(self):
+        results = self.batch({'path': 'reports/subscribed/feed/'},
+            {'path': 'report/%d/feed/?stream=1' % self.report.id},
+            {'method': 'POST', 'path': 'reports/import/'}, {'path': 'reports/export/'},
+            {'path': 'blob/%s/' % ('0' * 64)})
+        self.assertEqual([r['status'] for r in results], [400] * 5)
+
+    def test_failing_item_answers_500(self):
+        url = 'report/%d/' % self.report.id
+        def fail(*args):
+            raise RuntimeError('boom')
+        v1.report_versions, versions = fail, v1.report_versions
+        try:
+            results = self.batch({'path': url}, {'path': url + 'messages/'})
+        finally:
+            v1.report_versions = versions
+        self.assertEqual([r['status'] for r in results], [500, 200])
+
+    def test_rejects_oversized_batch(self):
+        response = self.client.post('/api/batch/',
+            json.dumps({'requests': [{'path': 'reports/'}] * (v1.MAX_BATCH_SIZE + 1)}),
+            content_type='application/json', HTTP_X_CWX_SESSION_KEY=self.session.key)
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_session(self):
+        response = self.client.post('/api/batch/', json.dumps({'requests': []}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class FormatTests(ApiTestCase):
+
+    IMAGE = png(30, 20)
+
+    def setUp(self):
+        super(FormatTests, self).setUp()
+        self.report = Report(reported_by=self.account, title=u'Caf\xe9 sign', latitude=1.5, longitude=-2)
+        self.report.save()
+        self.msg = Message.objects.create(about_report=self.report, written_by=self.account,
+            message_text='hello')
+        self.client.post('/api/report/%d/message/%d/images/' % (self.report.id, self.msg.id),
+            {'img_data': self.IMAGE.encode('base64')}, HTTP_X_CWX_SESSION_KEY=self.session.key)
+
+    def msgpack(self, url, **extra):
+        response = self.get(url, HTTP_ACCEPT='application/msgpack', **extra)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        return response, unpackb(self.body(response))
+
+    def test_pack_round_trip(self):
+        data = {u'a': [None, True, False, 0, 127, 128, -1, -33, 70000, -70000, 2 ** 40, 1.5],
+            u'text': u'x' * 300, u'bin': serializers.Binary('\x00' * 70000), u'list': range(20)}
+        self.assertEqual(unpackb(serializers.packb(data)), data)
+
+    def test_negotiation(self):
+        def fmt(accept):
+            request = self.client.get('/').wsgi_request
+            request.META['HTTP_ACCEPT'] = accept
+            return serializers.negotiate(request)
+        self.assertEqual(fmt(''), 'json')
+        self.assertEqual(fmt('application/x-msgpack'), 'msgpack')
+        self.assertEqual(fmt('application/json;q=0.5, application/msgpack'), 'msgpack')
+        self.assertEqual(fmt('application/msgpack;q=0.1, */*'), 'json')
+        self.assertEqual(fmt('text/html'), 'json')
+
+    def test_lists_match_json(self):
+        for url in ('/api/reports/subscribed/', '/api/report/%d/messages/' % self.report.id,
+                '/api/report/%d/' % self.report.id):
+            response, packed = self.msgpack(url)
+            self.assertEqual(response['Vary'], 'Accept')
+            self.assertEqual(packed, json.loads(self.body(self.get(url))))
+
+    def test_etag_per_format(self):
+        url = '/api/report/%d/' % self.report.id
+        json_etag = self.get(url)['ETag']
+        response, packed = self.msgpack(url)
+        self.assertNotEqual(response['ETag'], json_etag)
+        response = self.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=json_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_image_bytes_sent_raw(self):
+        image = self.msg.images.get()
+        url = '/api/report/%d/message/%d/image/%d/' % (self.report.id, self.msg.id, image.id)
+        response, packed = self.msgpack(url)
+        self.assertEqual(packed['data'], serializers.Binary(self.IMAGE))
+        as_json = json.loads(self.body(self.get(url)))
+        self.assertEqual(as_json['data'].decode('base64'), self.IMAGE)
+        self.assertTrue(len(self.body(response)) < len(self.body(self.get(url))))
+
+
+class ThumbnailTests(ApiTestCase):
+
+    def setUp(self):
+        super(ThumbnailTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        self.url = '/api/report/%d/messages/' % self.report.id
+
+    def post(self, image):
+        return self.client.post(self.url, {'message_text': 'look', 'img_data': image.encode('base64')},
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+
+    def test_rejects_non_images(self):
+        self.assertEqual(self.post('hello').status_code, 400)
+        with self.settings(IMAGE_MAX_PIXELS=100):
+            self.assertEqual(self.post(png(20, 20)).status_code, 400)
+        self.assertEqual(self.post(png(20, 20)[:20]).status_code, 400) # truncated header
+        self.assertFalse(Message.objects.exists())
+
+    def test_small_image_is_its_own_thumbnail(self):
+        self.post(png(16, 16))
+        img = MessageImage.objects.get()
+        self.assertEqual((img.thumb_blob, img.large_blob), (img.img_blob, img.img_blob))
+        message = json.loads(self.body(self.get(self.url)))[0]
+        self.assertEqual(message['images'], [{'id': img.id, 'thumb_url': v1.blob_url(img.img_blob)}])
+
+    def test_variants_change_etag_not_activity(self):
+        self.post(png(16, 16))
+        img = MessageImage.objects.get()
+        url = '/api/report/%d/message/%d/' % (self.report.id, img.on_message_id)
+        etag = self.get(url)['ETag']
+        active = Report.objects.get(id=self.report.id).last_activity
+        MessageImage.objects.filter(id=img.id).update(thumb_blob='', large_blob='')
+        message_image_variants(img.id)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(Report.objects.get(id=self.report.id).last_activity, active)
+
+    def test_large_image_variants(self):
+        with self.settings(IMAGE_THUMBNAIL_SIZE=8, IMAGE_MAX_SIZE=32):
+            self.post(png(64, 48))
+        img = MessageImage.objects.get()
+        if images.Image is None:
+            # no Pillow: nothing made, and lists fall back to the original
+            self.assertEqual((img.thumb_blob, img.large_blob), ('', ''))
+            message = json.loads(self.body(self.get(self.url)))[0]
+            self.assertEqual(message['images'][0]['thumb_url'], v1.blob_url(img.img_blob))
+            return
+        store = v1.blob_store()
+        self.assertEqual(images.image_info(store.read(img.thumb_blob))[1:], (8, 8))
+        self.assertEqual(images.image_info(store.read(img.large_blob))[1:], (32, 24))
+
+    def test_profile_thumbnail_used_for_author(self):
+        self.client.put('/api/auth/profile/me/', urllib.urlencode({'img_data': png(4, 4).encode('base64')}),
+            HTTP_X_CWX_SESSION_KEY=self.session.key)
+        profile = Profile.objects.get(account=self.account)
+        self.assertEqual(profile.thumb_blob, profile.img_blob)
+        report = json.loads(self.body(self.get('/api/report/%d/' % self.report.id)))
+        self.assertEqual(report['author'][2], v1.blob_url(profile.thumb_blob))
+
+    def test_failed_jobs_counted(self):
+        failed = pipeline.stats()['failed']
+        pipeline.submit(images.make_variants, v1.blob_store(), '0' * 64)
+        self.assertEqual(pipeline.stats()['failed'], failed + 1)
+
+
+class MetricsTests(ApiTestCase):
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        self.report = Report(reported_by=self.account, title='x', latitude=0, longitude=0)
+        self.report.save()
+        for i in range(3):
+            Message.objects.create(about_report=self.report, written_by=self.account, message_text='m')
+        self.url = '/api/report/%d/messages/' % self.report.id
+
+    def series(self, histogram, view):
+        return list(histogram.series.get((view,), [0] * (len(histogram.buckets) + 2)))
+
+    def test_histogram_render(self):
+        h = metrics.Histogram('t_seconds', 'Test', (0.1, 1.0), labels=('view',))
+        for value in (0.05, 0.5, 5):
+            h.observe(value, 'a"b')
+        self.assertEqual(h.render()[2:], [
+            't_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            't_seconds_bucket{view="a\\"b",le="1"} 2',
+            't_seconds_bucket{view="a\\"b",le="+Inf"} 3',
+            't_seconds_count{view="a\\"b"} 3',
+            't_seconds_sum{view="a\\"b"} 5.55',
+        ])
+
+    def test_streamed_request_measured(self):
+        before_bytes = self.series(middleware.RESPONSE_BYTES, 'report-messages')
+        before_queries = self.series(middleware.DB_QUERIES, 'report-messages')
+        with CaptureQueriesContext(connection) as ctx:
+            body = self.body(self.get(self.url))
+            self.assertTrue(connection.use_debug_cursor) # still the test's setting
+        after_bytes = self.series(middleware.RESPONSE_BYTES, 'report-messages')
+        after_queries = self.series(middleware.DB_QUERIES, 'report-messages')
+        self.assertEqual(after_bytes[-2] - before_bytes[-2], 1)
+        self.assertEqual(after_bytes[-1] - before_bytes[-1], len(body))
+        self.assertEqual(after_queries[-1] - before_queries[-1], len(ctx.captured_queries))
+
+    def test_slow_requests_sampled(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        middleware.slow_logger.addHandler(handler)
+        self.addCleanup(middleware.slow_logger.removeHandler, handler)
+        with self.settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_SLOW_SAMPLE_RATE=1):
+            self.body(self.get(self.url))
+        self.assertEqual(len(records), 1)
+        self.assertIn('SELECT', records[0].getMessage())
+
+    def test_metrics_admin_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.assertEqual(self.get('/api/metrics/').status_code, 403)
+        self.body(self.get(self.url))
+        with self.settings(ADMIN_ACCOUNTS=['tester']):
+            response = self.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('cwx_request_seconds_count{view="report-messages"}', response.content)
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class LoadTestTests(ApiTestCase):
+
+    def test_generate_and_run(self):
+        data = loadtest.generate(accounts=5, reports=10, messages=3, image_ratio=0.5)
+        self.assertEqual(len(data['accounts']), 5)
+        self.assertEqual(Report.objects.filter(id__in=data['reports']).count(), 10)
+        self.assertEqual(Message.objects.filter(about_report__in=data['reports']).count(),
+            len(data['messages']))
+        self.assertEqual(set(data['sessions']), set(data['accounts']))
+        results = loadtest.run(data, 'mixed', count=30)
+        self.assertEqual(len(results), 30)
+        self.assertEqual([r for r in results if r[3] >= 400], [])
+
+    def test_compare(self):
+        results = [('a', 0.01, 2, 200), ('a', 0.02, 2, 200), ('b', 0.01, 1, 404)]
+        summary = loadtest.summarize(results, 1.0)
+        self.assertEqual(summary['*']['requests'], 3)
+        self.assertEqual(summary['b']['errors'], 1)
+        baseline = {'a': dict(summary['a'], p50_ms=5.0, queries=1.0)}
+        regressed = [(kind, measure) for kind, measure, was, now, bad
+            in loadtest.compare(summary, baseline) if bad]
+        self.assertEqual(regressed, [('a', 'p50_ms'), ('a', 'queries')])
+
+
+class RateLimitTests(ApiTestCase):
+
+    def login(self, username, **extra):
+        return self.client.post('/api/auth/session/', {'username': username, 'password': 'x'},
+            **extra)
+
+    def test_bucket_refills(self):
+        store = ratelimit.TokenBucketStore()
+        self.assertEqual([store.take('k', 1.0, 2, now=100) for i in range(3)], [0, 0, 1.0])
+        self.assertEqual(store.take('k', 1.0, 2, now=100.5), 0.5)
+        self.assertEqual(store.take('k', 1.0, 2, now=101), 0)
+        self.assertEqual(store.take('other', 1.0, 2, now=101), 0)
+
+    def test_store_evicts_oldest(self):
+        store = ratelimit.TokenBucketStore(size=2)
+        for key in ('a', 'b', 'c'):
+            store.take(key, 1.0, 1, now=0)
+        self.assertEqual(list(store.buckets), ['b', 'c'])
+        self.assertEqual(store.take('a', 1.0, 1, now=0), 0) # full again
+
+    def test_login_limited_per_account_before_database(self):
+        limits = {'login-ip': (1, 100), 'login-account': (0.1, 2)}
+        with self.settings(RATE_LIMITS=limits):
+            self.assertEqual([self.login('victim').status_code for i in range(2)], [401, 401])
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.login('Victim')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '10')
+            self.assertEqual(len(ctx.captured_queries), 0)
+            self.assertEqual(self.login('someone-else').status_code, 401)
+
+    def test_login_limited_per_address(self):
+        limits = {'login-ip': (0.1, 2), 'login-account': (1, 100)}
+        with self.settings(RATE_LIMITS=limits):
+            statuses = [self.login('user%d' % i).status_code for i in range(3)]
+            self.assertEqual(statuses, [401, 401, 429])
+            other = self.login('user3', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.status_code, 401)
+
+    def test_forwarded_address(self):
+        request = type('Request', (), {'META': {'REMOTE_ADDR': '10.0.0.1',
+            'HTTP_X_FORWARDED_FOR': '1.2.3.4, 5.6.7.8'}})()
+        self.assertEqual(ratelimit.client_ip(request), '10.0.0.1')
+        with self.settings(RATE_LIMIT_FORWARDED=True):
+            self.assertEqual(ratelimit.client_ip(request), '5.6.7.8')
+
+    def test_batched_logins_share_the_address(self):
+        login = {'method': 'POST', 'path': 'auth/session/',
+            'body': {'username': 'victim', 'password': 'x'}}
+        spoofed = [dict(login, headers={'X-Forwarded-For': '10.1.0.%d' % i}) for i in range(5)]
+        batch = lambda items: [item['status'] for item in json.loads(self.client.post(
+            '/api/batch/', json.dumps({'requests': items}), content_type='application/json',
+            HTTP_X_CWX_SESSION_KEY=self.session.key, HTTP_X_FORWARDED_FOR='1.2.3.4').content)]
+        limits = {'login-ip': (0.1, 3), 'login-account': (1, 100)}
+        with self.settings(RATE_LIMITS=limits, RATE_LIMIT_FORWARDED=True):
+            self.assertEqual(batch(spoofed), [400] * 5)
+            self.assertEqual(batch([login] * 5), [401, 401, 401, 429, 429])
+            # and the batch's logins used up the address's own bucket
+            self.assertEqual(self.login('victim', HTTP_X_FORWARDED_FOR='1.2.3.4').status_code,
+                429)
+            self.assertEqual(self.login('victim', HTTP_X_FORWARDED_FOR='4.3.2.1').status_code,
+                401)
+
+    def test_batched_items_charge_the_session(self):
+        items = [{'path': 'reports/subscribed/'}] * 4
+        with self.settings(RATE_LIMITS={'session': (0.1, 4)}):
+            response = self.client.post('/api/batch/', json.dumps({'requests': items}),
+                content_type='application/json', HTTP_X_CWX_SESSION_KEY=self.session.key)
+            # the batch itself took the first token
+            statuses = [item['status'] for item in json.loads(response.content)]
+            self.assertEqual(statuses, [200, 200, 200, 429])
+            self.assertEqual(self.get('/api/reports/subscribed/').status_code, 429)
+
+    def test_session_limited(self):
+        before = ratelimit.CHECKS.value('session', 'rejected')
+        with self.settings(RATE_LIMITS={'session': (0.1, 3)}):
+            statuses = [self.get('/api/reports/subscribed/').status_code for i in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertEqual(ratelimit.CHECKS.value('session', 'rejected') - before, 1)
+        with self.settings(RATE_LIMITS={'session': (0.1, 3)}, RATE_LIMIT_ENABLED=False):
+            self.assertEqual(self.get('/api/reports/subscribed/').status_code, 200)
+
+
+class PasswordTests(ApiTestCase):
+
+    def login(self, username, password):
+        return self.client.post('/api/auth/session/', {'username': username, 'password': password})
+
+    def test_hashes_salted(self):
+        first, second = passwords.make_password('pw'), passwords.make_password('pw')
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(passwords.check_password('pw', first))
+        self.assertFalse(passwords.check_password('wrong', first))
+
+    def test_new_account_hashed(self):
+        self.client.post('/api/auth/profile/', {'username': 'New', 'password': 'pw'})
+        passphrase = Account.objects.get(account_key='new').passphrase
+        self.assertFalse(passwords.needs_rehash(passphrase))
+        self.assertEqual(self.login('new', 'pw').status_code, 302)
+
+    def test_legacy_hash_upgraded_on_login(self):
+        legacy = hashlib.sha256('pw').hexdigest()
+        account = Account.objects.create(account_key='old', passphrase=legacy)
+        self.assertEqual(self.login('old', 'wrong').status_code, 401)
+        self.assertEqual(Account.objects.get(id=account.id).passphrase, legacy)
+        self.assertEqual(self.login('old', 'pw').status_code, 302)
+        upgraded = Account.objects.get(id=account.id).passphrase
+        self.assertTrue(upgraded.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.login('old', 'pw').status_code, 302)
+        with self.settings(PASSWORD_ITERATIONS=2000):
+            self.assertEqual(self.login('old', 'pw').status_code, 302)
+        self.assertTrue(Account.objects.get(id=account.id).passphrase.startswith('pbkdf2_sha256$2000$'))
+
+    def test_unknown_account(self):
+        self.assertEqual(self.login('nobody', 'pw').status_code, 401)
+
+    def test_hashed_on_pool(self):
+        account = Account.objects.create(account_key='pooled', passphrase=passwords.make_password('pw'))
+        with self.settings(PASSWORD_HASH_THREADS=1):
+            self.assertEqual(self.login('pooled', 'pw').status_code, 302)
+            self.assertEqual(self.login('pooled', 'wrong').status_code, 401)
+        self.assertEqual(passwords.pool.stats()['threads'], 1)
+
+    def test_busy_pool_turns_logins_away(self):
+        Account.objects.create(account_key='busy', passphrase=passwords.make_password('pw'))
+        with self.settings(PASSWORD_HASH_THREADS=1, PASSWORD_HASH_QUEUE=0):
+            response = self.login('busy', 'pw')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+import logging
+import Queue
+import threading
+
+from fragments import fragment_cache
+from worx.blobs import blob_store
+from worx.images import make_variants
+from worx.models import MessageImage, Profile, Report
+
+logger = logging.getLogger(__name__)
+
+# Runs image jobs on a few background threads, off the request thread
+# Jobs only add variants of images already stored, so one lost with its
+# process is harmless: until make_thumbnails fills it in the original is
+# served. IMAGE_PIPELINE_THREADS = 0 runs jobs inline (e.g. for tests).
+class ImagePipeline(object):
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.done = self.failed = 0
+
+    def submit(self, job, *args):
+        workers = getattr(settings, 'IMAGE_PIPELINE_THREADS', 2)
+        if workers <= 0:
+            self.run(job, args)
+            return
+        with self.lock:
+            while len(self.threads) < workers:
+                thread = threading.Thread(target=self.work, name='image-pipeline')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.queue.put((job, args))
+
+    def work(self):
+        while True:
+            job, args = self.queue.get()
+            self.run(job, args)
+            connection.close()
+
+    def run(self, job, args):
+        try:
+            job(*args)
+        except Exception:
+            logger.exception('image job %s%r failed', job.__name__, args)
+            ok = False
+        else:
+            ok = True
+        with self.lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        with self.lock:
+            return {'queued': self.queue.qsize(), 'done': self.done,
+                'failed': self.failed, 'threads': len(self.threads)}
+
+
+pipeline = ImagePipeline()
+
+# Make the variants of an image attached to a message
+# The report is marked updated so the message's ETag changes too.
+def message_image_variants(image_id):
+    img = MessageImage.objects.select_related('on_message').get(id=image_id)
+    thumb, large = make_variants(blob_store(), img.img_blob)
+    if (thumb, large) == (img.thumb_blob, img.large_blob):
+        return
+    MessageImage.objects.filter(id=image_id).update(thumb_blob=thumb, large_blob=large)
+    report_id = img.on_message.about_report_id
+    Report.objects.filter(id=report_id).update(updated_on=timezone.now())
+    fragment_cache.invalidate('message', img.on_message_id)
+    fragment_cache.invalidate('report', report_id)
+
+# Make the thumbnail of an account's profile image
+def profile_variants(account_id):
+    profile = Profile.objects.get(account_id=account_id)
+    thumb = make_variants(blob_store(), profile.img_blob)[0] if profile.img_blob else ''
+    if thumb == profile.thumb_blob:
+        return
+    Profile.objects.filter(id=profile.id).update(thumb_blob=thumb, updated_on=timezone.now())
+    fragment_cache.invalidate_author(account_id)
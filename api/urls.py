@@ -1,6 +1,6 @@
 from django.conf.urls import patterns, include, url
 
-urlpatterns = patterns('',
+urlpatterns = patterns('api.v1',
     # Examples:
     # url(r'^$', 'civiworx.views.home', name='home'),
     # url(r'^blog/', include('blog.urls')),
@@ -9,21 +9,47 @@ urlpatterns = patterns('',
     url(r'^auth/profile/me/$', 'account', name='my-account'),
     url(r'^auth/profile/$', 'new_account', name='new-account'),
     url(r'^auth/session/(?P<key>[a-z0-9]{64})/$', 'session', name='existing-session'),
+    url(r'^auth/session/cache/$', 'session_cache_stats', name='session-cache-stats'),
     url(r'^auth/session/$', 'new_session', name='new-session'),
 
     # message control for reports
     url(r'^report/(?P<report_id>\d+)/message/(?P<message_id>\d+)/image/(?P<image_id>\d+)/$', 'message_image', name='message-image'),
     url(r'^report/(?P<report_id>\d+)/message/(?P<message_id>\d+)/images/$', 'message_images', name='message-images'),
+    url(r'^report/(?P<report_id>\d+)/message/(?P<message_id>\d+)/thread/$', 'message_thread',
+        name='message-thread'),
     url(r'^report/(?P<report_id>\d+)/message/(?P<message_id>\d+)/$', 'message', name='message-details'),
+    url(r'^report/(?P<report_id>\d+)/messages/search/(?P<keyword>[^/]+)/$', 'search_messages',
+        name='search-report-messages'),
     url(r'^report/(?P<report_id>\d+)/messages/$', 'messages', name='report-messages'),
+    url(r'^report/(?P<report_id>\d+)/feed/$', 'report_feed', name='report-feed'),
 
     # report management
     url(r'^report/(?P<report_id>\d+)/subscribe/$', 'report_subscription', name='report-subscription'),
     url(r'^report/(?P<report_id>\d+)/$', 'report_details', name='report-details'),
-    url(r'^reports/search/title/(?P<keyword>[a-zA-Z0-9]+)/$', 'search_report_title', name='search-reports-by-title'),
+    url(r'^reports/search/title/(?P<keyword>[^/]+)/$', 'search_report_title', name='search-reports-by-title'),
     url(r'^reports/search/area/(?P<lat>\-?\d+\.\d+)/(?P<lng>\-?\d+\.\d+)/(?P<radius>\d+\.\d+)/$',
     	'search_report_location', name='search-reports-by-location'),
+    url(r'^reports/subscribed/feed/$', 'subscribed_feed', name='subscribed-feed'),
     url(r'^reports/subscribed/$', 'subscribed_reports', name='subscribed-reports'),
     url(r'^reports/$', 'reports', name='all-reports'),
 
+    # bulk import and export (administrators only)
+    url(r'^reports/import/$', 'import_reports', name='import-reports'),
+    url(r'^reports/export/$', 'export_reports', name='export-reports'),
+
+    # several requests in one round trip
+    url(r'^batch/$', 'batch', name='batch'),
+
+    # caches
+    url(r'^fragments/stats/$', 'fragment_stats', name='fragment-stats'),
+
+    # instrumentation (administrators only)
+    url(r'^metrics/$', 'metrics_text', name='metrics'),
+
+    # push notifications
+    url(r'^push/stats/$', 'push_stats', name='push-stats'),
+
+    # image data
+    url(r'^blob/(?P<blob_id>[0-9a-f]{64})/$', 'blob', name='blob'),
+
 )
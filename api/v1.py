@@ -1,21 +1,57 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import redirect
 from django.http import HttpResponse, HttpResponseBadRequest, \
-    HttpResponseNotFound, HttpResponseNotAllowed, QueryDict
-from django.views.decorators.http import require_http_methods
-from django.db.models import Count
+    HttpResponseNotFound, HttpResponseNotAllowed, HttpResponseNotModified, \
+    StreamingHttpResponse, HttpRequest, Http404, QueryDict
+from django.core.urlresolvers import reverse, resolve
+from django.utils.http import urlencode
+from django.utils import timezone
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.views.decorators.http import require_http_methods, condition
+from django.db.models import Max, Q
 
 import json
 import hashlib
+import logging
+import re
+import time
 import uuid
 
-from models import Session
+from models import Session, ImportJob
+from session_cache import session_cache
+from fragments import fragment_cache
+from serializers import Binary, negotiate, render, render_serialized
+import serializers
+import bulk
+import feed
+import metrics
+import passwords
+import ratelimit
+import thumbnails
 from worx.models import *
+from worx.geo import bounding_box, covering_prefixes, prefix_upper_bound, haversine
+from worx.blobs import blob_store, decode_base64, sniff_content_type
+from worx.images import image_info
+from worx import search
+from push import fanout
 
-# TODO: push notification for subscribed/watch accounts
+logger = logging.getLogger(__name__)
 
-# Helper to hash plain text passwords
-def hash_password(plain_text):
-    return hashlib.sha256(plain_text).hexdigest()
+# Most sub-requests a single batch may carry
+MAX_BATCH_SIZE = 25
+
+# Default and maximum number of items returned in one page of a list
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Number of rows loaded and encoded at a time when streaming a list
+STREAM_CHUNK = 100
+
+# Default and largest number of messages, and default levels of replies,
+# in a message thread
+THREAD_SIZE = 200
+MAX_THREAD_SIZE = 1000
+THREAD_DEPTH = 10
 
 # Helper for getting a reasonably unique session hash
 def session_hash():
@@ -23,61 +59,272 @@ def session_hash():
 
 # Helper to get account from session key
 def account_from_session(request):
+    # batched sub-requests share the account resolved for the whole batch
+    if getattr(request, 'cwx_account', None) is not None:
+        return request.cwx_account
     # NOTE: Key should be set as X-CWX-SESSION-KEY (framework changes to the below)
     s_key = request.META.get('HTTP_X_CWX_SESSION_KEY', None)
     if s_key is not None:
-        try:
-            s_obj = Session.objects.get(key=s_key)
-            return s_obj.account
-        except Session.DoesNotExist:
-            raise Account.DoesNotExist
+        # raises Account.DoesNotExist itself if there's no such session
+        return session_cache.account(s_key)
     else: # i.e. is None
         raise Account.DoesNotExist
 
-# Helper to convert message to JSON encodable dict
-def encode_message(msg):
-    # pull out details of the author
-    author, a_img = 'Anonymous', None
+# Helper to read the requested page size, capped at the server maximum
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# Helper to read the ?after=<id> cursor (None for the first page)
+# Raises ValueError if the cursor isn't an id
+def page_after(request):
+    after = request.GET.get('after', None)
+    return int(after) if after is not None else None
+
+# Helper to evaluate the ids of a page fetched with one extra (i.e. limit + 1)
+# Returns the ids in the page and the cursor for the next page (or None)
+def split_page(ids, limit):
+    ids = list(ids)
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+# Helper to read a "<score>_<id>" cursor, as left by ranked searches
+# Raises ValueError if the cursor is malformed
+def page_after_ranked(request):
+    after = request.GET.get('after', None)
+    if after is None:
+        return None
+    score, r_id = after.split('_')
+    return float(score), int(r_id)
+
+# Helper to cut a page from (score, id) hits with one extra (i.e. limit + 1)
+# Returns the ids in the page and the cursor for the next page (or None)
+def split_ranked_page(hits, limit):
+    if len(hits) > limit:
+        return [h[1] for h in hits[:limit]], '%r_%d' % hits[limit - 1]
+    return [h[1] for h in hits], None
+
+# Helper to get the serialized reports or messages (`kind`) by id, from the
+# fragment cache where possible; `load` fetches the rows for ids missing
+def json_fragments(kind, ids, load, fmt='json'):
+    found = fragment_cache.get(kind, ids, fmt)
+    missing = [i for i in ids if i not in found]
+    if missing:
+        encode, author = FRAGMENT_ENCODERS[kind]
+        fresh = [(r.id, getattr(r, author), serializers.dumps(fmt, encode(r)))
+            for r in load(missing)]
+        fragment_cache.put(kind, fresh, fmt)
+        found.update((f_id, data) for f_id, a_id, data in fresh)
+    return found
+
+# Helper to stream an array of reports or messages, a chunk at a time
+# The page's ids are known up front; only STREAM_CHUNK rows are ever held
+# at once. The JSON output is byte for byte what json.dumps() of the whole
+# list would give. A MessagePack array states its length first, so those
+# fragments are all fetched before anything is sent (pages are capped at
+# MAX_PAGE_SIZE, so this is bounded too).
+def stream_json(request, ids, kind, load):
+    fmt = negotiate(request)
+    def chunks():
+        for i in range(0, len(ids), STREAM_CHUNK):
+            chunk = ids[i:i + STREAM_CHUNK]
+            found = json_fragments(kind, chunk, load, fmt)
+            # skipping any deleted since the ids were read
+            yield [found[r_id] for r_id in chunk if r_id in found]
+    def generate():
+        sep = serializers.array_separator(fmt)
+        if fmt == 'json':
+            yield '['
+            first = True
+            for fragments in chunks():
+                if fragments:
+                    yield ('' if first else sep) + sep.join(fragments)
+                    first = False
+        else:
+            fragments = [f for c in chunks() for f in c]
+            yield serializers.array_start(fmt, len(fragments)) + sep.join(fragments)
+        yield serializers.array_end(fmt)
+    response = StreamingHttpResponse(generate(), content_type=serializers.FORMATS[fmt][0])
+    response['Vary'] = 'Accept'
+    return response
+
+# Helper to add a Link header pointing at the next page (if there is one)
+def link_next_page(request, response, cursor):
+    if cursor is not None:
+        params = request.GET.copy()
+        params['after'] = cursor
+        response['Link'] = '<%s?%s>; rel="next"' % (request.path, params.urlencode())
+    return response
+
+# Helper to find all reports within radius km of a point, nearest first
+# Returns a list of (distance, report id) tuples. The geohash index and
+# a bounding box narrow the candidates before the exact haversine check.
+def reports_near(lat, lng, radius):
+    box = bounding_box(lat, lng, radius)
+    min_lat, max_lat, min_lng, max_lng = box
+    candidates = Report.objects.filter(latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lng, max_lng))
+    prefixes = covering_prefixes(box)
+    if prefixes:
+        cells = Q()
+        for prefix in prefixes:
+            cells |= Q(geohash__gte=prefix, geohash__lt=prefix_upper_bound(prefix))
+        candidates = candidates.filter(cells)
+    found = []
+    for r_id, r_lat, r_lng in candidates.values_list('id', 'latitude', 'longitude'):
+        dist = haversine(lat, lng, r_lat, r_lng)
+        if dist <= radius:
+            found.append((dist, r_id))
+    found.sort()
+    return found
+
+# Helper to build the URL a stored blob can be fetched from
+def blob_url(blob_id):
+    return reverse('blob', kwargs={'blob_id': blob_id}) if blob_id else None
+
+# Helper to JSON encode an image for a list: its id and thumbnail URL
+# (the original stands in until the thumbnail has been made)
+def encode_image(img):
+    return {'id': img.id, 'thumb_url': blob_url(img.thumb_blob or img.img_blob)}
+
+# Helper to JSON encode an image with links to all its variants
+def encode_image_details(img):
+    i_dict = encode_image(img)
+    i_dict.update({
+        'blob': img.img_blob,
+        'url': blob_url(img.large_blob or img.img_blob), # capped resolution
+        'original_url': blob_url(img.img_blob),
+    })
+    return i_dict
+
+# Helper to decode and check an uploaded base64 image, then store it
+# Returns the blob id ('' if no image was sent); raises ValueError saying
+# what's wrong. Only the header is read here, the variants are made later.
+def store_image(b64):
     try:
-        author = msg.written_by.profile.name
-        a_img = msg.written_by.profile.img_data
+        data = decode_base64(b64)
+    except ValueError:
+        raise ValueError('Image data must be base64 encoded')
+    if not data:
+        return ''
+    image_info(data)
+    return blob_store().put(data)
+
+# Helper for an author's name and avatar (thumbnail) URL
+def encode_author(account):
+    try:
+        profile = account.profile
+        return (account.public_id, profile.name, blob_url(profile.thumb_blob or profile.img_blob))
     except Profile.DoesNotExist:
-        pass # remain anonymous
+        return (account.public_id, 'Anonymous', None)
+
+# Helper to read (once per request) the version stamps a resource's JSON
+# depends on, for the conditional GET functions below. None if there's no
+# such resource or no valid session, in which case the view says so.
+def resource_versions(request, stamps):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if not hasattr(request, 'cwx_versions'):
+        request.cwx_versions = None
+        try:
+            account_from_session(request)
+            request.cwx_versions = stamps.first()
+        except Account.DoesNotExist:
+            pass
+    return request.cwx_versions
+
+# A report changes when it's updated and with its author's profile
+def report_versions(request, report_id):
+    return resource_versions(request, Report.objects.filter(id=report_id)
+        .values_list('updated_on', 'reported_by__profile__updated_on'))
+
+# A message (and its images) with its report's updates and author's profile
+def message_versions(request, report_id, message_id, **kwargs):
+    return resource_versions(request, Message.objects.filter(id=message_id,
+        about_report__id=report_id).values_list('written_on', 'about_report__updated_on',
+        'written_by__profile__updated_on'))
+
+def versions_etag(versions):
+    return hashlib.md5(repr(versions)).hexdigest() if versions else None
 
-    # create a sub-list of photo data for this message
-    m_photos = [{'id': img.id, 'data': img.img_data} for img in msg.images.all()]
+# Each response format is a different representation, with its own ETag
+def format_etag(request, etag):
+    fmt = negotiate(request)
+    return etag if etag is None or fmt == serializers.DEFAULT_FORMAT else '%s-%s' % (etag, fmt)
+
+def versions_modified(versions):
+    stamps = [v for v in versions if v] if versions else []
+    return max(stamps) if stamps else None
+
+def report_etag(request, report_id):
+    return format_etag(request, versions_etag(report_versions(request, report_id)))
+
+def report_modified(request, report_id):
+    return versions_modified(report_versions(request, report_id))
+
+def message_etag(request, report_id, message_id):
+    return format_etag(request, versions_etag(message_versions(request, report_id, message_id)))
+
+def message_modified(request, report_id, message_id):
+    return versions_modified(message_versions(request, report_id, message_id))
+
+# Images never change, only gain variants, so their blob ids are their ETag
+def image_etag(request, report_id, message_id, image_id):
+    blobs = resource_versions(request, MessageImage.objects.filter(id=image_id,
+        on_message__id=message_id, on_message__about_report__id=report_id)
+        .values_list('img_blob', 'thumb_blob', 'large_blob'))
+    return format_etag(request, versions_etag(blobs))
+
+# Helpers to load everything the encoders below touch in a constant number
+# of queries, however many rows are in the list
+def with_report_details(reports):
+    return reports.select_related('reported_by__profile')
+
+def with_message_details(messages):
+    return messages.select_related('written_by__profile').prefetch_related('images')
+
+# Helper to convert message to JSON encodable dict
+def encode_message(msg):
+    # create a sub-list of photo links for this message
+    m_photos = [encode_image(img) for img in msg.images.all()]
 
     # create the dictionary for this message
     return {
         'id': msg.id,
-        # who wrote the message? hash(email), name, image
-        'author': (hash_password(msg.written_by.account_key), author, a_img),
+        # who wrote the message? public id, name, image url
+        'author': encode_author(msg.written_by),
         'date_time': msg.written_on.isoformat(),
-        'reply_to': msg.reply_to.id if msg.reply_to else None,
+        'reply_to': msg.reply_to_id,
         'text': msg.message_text,
         'images': m_photos,
     }
 
 # Helper to convert report to JSON encodable dict
 def encode_report(rep):
-    # pull out details of the author
-    author, a_img = 'Anonymous', None
-    try:
-        author = rep.reported_by.profile.name
-        a_img = rep.reported_by.profile.img_data
-    except Profile.DoesNotExist:
-        pass # remain anonymous
-
     # create the dictionary for this report
     return {
         'id': rep.id,
-        # who wrote the report originally? hash(email), name, image
-        'author': (hash_password(rep.reported_by.account_key), author, a_img),
+        # who wrote the report originally? public id, name, image url
+        'author': encode_author(rep.reported_by),
         'date_time': rep.reported_on.isoformat(),
         'title': rep.title,
         'coord': (rep.latitude, rep.longitude),
+        'last_activity': rep.last_activity.isoformat() if rep.last_activity else None,
+        'message_count': rep.message_count,
+        'image_count': rep.image_count,
+        'subscriber_count': rep.subscriber_count,
     }
 
+# How to encode each kind of cached fragment, and who wrote it
+FRAGMENT_ENCODERS = {
+    'report': (encode_report, 'reported_by_id'),
+    'message': (encode_message, 'written_by_id'),
+}
+
 
 
 
@@ -100,9 +347,7 @@ def reports(request):
         r_lng = request.POST.get("longitude", None)
         # ensure we've been given all three fields
         if r_title is None or r_lat is None or r_lng is None:
-            print r_title
-            print r_lat
-            print r_lng
+            logger.debug('incomplete report: title=%r latitude=%r longitude=%r', r_title, r_lat, r_lng)
             return HttpResponseBadRequest('Reports need title, latitude and longitude')
         # make a new report then redirect to the report info url
         n_report = Report(reported_by=account, title=r_title, 
@@ -113,7 +358,9 @@ def reports(request):
     # TODO: If adding get all then change this
     return HttpResponseNotAllowed('Not implemented')
 
-# List all reports where title contains given keyword
+# List all reports whose title matches the given words, best matches first
+# Paged with ?after=<cursor>&limit=N. Without a full text index this falls
+# back to a substring match in id order, the cursor then being the id.
 @require_http_methods(["GET"])
 def search_report_title(request, keyword):
     # ensure the session corresponds to valid user
@@ -122,12 +369,27 @@ def search_report_title(request, keyword):
     except Account.DoesNotExist:
         return HttpResponse(content='Invalid session', status=401, 
             reason='Session key does not correspond to user account')
+    ranked = search.fts_available('report')
+    try:
+        after = page_after_ranked(request) if ranked else page_after(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    limit = page_limit(request)
     # let the database do the hard work
-    r_list = [encode_report(r) for r in \
-        Report.objects.filter(title__icontains=keyword).annotate(num_msg=Count('messages'))]
-    return HttpResponse(content=json.dumps(r_list), content_type='application/json')
+    if ranked:
+        page, cursor = split_ranked_page(
+            search.search('report', keyword, limit + 1, after), limit)
+    else:
+        r_query = Report.objects.filter(title__icontains=keyword).order_by('id')
+        if after is not None:
+            r_query = r_query.filter(id__gt=after)
+        page, cursor = split_page(r_query.values_list('id', flat=True)[:limit + 1], limit)
+    response = stream_json(request, page, 'report', lambda ids: with_report_details(
+        Report.objects.filter(id__in=ids)))
+    return link_next_page(request, response, cursor)
 
-# List all reports within a given radius of a point
+# List all reports within a given radius (km) of a point, nearest first
+# Paged with ?after=<cursor>&limit=N, the cursor being "<distance>_<id>"
 @require_http_methods(["GET"])
 def search_report_location(request, lat, lng, radius):
     # ensure the session corresponds to valid user
@@ -136,9 +398,23 @@ def search_report_location(request, lat, lng, radius):
     except Account.DoesNotExist:
         return HttpResponse(content='Invalid session', status=401, 
             reason='Session key does not correspond to user account')
-    # TODO: lookup the real set 
-    r_list = [encode_report(r) for r in Report.objects.all()[:10]]
-    return HttpResponse(content=json.dumps(r_list), content_type='application/json')
+    lat, lng, radius = float(lat), float(lng), float(radius)
+    if abs(lat) > 90.0 or abs(lng) > 180.0:
+        return HttpResponseBadRequest('Coordinates out of range')
+    # read the cursor left by the previous page, if any
+    try:
+        after = page_after_ranked(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    limit = page_limit(request)
+    # find everything in range and cut out the requested page
+    found = reports_near(lat, lng, radius)
+    if after is not None:
+        found = [f for f in found if f > after]
+    page, cursor = split_ranked_page(found, limit)
+    response = stream_json(request, page, 'report',
+        lambda ids: with_report_details(Report.objects.filter(id__in=ids)))
+    return link_next_page(request, response, cursor)
 
 # List all reports that this person is subscribed to
 # NOTE: reports are auto-subscribed, but could be unsubscribed
@@ -151,12 +427,23 @@ def subscribed_reports(request):
     except Account.DoesNotExist:
         return HttpResponse(content='Invalid session', status=401, 
             reason='Session key does not correspond to user account')
-    # lookup reports subscribed by this account
-    r_list = [encode_report(r) for r in Report.objects.filter(observers__account=account)]
-    return HttpResponse(content=json.dumps(r_list), content_type='application/json')
+    try:
+        after = page_after(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    limit = page_limit(request)
+    # lookup reports subscribed by this account, a page at a time in id order
+    r_query = Report.objects.filter(observers__account=account).order_by('id')
+    if after is not None:
+        r_query = r_query.filter(id__gt=after)
+    page, cursor = split_page(r_query.values_list('id', flat=True)[:limit + 1], limit)
+    response = stream_json(request, page, 'report', lambda ids: with_report_details(
+        Report.objects.filter(id__in=ids)))
+    return link_next_page(request, response, cursor)
 
 # Get details of the specific report
 @require_http_methods(["GET"])
+@condition(etag_func=report_etag, last_modified_func=report_modified)
 def report_details(request, report_id):
     # ensure the session corresponds to valid user
     try:
@@ -164,12 +451,12 @@ def report_details(request, report_id):
     except Account.DoesNotExist:
         return HttpResponse(content='Invalid session', status=401, 
             reason='Session key does not correspond to user account')
-    # make sure the report exists
-    try:
-        report = Report.objects.get(id=report_id)
-        return HttpResponse(content=json.dumps(encode_report(report)), content_type='application/json')
-    except Report.DoesNotExist:
+    # make sure the report exists (already looked up for the ETag)
+    if report_versions(request, report_id) is None:
         return HttpResponseNotFound('No such report')
+    r_json = json_fragments('report', [int(report_id)],
+        lambda ids: with_report_details(Report.objects.filter(id__in=ids)), negotiate(request))
+    return render_serialized(request, r_json[int(report_id)])
 
 # Subscribe (PUT) & unsubscribe (DELETE) to the given report
 @require_http_methods(["PUT", "DELETE"])
@@ -186,12 +473,17 @@ def report_subscription(request, report_id):
     except Report.DoesNotExist:
         return HttpResponseNotFound('No such report')
     # decide if this is a subscribe request or unsubscribe request
+    # (the report's JSON shows its subscriber count)
     if request.method == "PUT":
         the_sub, created = ReportSubscription.objects.get_or_create(account=account, report=report)
+        if created:
+            fragment_cache.invalidate('report', report.id)
         return HttpResponse(content='OK') # TODO: anything else?
     elif request.method == "DELETE":
-        # Delete the subscription 
-        ReportSubscription.objects.filter(account=account, report=report).delete()
+        # Delete the subscription (one at most) so it's counted
+        for the_sub in ReportSubscription.objects.filter(account=account, report=report):
+            the_sub.delete()
+            fragment_cache.invalidate('report', report.id)
         return HttpResponse(content='OK', status=204)
 
 
@@ -199,7 +491,7 @@ def report_subscription(request, report_id):
 
 # Create new message for a report or read list of messages
 # C - POST: report/<id>/messages/
-# R - GET:  
+# R - GET:  report/<id>/messages/?after=<id>&limit=N
 @require_http_methods(["GET", "POST"])
 def messages(request, report_id):
     # ensure the session corresponds to valid user
@@ -222,7 +514,7 @@ def messages(request, report_id):
         m_reply = request.POST.get('reply_to', None)
         # ensure the message text is valid
         if m_text is None:
-            print "message text"
+            logger.debug('message without text')
             return HttpResponseBadRequest('Message text is required')
         # if in reply then make sure that message exists for this report
         r_msg = None
@@ -230,31 +522,177 @@ def messages(request, report_id):
             try:
                 r_msg = Message.objects.get(about_report=report, id=m_reply)
             except Message.DoesNotExist:
-                print "reply problem"
-                print "'%s'" % m_reply
+                logger.debug('reply to unknown message %r', m_reply)
                 return HttpResponseBadRequest('Message reply invalid for this report')
+            if r_msg.thread_depth >= THREAD_MAX_DEPTH:
+                return HttpResponseBadRequest('Thread is too deep to reply to this message')
+        # store any attached image before anything is written
+        img_blob = None
+        img_data = request.POST.get("img_data", None)
+        if img_data is not None:
+            try:
+                img_blob = store_image(img_data)
+            except ValueError as e:
+                return HttpResponseBadRequest(str(e))
         # all good so create the message and save it
         n_msg = Message(about_report=report, written_by=account, reply_to=r_msg,
             message_text=m_text)
         n_msg.save()
 
-        img_data = request.POST.get("img_data", None)
-        if img_data is not None:
-        	m_img = MessageImage(on_message=n_msg, img_data=img_data)
-	        m_img.save()
+        if img_blob:
+            m_img = MessageImage(on_message=n_msg, img_blob=img_blob)
+            m_img.save()
+            thumbnails.pipeline.submit(thumbnails.message_image_variants, m_img.id)
+
+        # let the subscribers know (the push workers do the actual sending)
+        fanout.enqueue(n_msg)
+        fragment_cache.invalidate('report', report.id)
+        feed.watcher.notify(n_msg.id)
 
         # and return redirect to that message
         return redirect('message-details', report_id=report.id, message_id=n_msg.id)
 
     elif request.method == "GET": # a little redundant but anyway
-        # manually serialize the reports messages into a JSON array
-        m_list = [encode_message(m) for m in report.messages.all()]
-        # and then transmit as JSON to the client
-        return HttpResponse(content=json.dumps(m_list), content_type='application/json')
+        # messages come newest first, a page at a time after the given id
+        try:
+            after = page_after(request)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor')
+        limit = page_limit(request)
+        m_query = report.messages.order_by('-written_on', '-id')
+        if after is not None:
+            try:
+                a_when = report.messages.values_list('written_on', flat=True).get(id=after)
+            except Message.DoesNotExist:
+                return HttpResponseBadRequest('Invalid cursor')
+            m_query = m_query.filter(Q(written_on__lt=a_when) | Q(written_on=a_when, id__lt=after))
+        page, cursor = split_page(m_query.values_list('id', flat=True)[:limit + 1], limit)
+        # and stream the messages to the client as a JSON array
+        response = stream_json(request, page, 'message', lambda ids: with_message_details(
+            Message.objects.filter(id__in=ids)))
+        return link_next_page(request, response, cursor)
+
+# Full text search of a report's messages, best matches first
+# Paged like search_report_title (by id, newest first, without an index)
+# R - GET: report/<id>/messages/search/<keyword>/?after=<cursor>&limit=N
+@require_http_methods(["GET"])
+def search_messages(request, report_id, keyword):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    # make sure the report exists
+    try:
+        report = Report.objects.get(id=report_id)
+    except Report.DoesNotExist:
+        return HttpResponseNotFound('No such report')
+    ranked = search.fts_available('message')
+    try:
+        after = page_after_ranked(request) if ranked else page_after(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    limit = page_limit(request)
+    if ranked:
+        page, cursor = split_ranked_page(search.search('message', keyword, limit + 1, after,
+            within=('t.about_report_id = %s', [report.id])), limit)
+    else:
+        m_query = report.messages.filter(message_text__icontains=keyword).order_by('-id')
+        if after is not None:
+            m_query = m_query.filter(id__lt=after)
+        page, cursor = split_page(m_query.values_list('id', flat=True)[:limit + 1], limit)
+    response = stream_json(request, page, 'message', lambda ids: with_message_details(
+        Message.objects.filter(id__in=ids)))
+    return link_next_page(request, response, cursor)
+
+# Helper to wait up to timeout seconds for messages newer than `after`
+# Returns the new messages from the query, oldest first
+def wait_for_messages(m_query, after, limit, timeout):
+    deadline = time.time() + timeout
+    seen = after
+    while True:
+        found = list(with_message_details(m_query.filter(id__gt=after)).order_by('id')[:limit])
+        remaining = deadline - time.time()
+        if found or remaining <= 0:
+            return found
+        # don't hold on to a database connection while idle
+        connection.close()
+        seen = max(seen, feed.watcher.wait(seen, remaining))
+
+# Helper to serve a feed of the messages in the query, from the last seen
+# id (Last-Event-ID or ?after=) or else from now on. Clients accepting
+# text/event-stream get Server-Sent Events for FEED_STREAM_SECONDS, anyone
+# else a long-poll answered as soon as there's something new (or after
+# ?timeout= seconds, at most FEED_TIMEOUT, with an empty list).
+def message_feed(request, m_query):
+    try:
+        after = request.META.get('HTTP_LAST_EVENT_ID', None) or request.GET.get('after', None)
+        after = int(after) if after is not None else \
+            Message.objects.aggregate(top=Max('id'))['top'] or 0
+        timeout = min(float(request.GET.get('timeout', settings.FEED_TIMEOUT)),
+            settings.FEED_TIMEOUT)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor or timeout')
+    limit = page_limit(request)
+
+    if 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+        m_list = [encode_message(m) for m in wait_for_messages(m_query, after, limit, timeout)]
+        response = render(request, m_list)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def events(last):
+        deadline = time.time() + settings.FEED_STREAM_SECONDS
+        yield 'retry: 2000\n\n'
+        while True:
+            remaining = deadline - time.time()
+            found = wait_for_messages(m_query, last, limit,
+                min(remaining, settings.FEED_KEEPALIVE))
+            for m in found:
+                yield 'id: %d\nevent: message\ndata: %s\n\n' % (m.id, json.dumps(encode_message(m)))
+                last = m.id
+            if remaining <= 0:
+                break
+            if not found:
+                yield ': keepalive\n\n'
+    response = StreamingHttpResponse(events(after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# Feed of new messages on a report (long-poll or Server-Sent Events)
+# R - GET: report/<id>/feed/?after=<id>&timeout=<seconds>
+@require_http_methods(["GET"])
+def report_feed(request, report_id):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    # make sure the report exists
+    try:
+        report = Report.objects.get(id=report_id)
+    except Report.DoesNotExist:
+        return HttpResponseNotFound('No such report')
+    return message_feed(request, report.messages.all())
+
+# Feed of new messages on every report this person is subscribed to
+# R - GET: reports/subscribed/feed/?after=<id>&timeout=<seconds>
+@require_http_methods(["GET"])
+def subscribed_feed(request):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    return message_feed(request, Message.objects.filter(about_report__observers__account=account))
 
 # Get details about a message
 # TODO: do we want to make these updateable??
 @require_http_methods(["GET"])
+@condition(etag_func=message_etag, last_modified_func=message_modified)
 def message(request, report_id, message_id):
     # ensure the session corresponds to valid user
     try:
@@ -262,17 +700,59 @@ def message(request, report_id, message_id):
     except Account.DoesNotExist:
         return HttpResponse(content='Invalid session', status=401, 
             reason='Session key does not correspond to user account')
-    # make sure the message+report exists
+    # make sure the message+report exists (already looked up for the ETag)
+    if message_versions(request, report_id, message_id) is None:
+        return HttpResponseNotFound('No such report/message exists')
+    # as we're simply getting the message json
+    m_json = json_fragments('message', [int(message_id)],
+        lambda ids: with_message_details(Message.objects.filter(id__in=ids)), negotiate(request))
+    return render_serialized(request, m_json[int(message_id)])
+
+# Get a message and the replies under it as a nested thread
+# Each message lists its replies (oldest first) in "replies", down to
+# ?depth= levels below this one (at most THREAD_MAX_DEPTH) and up to
+# ?limit= messages in all (at most MAX_THREAD_SIZE), shallowest first;
+# "truncated" says whether the limit left some out. The whole subtree is
+# one range of the thread path index, so it's read in one query.
+# R - GET: report/<id>/message/<id>/thread/?depth=N&limit=N
+@require_http_methods(["GET"])
+def message_thread(request, report_id, message_id):
+    # ensure the session corresponds to valid user
     try:
-        message = Message.objects.get(id=message_id, about_report__id=report_id)
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    # make sure the message+report exists, and find where its replies are
+    try:
+        path, depth = Message.objects.filter(id=message_id, about_report__id=report_id) \
+            .values_list('thread_path', 'thread_depth').get()
     except Message.DoesNotExist:
         return HttpResponseNotFound('No such report/message exists')
-    # as we're simply getting the message json
-    return HttpResponse(content=json.dumps(encode_message(message)),
-        content_type='application/json')
+    try:
+        below = min(int(request.GET.get('depth', THREAD_DEPTH)), THREAD_MAX_DEPTH)
+        limit = min(int(request.GET.get('limit', THREAD_SIZE)), MAX_THREAD_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid depth or limit')
+    if below < 0 or limit < 1:
+        return HttpResponseBadRequest('Invalid depth or limit')
+    path += thread_segment(int(message_id))
+    m_query = Message.objects.filter(Q(id=message_id) | Q(thread_path__gte=path,
+        thread_path__lt=path + '~', thread_depth__lte=depth + below)).order_by('thread_depth', 'id')
+    found = list(with_message_details(m_query)[:limit + 1])
+    # parents come before their replies, being shallower
+    nodes = {}
+    for msg in found[:limit]:
+        node = nodes[msg.id] = encode_message(msg)
+        node['replies'] = []
+        if msg.id != int(message_id):
+            nodes[msg.reply_to_id]['replies'].append(node)
+    return render(request, {'thread': nodes[int(message_id)], 'size': len(nodes),
+        'truncated': len(found) > limit})
 
 # Get or add images to the given report/message
 @require_http_methods(["GET", "POST"])
+@condition(etag_func=message_etag, last_modified_func=message_modified)
 def message_images(request, report_id, message_id):
     # ensure the session corresponds to valid user
     try:
@@ -290,17 +770,27 @@ def message_images(request, report_id, message_id):
         img_data = request.POST.get("img_data", None)
         if img_data is None:
             return HttpResponseBadRequest('Image data must be given')
-        m_img = MessageImage(on_message=message, img_data=img_data)
+        try:
+            img_blob = store_image(img_data)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        if not img_blob:
+            return HttpResponseBadRequest('Image data must be given')
+        m_img = MessageImage(on_message=message, img_blob=img_blob)
         m_img.save()
+        fragment_cache.invalidate('message', message.id)
+        fragment_cache.invalidate('report', message.about_report_id)
+        thumbnails.pipeline.submit(thumbnails.message_image_variants, m_img.id)
         return redirect('message-image', report_id=m_img.on_message.about_report.id, 
             message_id=m_img.on_message.id, image_id=m_img.id)
     elif request.method == "GET":
         # lookp the the set of images for this message and return them
-        img_list = [{'id': i.id, 'data': i.img_data} for i in message.images.all()]
-        return HttpResponse(content=json.dumps(img_list), content_type='application/json')
+        img_list = [encode_image(i) for i in message.images.all()]
+        return render(request, img_list)
 
 # Get the image data for the given image
 @require_http_methods(["GET"])
+@condition(etag_func=image_etag)
 def message_image(request, report_id, message_id, image_id):
     # ensure the session corresponds to valid user
     try:
@@ -312,15 +802,24 @@ def message_image(request, report_id, message_id, image_id):
     try:
         img = MessageImage.objects.get(id=image_id, on_message__id=message_id, 
             on_message__about_report__id=report_id)
-        # encode the image data 
-        return HttpResponse(content=json.dumps({'id': img.id, 'data': img.img_data}), 
-            content_type='application/json')
+        # encode the image data (read back from the blob store), which is
+        # sent as raw bytes in binary formats and base64 in JSON
+        i_dict = encode_image_details(img)
+        i_dict['data'] = Binary(blob_store().read(img.img_blob))
+        return render(request, i_dict)
     except MessageImage.DoesNotExist:
         return HttpResponseNotFound('No such report/message/image exists')
 
 
 # ********* PROFILE CREATION                    *********
 
+# Helper to turn requests away while password hashing is overloaded
+def hashing_busy():
+    response = HttpResponse(content='Too busy, try again shortly', status=503,
+        reason='Service Unavailable')
+    response['Retry-After'] = '1'
+    return response
+
 # Create an acccount
 # C - POST: auth/profile/
 @require_http_methods(["POST"])
@@ -336,16 +835,30 @@ def new_account(request):
     # ensure both the username and password were given
     if username is None or password is None:
         return HttpResponseBadRequest("Missing username or password")
+    # throttle sign ups from one address before touching the database
+    limited = ratelimit.check(('signup-ip', ratelimit.client_ip(request)))
+    if limited:
+        return limited
+    # and that any image sent is valid
+    try:
+        person_img = store_image(person_img)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
     
     # create a new account 
     u_norm = username.lower()
-    p_hash = hash_password(password)
+    try:
+        p_hash = passwords.hash_password(password)
+    except passwords.Busy:
+        return hashing_busy()
     n_account = Account(account_key=u_norm, passphrase=p_hash)
     n_account.save()
     # and then a profile for this new account
     n_profile = Profile(name=person_name, location=person_loc,
-        bio=person_bio, img_data=person_img, account=n_account)
+        bio=person_bio, img_blob=person_img, account=n_account)
     n_profile.save()
+    if person_img:
+        thumbnails.pipeline.submit(thumbnails.profile_variants, n_account.id)
 
     # create a session for the new account and send the key
     u_session = Session(key=session_hash(), account=n_account)
@@ -367,12 +880,21 @@ def account(request):
     name = posted.get('real_name', profile.name)
     location = posted.get('location', profile.location)
     bio = posted.get('bio', profile.bio)
-    img_b64 = posted.get('img_data', profile.img_data)
+    img_b64 = posted.get('img_data', None)
+    if img_b64 is not None:
+        try:
+            profile.img_blob = store_image(img_b64)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        profile.thumb_blob = '' # until the new one is made
     profile.name = name
     profile.location = location
     profile.bio = bio
-    profile.img_data = img_b64
     profile.save()
+    # everything showing this author's name/image is now out of date
+    fragment_cache.invalidate_author(account.id)
+    if img_b64:
+        thumbnails.pipeline.submit(thumbnails.profile_variants, account.id)
     return HttpResponse(content='OK')
 
 
@@ -385,26 +907,33 @@ def new_session(request):
     # pull out the POSTed username and password
     username = request.POST.get('username', None)
     password = request.POST.get('password', None)
-    print username, password
+    logger.debug('login attempt for %r', username)
 
     # ensure both username and password were given
     if username is None or password is None:
         return HttpResponseBadRequest("Missing username or password")
 
-    # hash the password and lookup the pair
+    # throttle guessing from one address and at one account before
+    # touching the database
     u_norm = username.lower()
-    p_hash = hash_password(password)
-    print u_norm, p_hash
-    try:
-        # lookup the user account, create the session and redirect
-        user = Account.objects.get(account_key=u_norm, passphrase=p_hash)
-        u_session = Session(key=session_hash(), account=user)
-        u_session.save() # persist the session with that key
-        return redirect('existing-session', key=u_session.key)
-    except Account.DoesNotExist:
+    limited = ratelimit.check(('login-ip', ratelimit.client_ip(request)),
+        ('login-account', u_norm))
+    if limited:
+        return limited
+
+    # lookup the user account and then check the password against its hash
+    try:
+        user = passwords.authenticate(list(Account.objects.filter(account_key=u_norm)), password)
+    except passwords.Busy:
+        return hashing_busy()
+    if user is None:
         # invalid username or password so return a 401
         return HttpResponse(content='Invalid username or password', status=401,
             reason='Authentication failed')
+    # create the session and redirect
+    u_session = Session(key=session_hash(), account=user)
+    u_session.save() # persist the session with that key
+    return redirect('existing-session', key=u_session.key)
 
 # Session management
 # R - GET:  auth/session/<key>/
@@ -413,18 +942,315 @@ def new_session(request):
 def session(request, key):
     # All of the three methods require the session object
     try:
-        s_obj = Session.objects.get(key=key)
+        s_obj = Session.objects.get(key=key, expires_on__gt=timezone.now())
     except Session.DoesNotExist:
         return HttpResponseNotFound("No such session")
 
     # Check the request method
     if request.method == "GET":
         # Want to get the session file
-        return HttpResponse(content=s_obj.to_json(), content_type='application/json')
+        return render(request, s_obj.to_dict())
     elif request.method == "DELETE":
         # Delete the session - i.e. log out
         s_obj.delete()
+        session_cache.invalidate(key)
         return HttpResponse(content='OK', status=204)
 
+# Session cache counters, for sizing the cache (administrators only)
+# R - GET: auth/session/cache/
+@require_http_methods(["GET"])
+def session_cache_stats(request):
+    try:
+        if not is_admin(request):
+            return HttpResponse(content='Administrators only', status=403)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    return render(request, session_cache.stats())
+
+
+# ********* CACHES                         *********
+
+# Hit rate and counters of the report/message JSON cache (administrators only)
+# R - GET: fragments/stats/
+@require_http_methods(["GET"])
+def fragment_stats(request):
+    try:
+        if not is_admin(request):
+            return HttpResponse(content='Administrators only', status=403)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    return render(request, fragment_cache.stats())
+
+
+# ********* PUSH NOTIFICATIONS             *********
+
+# Push queue depth, delivery lag and failed events (administrators only)
+# R - GET: push/stats/
+@require_http_methods(["GET"])
+def push_stats(request):
+    try:
+        if not is_admin(request):
+            return HttpResponse(content='Administrators only', status=403)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    return render(request, fanout.stats())
+
+
+# ********* BULK IMPORT AND EXPORT         *********
+
+# Helper to get the format of a bulk import or export: ?format=, else CSV
+# if that's what was sent, else NDJSON (None if it's neither)
+def bulk_format(request):
+    fmt = request.GET.get('format', None) or \
+        ('csv' if request.META.get('CONTENT_TYPE', '').startswith('text/csv') else 'ndjson')
+    return fmt if fmt in bulk.CONTENT_TYPES else None
+
+# Import reports and messages from NDJSON or CSV (see api/bulk.py), read
+# from the body as it arrives, by the administrator sending them
+# Answers with the import job. If it fails part way the 503 carries the
+# job too; sending the same body again with ?job=<id> carries on after the
+# rows already written.
+# C - POST: reports/import/?format=ndjson|csv[&job=<id>]
+@require_http_methods(["POST"])
+def import_reports(request):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    if account.account_key not in getattr(settings, 'ADMIN_ACCOUNTS', ()):
+        return HttpResponse(content='Administrators only', status=403)
+    if 'job' in request.GET:
+        try:
+            job = ImportJob.objects.get(id=int(request.GET['job']), account=account)
+        except (ValueError, ImportJob.DoesNotExist):
+            return HttpResponseNotFound('No such import')
+    else:
+        fmt = bulk_format(request)
+        if fmt is None:
+            return HttpResponseBadRequest('Imports are ndjson or csv')
+        job = ImportJob.objects.create(account=account, format=fmt)
+    status = 200
+    if not job.finished:
+        try:
+            bulk.run_import(job, request)
+        except DatabaseError:
+            logger.exception('import %d failed after %d rows', job.id, job.rows_done)
+            status = 503
+    return render(request, job.to_dict(), status)
+
+# Stream every report (after the id ?after=) and its messages as NDJSON or
+# CSV, in the form imports take
+# R - GET: reports/export/?format=ndjson|csv[&after=<id>]
+@require_http_methods(["GET"])
+def export_reports(request):
+    # a session for an administrator, not the metrics token, as this is
+    # every report and message
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    if account.account_key not in getattr(settings, 'ADMIN_ACCOUNTS', ()):
+        return HttpResponse(content='Administrators only', status=403)
+    fmt = bulk_format(request)
+    if fmt is None:
+        return HttpResponseBadRequest('Exports are ndjson or csv')
+    try:
+        after = page_after(request) or 0
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    rows = bulk.export_rows(after=after)
+    return StreamingHttpResponse(bulk.format_rows(rows, fmt),
+        content_type=bulk.CONTENT_TYPES[fmt])
+
+
+# ********* INSTRUMENTATION                *********
+
+# Helper to check the request comes from an administrator: a session for
+# one of ADMIN_ACCOUNTS, or (for scrapers) "Authorization: Bearer <token>"
+# with METRICS_TOKEN
+def is_admin(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.META.get('HTTP_AUTHORIZATION', '') == 'Bearer ' + token:
+        return True
+    account = account_from_session(request) # Account.DoesNotExist if no session
+    return account.account_key in getattr(settings, 'ADMIN_ACCOUNTS', ())
+
+# Request histograms and counters, in the Prometheus text format
+# R - GET: metrics/
+@require_http_methods(["GET"])
+def metrics_text(request):
+    try:
+        if not is_admin(request):
+            return HttpResponse(content='Administrators only', status=403)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    return HttpResponse(content=metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ********* IMAGE BLOBS                    *********
+
+# Single "bytes=start-end" range requests, the only kind clients send
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Stream the raw bytes of a stored blob
+# Blobs never change, so the id doubles as a strong ETag
+# R - GET: blob/<sha256>/
+@require_http_methods(["GET"])
+def blob(request, blob_id):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    store = blob_store()
+    if not store.exists(blob_id):
+        return HttpResponseNotFound('No such blob')
+    etag = '"%s"' % blob_id
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    # work out which bytes were asked for
+    size = store.size(blob_id)
+    start, end, status = 0, size - 1, 200
+    m_range = RANGE_RE.match(request.META.get('HTTP_RANGE', ''))
+    if m_range and (m_range.group(1) or m_range.group(2)):
+        if m_range.group(1):
+            start = int(m_range.group(1))
+            if m_range.group(2):
+                end = min(int(m_range.group(2)), size - 1)
+        else: # suffix range i.e. the last N bytes
+            start = max(size - int(m_range.group(2)), 0)
+        if start > end:
+            response = HttpResponse(content='Range not satisfiable', status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        status = 206
+
+    with store.open(blob_id) as f:
+        c_type = sniff_content_type(f.read(16))
+    response = StreamingHttpResponse(store.stream(blob_id, start, end - start + 1),
+        content_type=c_type, status=status)
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000'
+    if status == 206:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    return response
+
+
+# ********* BATCHED REQUESTS               *********
+
+# Headers saying where a request came from, which batch items take from the
+# batch itself (so rate limits per address count them all) and can't set
+FORWARDING_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP')
+
+# Endpoints that can't be batch items: feeds hold the request open, import
+# reads the request as it streams in, and export and blobs answer with more
+# (or other) than a JSON item can hold
+BATCH_EXCLUDED = ('batch', 'report-feed', 'subscribed-feed', 'import-reports',
+    'export-reports', 'blob')
 
+# Helper to build the request for one item of a batch
+# The item gives the method, the path (relative to the API root, with any
+# query string), an optional form body (string or dict) and headers.
+# Raises ValueError if the item sets a forwarding header.
+def batch_sub_request(request, account, item):
+    method = str(item.get('method', 'GET')).upper()
+    path, _, query = item['path'].lstrip('/').partition('?')
+    if path.startswith('api/'):
+        path = path[len('api/'):]
+    body = item.get('body', '')
+    if isinstance(body, dict):
+        body = urlencode(body)
+    sub = HttpRequest()
+    sub.method = method
+    sub.path = sub.path_info = reverse('batch')[:-len('batch/')] + path
+    sub.META = dict((k, v) for k, v in request.META.items() if not k.startswith('HTTP_')
+        or k == 'HTTP_X_CWX_SESSION_KEY' or k in FORWARDING_HEADERS)
+    sub.META.update({'REQUEST_METHOD': method, 'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': str(len(body))})
+    for name, value in item.get('headers', {}).items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in FORWARDING_HEADERS:
+            raise ValueError('Batch items cannot set %s' % name)
+        sub.META[key] = value
+    sub.GET = QueryDict(query)
+    sub.POST = QueryDict(body) if method == 'POST' else QueryDict('')
+    sub._body = body.encode('utf-8') if isinstance(body, unicode) else body
+    sub.cwx_account = account
+    # items answer in JSON; the batch as a whole is in the negotiated format
+    sub.cwx_format = serializers.DEFAULT_FORMAT
+    return sub, '/' + path
+
+# Helper to run one item of a batch and describe its response
+def batch_run(request, account, item):
+    try:
+        sub, path = batch_sub_request(request, account, item)
+        match = resolve(path, urlconf='api.urls')
+    except (KeyError, AttributeError, TypeError):
+        return {'status': 400, 'headers': {}, 'body': 'Malformed batch item'}
+    except ValueError as e:
+        return {'status': 400, 'headers': {}, 'body': '%s' % e}
+    except Http404:
+        return {'status': 404, 'headers': {}, 'body': 'No such endpoint'}
+    if match.url_name == 'batch':
+        return {'status': 400, 'headers': {}, 'body': 'Batches cannot be nested'}
+    if match.url_name in BATCH_EXCLUDED:
+        return {'status': 400, 'headers': {}, 'body': 'Cannot be part of a batch'}
+    # each item costs the session a request, as it would sent on its own
+    limited = ratelimit.check(('session', request.META['HTTP_X_CWX_SESSION_KEY'][:64]))
+    if limited:
+        return {'status': 429, 'headers': {'Retry-After': limited['Retry-After']},
+            'body': limited.content}
+    sub.resolver_match = match
+    # one item failing doesn't fail the others
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+        content = ''.join(response.streaming_content) if response.streaming else response.content
+        if response.get('Content-Type', '').startswith('application/json'):
+            content = json.loads(content)
+        else:
+            content = content.decode('utf-8')
+    except Exception:
+        logger.exception('batch item %s %s failed', sub.method, path)
+        return {'status': 500, 'headers': {}, 'body': 'Server error'}
+    headers = dict((name, response[name]) for name in
+        ('Location', 'ETag', 'Last-Modified', 'Link') if response.has_header(name))
+    return {'status': response.status_code, 'headers': headers, 'body': content}
+
+# Run several API requests in one round trip
+# The body is JSON: {"requests": [{"method": "GET", "path": "report/1/"}, ...]}
+# and the answer lists a {"status", "headers", "body"} for each, in order.
+# The session is resolved once for the whole batch, and items run one
+# after another on the same database connection. Each item counts against
+# the session's rate limit, as the batch does.
+# C - POST: batch/
+@require_http_methods(["POST"])
+def batch(request):
+    # ensure the session corresponds to valid user
+    try:
+        account = account_from_session(request)
+    except Account.DoesNotExist:
+        return HttpResponse(content='Invalid session', status=401,
+            reason='Session key does not correspond to user account')
+    try:
+        items = json.loads(request.body)['requests']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Batch must be JSON with a list of requests')
+    if not isinstance(items, list) or len(items) > MAX_BATCH_SIZE:
+        return HttpResponseBadRequest('Batch must list at most %d requests' % MAX_BATCH_SIZE)
+    results = [batch_run(request, account, item) for item in items]
+    return render(request, results)
 
@@ -0,0 +1,53 @@
+"""
+The production database profile for civiworx, used by
+civiworx/settings_production.py (and by `manage.py bench_db` to compare it
+with the development one). The path comes from the environment.
+"""
+
+import os
+
+from civiworx.settings import BASE_DIR
+
+
+# Database
+# Connections persist across requests (CONN_MAX_AGE), so each worker thread
+# opens one and keeps it. SQLite runs in WAL mode, where readers never block
+# the writer and the writer never blocks readers, and transactions take the
+# write lock as they begin so writers queue for up to `timeout` seconds
+# instead of failing with "database is locked" (see worx/backends/sqlite3).
+
+DB_PATH = os.environ.get('CIVIWORX_DB', os.path.join(BASE_DIR, 'db.sqlite3'))
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal', # durable at checkpoints, safe with WAL
+    'cache_size': -32000, # KiB of page cache per connection
+    'temp_store': 'memory',
+    'mmap_size': 268435456,
+}
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'worx.backends.sqlite3',
+        'NAME': DB_PATH,
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+        'PRAGMAS': SQLITE_PRAGMAS,
+        'TRANSACTION_MODE': 'IMMEDIATE',
+    },
+    # a read only connection to the same file, so list and detail reads
+    # run on their own connections beside the writes (swap in a real
+    # replica's settings when moving to a server database)
+    'replica': {
+        'ENGINE': 'worx.backends.sqlite3',
+        'NAME': DB_PATH,
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+        'PRAGMAS': dict(SQLITE_PRAGMAS, query_only='on'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['worx.db.ReadWriteRouter']
+
+DATABASE_READ_REPLICAS = ['replica']
@@ -33,9 +33,12 @@ INSTALLED_APPS = (
     'django.contrib.staticfiles',
     'worx',
     'api',
+    'push',
 )
 
 MIDDLEWARE_CLASSES = (
+    'api.middleware.InstrumentationMiddleware', # first, so it times everything
+    'api.middleware.RateLimitMiddleware',
     'django.middleware.common.CommonMiddleware',
 )
 
@@ -46,6 +49,7 @@ WSGI_APPLICATION = 'civiworx.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
+# (civiworx/settings_production.py has the profile for concurrent load)
 
 DATABASES = {
     'default': {
@@ -54,6 +58,141 @@ DATABASES = {
     }
 }
 
+# Content-addressed storage for uploaded images
+
+BLOB_ROOT = os.path.join(BASE_DIR, 'blobs')
+
+# Uploaded images (see worx/images.py and api/thumbnails.py)
+# Thumbnails and capped resolution variants need Pillow; without it the
+# original images are served in their place
+
+IMAGE_THUMBNAIL_SIZE = 160 # pixels square
+
+IMAGE_MAX_SIZE = 1280 # longest side of the capped resolution variant
+
+IMAGE_MAX_PIXELS = 50000000 # larger uploads are refused
+
+IMAGE_PIPELINE_THREADS = 2 # per process, 0 to make variants on the request thread
+
+# Session -> account lookup cache
+# SESSION_CACHE_SHARED optionally names an entry in CACHES (e.g. a
+# FileBasedCache) shared by all worker processes, through which logouts
+# reach them all at once. Without one, other processes accept a logged
+# out session for up to SESSION_CACHE_TTL.
+
+SESSION_CACHE_SIZE = 10000
+
+SESSION_CACHE_TTL = 5 # seconds
+
+SESSION_CACHE_SHARED = None
+
+# Sessions expire SESSION_TTL after they were last used; using one pushes
+# its expiry back, at most once per SESSION_RENEW_INTERVAL. Run
+# `manage.py reap_sessions` to delete expired ones
+
+SESSION_TTL = 30 * 86400 # seconds
+
+SESSION_RENEW_INTERVAL = 86400 # seconds
+
+# Cache of serialized report/message JSON (see api/fragments.py)
+# FRAGMENT_CACHE_SHARED optionally names an entry in CACHES to use instead
+# of the in-process LRU, so invalidations reach every worker process.
+# In-process entries expire after FRAGMENT_CACHE_TTL, so changes made by
+# other processes (management commands, other workers) show within that
+
+FRAGMENT_CACHE_SIZE = 50000
+
+FRAGMENT_CACHE_TTL = 30 # seconds
+
+FRAGMENT_CACHE_SHARED = None
+
+# Push notifications to report subscribers (see push/fanout.py)
+# Run `manage.py push_worker` to deliver them
+
+PUSH_TRANSPORT = 'push.transports.LocalTransport'
+
+PUSH_BATCH_SIZE = 500 # queued messages per batch
+
+PUSH_SEND_SIZE = 100 # notifications per transport call
+
+PUSH_COALESCE_SECONDS = 2 # wait for bursts on a report to settle
+
+PUSH_CLAIM_TIMEOUT = 60 # seconds before a dead worker's batch is retried
+
+PUSH_MAX_ATTEMPTS = 5 # deliveries tried before an event is marked failed
+
+# Message feeds (long-poll and Server-Sent Events, see api/feed.py)
+# Serve them from an async worker class (e.g. gunicorn -k gevent) so idle
+# connections are greenlets rather than threads
+
+FEED_POLL_INTERVAL = 1.0 # seconds between checks for messages from other processes
+
+FEED_TIMEOUT = 25 # longest a long-poll is held open
+
+FEED_STREAM_SECONDS = 300 # event streams end after this, clients reconnect
+
+FEED_KEEPALIVE = 15 # seconds between keepalive comments on an idle stream
+
+# Request instrumentation (see api/middleware.py), served in the Prometheus
+# text format at api/metrics/ to ADMIN_ACCOUNTS or with the METRICS_TOKEN
+
+METRICS_ENABLED = True
+
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+
+METRICS_SLOW_SAMPLE_RATE = 0.1 # share of slow requests whose queries are logged
+
+METRICS_TOKEN = None
+
+ADMIN_ACCOUNTS = () # account keys
+
+# Password hashing (see api/passwords.py)
+# PBKDF2-SHA256 with a per-account salt; legacy hashes, and ones made with
+# another PASSWORD_ITERATIONS, are rehashed as their accounts log in. Run
+# `manage.py bench_passwords` to choose the work factor for a machine.
+# Hashes run on PASSWORD_HASH_THREADS threads; logins beyond
+# PASSWORD_HASH_QUEUE waiting, or waiting longer than PASSWORD_HASH_TIMEOUT
+# seconds, get a 503 with Retry-After
+
+PASSWORD_ITERATIONS = 100000
+
+PASSWORD_HASH_THREADS = 2 # per process, 0 to hash on the request thread
+
+PASSWORD_HASH_QUEUE = 100
+
+PASSWORD_HASH_TIMEOUT = 10
+
+# Rate limits (see api/ratelimit.py), as (tokens per second, burst) token
+# buckets: logins per address and per account, sign ups per address and
+# requests per session. Rejected requests get a 429 with Retry-After.
+# RATE_LIMIT_SHARED optionally names an entry in CACHES holding the buckets,
+# so worker processes count together
+
+RATE_LIMIT_ENABLED = True
+
+RATE_LIMITS = {
+    'login-ip': (0.5, 20),
+    'login-account': (0.05, 5),
+    'signup-ip': (0.01, 5),
+    'session': (20, 200),
+}
+
+RATE_LIMIT_SIZE = 100000 # buckets per process
+
+RATE_LIMIT_SHARED = None
+
+RATE_LIMIT_FORWARDED = False # use X-Forwarded-For, when behind a proxy
+
+# Bulk import and export of reports and messages (see api/bulk.py), at
+# api/reports/import/ and api/reports/export/ for ADMIN_ACCOUNTS or with
+# `manage.py import_reports` and `manage.py export_reports`. Each chunk of
+# rows is written in one transaction, and a failed import resumes after
+# the last chunk written
+
+IMPORT_CHUNK_SIZE = 1000 # rows
+
+IMPORT_MAX_ERRORS = 100 # invalid rows described on an import job
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
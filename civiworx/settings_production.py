@@ -0,0 +1,31 @@
+"""
+Production settings for civiworx: the development settings with debugging
+off and a database profile for concurrent load.
+
+Use with DJANGO_SETTINGS_MODULE=civiworx.settings_production. Paths and
+secrets come from the environment; CIVIWORX_SECRET_KEY and
+CIVIWORX_ALLOWED_HOSTS (comma separated) must be set.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from civiworx.settings import *
+
+DEBUG = False
+
+TEMPLATE_DEBUG = False
+
+# Helper to read a setting with no safe default from the environment
+# Starting without it fails rather than running with the development value.
+def required_env(name):
+    value = os.environ.get(name, '').strip()
+    if not value:
+        raise ImproperlyConfigured('Set %s in the environment' % name)
+    return value
+
+SECRET_KEY = required_env('CIVIWORX_SECRET_KEY')
+
+ALLOWED_HOSTS = [host.strip() for host in required_env('CIVIWORX_ALLOWED_HOSTS').split(',')]
+
+# The database profile for concurrent load
+from civiworx.database_production import *
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from collections import defaultdict
+from datetime import timedelta
+import uuid
+
+from models import PushEvent
+from transports import Notification, get_transport
+from worx.models import ReportSubscription
+
+# Queue a posted message for fan-out to the report's subscribers
+# This is a single insert however many subscribers there are, the
+# expensive part is left to the workers.
+def enqueue(message):
+    PushEvent.objects.create(report_id=message.about_report_id, message=message)
+
+# Unique token for a worker (process + thread) to claim events with
+def worker_token():
+    return uuid.uuid4().hex
+
+# Claim up to batch_size events for this worker
+# Only events that have waited `settle` seconds are taken, so a burst of
+# messages on a report is picked up (and coalesced) together. Claims older
+# than `timeout` seconds are from a worker that died and are taken over.
+# Each claim counts as an attempt (so does one a worker died holding), and
+# events that have had max_attempts are marked failed instead of retried.
+def claim(token, batch_size, settle, timeout, max_attempts):
+    now = timezone.now()
+    expired = Q(claimed_on__lt=now - timedelta(seconds=timeout))
+    PushEvent.objects.filter(expired, failed=False, attempts__gte=max_attempts) \
+        .update(failed=True, claimed_by='', claimed_on=None)
+    ready = PushEvent.objects.filter(failed=False,
+        queued_on__lte=now - timedelta(seconds=settle)).filter(Q(claimed_by='') | expired)
+    ids = list(ready.order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    # the update re-checks the conditions, so two workers never share an event
+    ready.filter(id__in=ids).update(claimed_by=token, claimed_on=now,
+        attempts=F('attempts') + 1)
+    return list(PushEvent.objects.filter(claimed_by=token)
+        .select_related('message').order_by('id'))
+
+# Build one notification per (subscriber, report) out of the events,
+# skipping the author of each message
+def coalesce(events):
+    report_ids = set(e.report_id for e in events)
+    observers = defaultdict(list)
+    for r_id, a_id in ReportSubscription.objects.filter(report_id__in=report_ids) \
+            .values_list('report_id', 'account_id'):
+        observers[r_id].append(a_id)
+    pending = defaultdict(list)
+    for event in events:
+        for a_id in observers[event.report_id]:
+            if a_id != event.message.written_by_id:
+                pending[(a_id, event.report_id)].append(event.message_id)
+    return [Notification(a_id, r_id, sorted(m_ids))
+        for (a_id, r_id), m_ids in sorted(pending.items())]
+
+# Claim, coalesce and deliver one batch; returns the number of events done
+def process_batch(token=None, batch_size=None, settle=None, timeout=None, transport=None):
+    token = token or worker_token()
+    batch_size = batch_size or getattr(settings, 'PUSH_BATCH_SIZE', 500)
+    settle = getattr(settings, 'PUSH_COALESCE_SECONDS', 2) if settle is None else settle
+    timeout = timeout or getattr(settings, 'PUSH_CLAIM_TIMEOUT', 60)
+    max_attempts = getattr(settings, 'PUSH_MAX_ATTEMPTS', 5)
+    transport = transport or get_transport()
+
+    events = claim(token, batch_size, settle, timeout, max_attempts)
+    if not events:
+        return 0
+    notifications = coalesce(events)
+    try:
+        send_size = getattr(settings, 'PUSH_SEND_SIZE', 100)
+        for i in range(0, len(notifications), send_size):
+            transport.send(notifications[i:i + send_size])
+    except Exception:
+        # hand the events back to be retried by the next batch, unless
+        # they've had all their attempts
+        claimed = PushEvent.objects.filter(claimed_by=token)
+        claimed.filter(attempts__gte=max_attempts).update(failed=True)
+        claimed.update(claimed_by='', claimed_on=None)
+        raise
+    PushEvent.objects.filter(claimed_by=token).delete()
+    return len(events)
+
+# Queue depth and lag, from the database so every process sees the same:
+# events waiting (claimed or not), claimed, and failed for good, and how
+# long the oldest unclaimed event has been waiting
+def stats():
+    pending = PushEvent.objects.filter(failed=False)
+    oldest = pending.filter(claimed_by='').order_by('id') \
+        .values_list('queued_on', flat=True)[:1]
+    return {
+        'queue_depth': pending.count(),
+        'claimed': pending.exclude(claimed_by='').count(),
+        'failed': PushEvent.objects.filter(failed=True).count(),
+        'lag': (timezone.now() - oldest[0]).total_seconds() if oldest else 0.0,
+    }
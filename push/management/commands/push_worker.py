@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from optparse import make_option
+import multiprocessing
+import time
+
+from push import fanout
+
+
+class Command(BaseCommand):
+    help = 'Fan queued messages out to report subscribers as push notifications.'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=1,
+            help='Number of worker processes to run'),
+        make_option('--batch', type='int', dest='batch', default=None,
+            help='Events claimed per batch (default PUSH_BATCH_SIZE)'),
+        make_option('--interval', type='float', dest='interval', default=1.0,
+            help='Seconds to sleep when the queue is empty'),
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='Drain the queue once and exit'),
+    )
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes <= 1:
+            return self.work(options)
+        # children must not share the parent's database connection
+        connection.close()
+        workers = [multiprocessing.Process(target=self.work, args=(options,))
+            for p in range(processes)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+    def work(self, options):
+        token = fanout.worker_token()
+        while True:
+            try:
+                done = fanout.process_batch(token, batch_size=options['batch'],
+                    settle=0 if options['once'] else None)
+            except Exception as e:
+                self.stderr.write('push batch failed: %s' % e)
+                done = 0
+            if done:
+                stats = fanout.stats()
+                self.stdout.write('pushed %d events; queue depth %d, lag %.2fs, %d failed' % (
+                    done, stats['queue_depth'], stats['lag'], stats['failed']))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
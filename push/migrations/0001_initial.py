@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0007_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('queued_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('claimed_by', models.CharField(max_length=64, blank=True, db_index=True)),
+                ('claimed_on', models.DateTimeField(null=True, blank=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('message', models.ForeignKey(related_name='+', to='worx.Message')),
+                ('report', models.ForeignKey(related_name='+', to='worx.Report')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushevent',
+            name='failed',
+            field=models.BooleanField(default=False, db_index=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import models
+from worx.models import Report, Message
+
+# Durable queue of posted messages waiting to be fanned out to the
+# report's subscribers. A row is only removed once its notifications
+# have been handed to the transport, or kept marked failed once it has
+# had PUSH_MAX_ATTEMPTS.
+class PushEvent(models.Model):
+    report = models.ForeignKey(Report, related_name='+')
+    message = models.ForeignKey(Message, related_name='+')
+    queued_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    claimed_by = models.CharField(max_length=64, blank=True, db_index=True) # worker token
+    claimed_on = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    failed = models.BooleanField(default=False, db_index=True)
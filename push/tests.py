@@ -0,0 +1,115 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from datetime import timedelta
+
+from api.models import Session
+from api.session_cache import session_cache
+from push import fanout
+from push.models import PushEvent
+from push.transports import LocalTransport, Transport
+from worx.models import *
+
+
+class FailingTransport(Transport):
+
+    def send(self, notifications):
+        raise IOError('gateway down')
+
+
+class FanoutTests(TestCase):
+
+    def setUp(self):
+        self.author = Account.objects.create(account_key='author', passphrase='')
+        self.report = Report(reported_by=self.author, title='x', latitude=0, longitude=0)
+        self.report.save() # subscribes the author
+        self.watchers = [Account.objects.create(account_key='w%d' % i, passphrase='')
+            for i in range(3)]
+        for w in self.watchers:
+            ReportSubscription.objects.create(account=w, report=self.report)
+
+    def post(self, account, text):
+        msg = Message.objects.create(about_report=self.report, written_by=account,
+            message_text=text)
+        fanout.enqueue(msg)
+        return msg
+
+    def test_post_enqueues_once(self):
+        session_cache.clear()
+        Session.objects.create(key='k' * 64, account=self.author)
+        self.client.post('/api/report/%d/messages/' % self.report.id,
+            {'message_text': 'hi'}, HTTP_X_CWX_SESSION_KEY='k' * 64)
+        self.assertEqual(PushEvent.objects.count(), 1)
+
+    def test_burst_coalesced_per_subscriber(self):
+        first = self.post(self.author, 'one')
+        second = self.post(self.author, 'two')
+        reply = self.post(self.watchers[0], 'three')
+        transport = LocalTransport()
+        self.assertEqual(fanout.process_batch(settle=0, transport=transport), 3)
+        sent = dict((n.account_id, n.message_ids) for n in transport.outbox)
+        # everyone but the author of each message hears about it, once
+        self.assertEqual(sent, {
+            self.author.id: [reply.id],
+            self.watchers[0].id: [first.id, second.id],
+            self.watchers[1].id: [first.id, second.id, reply.id],
+            self.watchers[2].id: [first.id, second.id, reply.id],
+        })
+        self.assertEqual(PushEvent.objects.count(), 0)
+
+    def test_failed_delivery_is_retried(self):
+        self.post(self.author, 'one')
+        with self.assertRaises(IOError):
+            fanout.process_batch(settle=0, transport=FailingTransport())
+        event = PushEvent.objects.get()
+        self.assertEqual((event.claimed_by, event.attempts), ('', 1))
+        transport = LocalTransport()
+        fanout.process_batch(settle=0, transport=transport)
+        self.assertEqual(len(transport.outbox), 3)
+
+    def test_events_wait_to_settle(self):
+        self.post(self.author, 'one')
+        self.assertEqual(fanout.process_batch(settle=60, transport=LocalTransport()), 0)
+        self.assertEqual(fanout.stats()['queue_depth'], 1)
+
+    def test_gives_up_after_max_attempts(self):
+        self.post(self.author, 'poison')
+        with self.settings(PUSH_MAX_ATTEMPTS=2):
+            for attempt in range(2):
+                with self.assertRaises(IOError):
+                    fanout.process_batch(settle=0, transport=FailingTransport())
+            transport = LocalTransport()
+            self.assertEqual(fanout.process_batch(settle=0, transport=transport), 0)
+        self.assertEqual(transport.outbox, [])
+        event = PushEvent.objects.get()
+        self.assertEqual((event.failed, event.attempts, event.claimed_by), (True, 2, ''))
+        stats = fanout.stats()
+        self.assertEqual((stats['queue_depth'], stats['failed']), (0, 1))
+
+    def test_dead_worker_claims_count_as_attempts(self):
+        self.post(self.author, 'one')
+        fanout.claim('dead', 10, settle=0, timeout=60, max_attempts=1)
+        self.assertEqual(fanout.stats()['claimed'], 1)
+        # the worker never comes back and its claim expires
+        self.assertEqual(fanout.claim('live', 10, settle=0, timeout=0, max_attempts=1), [])
+        self.assertTrue(PushEvent.objects.get().failed)
+
+    def test_stats_from_the_queue(self):
+        self.post(self.author, 'one')
+        PushEvent.objects.update(queued_on=timezone.now() - timedelta(seconds=30))
+        stats = fanout.stats()
+        self.assertEqual((stats['queue_depth'], stats['claimed'], stats['failed']), (1, 0, 0))
+        self.assertGreaterEqual(stats['lag'], 30)
+
+    def test_stats_admin_only(self):
+        session_cache.clear()
+        Session.objects.create(key='k' * 64, account=self.author)
+        self.assertEqual(self.client.get('/api/push/stats/').status_code, 401)
+        self.assertEqual(self.client.get('/api/push/stats/',
+            HTTP_X_CWX_SESSION_KEY='k' * 64).status_code, 403)
+        with self.settings(ADMIN_ACCOUNTS=['author']):
+            response = self.client.get('/api/push/stats/', HTTP_X_CWX_SESSION_KEY='k' * 64)
+        self.assertEqual(response.status_code, 200)
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/api/push/stats/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A notification for one subscriber, covering every message posted to a
+# report since the subscriber was last notified about it
+class Notification(object):
+
+    def __init__(self, account_id, report_id, message_ids):
+        self.account_id = account_id
+        self.report_id = report_id
+        self.message_ids = message_ids
+
+    @property
+    def count(self):
+        return len(self.message_ids)
+
+    @property
+    def latest_message_id(self):
+        return max(self.message_ids)
+
+    def __repr__(self):
+        return '<Notification account=%d report=%d messages=%r>' % (
+            self.account_id, self.report_id, self.message_ids)
+
+# Delivers batches of notifications (e.g. to APNs/GCM)
+# send() should raise if the batch could not be delivered so that the
+# queued events are retried.
+class Transport(object):
+
+    def send(self, notifications):
+        raise NotImplementedError
+
+# Stand-in transport that keeps everything it's sent in memory and logs it
+# Useful for development and tests, nothing leaves the process.
+class LocalTransport(Transport):
+
+    def __init__(self):
+        self.outbox = []
+
+    def send(self, notifications):
+        self.outbox.extend(notifications)
+        for n in notifications:
+            logger.debug('push %r', n)
+
+_transport = None
+
+# The transport configured by PUSH_TRANSPORT, shared by the process
+def get_transport():
+    global _transport
+    if _transport is None:
+        path = getattr(settings, 'PUSH_TRANSPORT', 'push.transports.LocalTransport')
+        _transport = import_string(path)()
+    return _transport
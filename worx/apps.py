@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.models.signals import post_migrate
+
+
+class WorxConfig(AppConfig):
+    name = 'worx'
+
+    def ready(self):
+        from worx.search import ensure_triggers
+        from worx.db import unpin
+        post_migrate.connect(ensure_triggers, sender=self)
+        request_started.connect(unpin)
@@ -0,0 +1,21 @@
+from django.db.backends.sqlite3 import base
+
+# Django's SQLite backend plus two per database settings:
+#   PRAGMAS           dict of pragmas set on every new connection
+#   TRANSACTION_MODE  e.g. 'IMMEDIATE' to take the write lock when a
+#                     transaction (atomic block, model save) begins
+# A transaction begun the default (DEFERRED) way takes the write lock at its
+# first write, and in WAL mode fails at once with "database is locked" if
+# another connection wrote since - the busy timeout isn't used. Beginning
+# IMMEDIATE queues it for the write lock up front instead.
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in sorted(self.settings_dict.get('PRAGMAS', {}).items()):
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get('TRANSACTION_MODE', '')
+        self.cursor().execute('BEGIN %s' % mode if mode else 'BEGIN')
@@ -0,0 +1,108 @@
+from django.conf import settings
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+# Size of the chunks used when streaming a blob back out
+CHUNK_SIZE = 64 * 1024
+
+# Standard or URL-safe base64, padding optional
+_BASE64_RE = re.compile(r'^[A-Za-z0-9+/_-]*={0,2}$')
+
+# Leading bytes of the image formats clients upload
+_MAGIC = [
+    ('\xff\xd8\xff', 'image/jpeg'),
+    ('\x89PNG\r\n\x1a\n', 'image/png'),
+    ('GIF8', 'image/gif'),
+]
+
+# Content-addressed store of binary blobs on the local filesystem
+# Each blob lives at <root>/<id[:2]>/<id[2:4]>/<id> where id is the SHA-256
+# of its content, so storing the same bytes twice only keeps one copy.
+class BlobStore(object):
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, blob_id):
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    def exists(self, blob_id):
+        return os.path.exists(self.path(blob_id))
+
+    def size(self, blob_id):
+        return os.path.getsize(self.path(blob_id))
+
+    def open(self, blob_id):
+        return open(self.path(blob_id), 'rb')
+
+    def read(self, blob_id):
+        with self.open(blob_id) as f:
+            return f.read()
+
+    # Store the bytes (if not already present) and return their id
+    def put(self, data):
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_id)
+        if not os.path.exists(path):
+            folder = os.path.dirname(path)
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    pass # created by a concurrent writer
+            # write to a temp file then rename so readers never see half a blob
+            fd, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, path)
+        return blob_id
+
+    # Decode base64 (optionally a data: URI) and store it, '' if empty
+    # Raises ValueError if the text is not valid base64
+    def put_base64(self, b64):
+        data = decode_base64(b64)
+        return self.put(data) if data else ''
+
+    # Generator over the bytes [start, start + length) of the blob
+    def stream(self, blob_id, start=0, length=None):
+        with self.open(blob_id) as f:
+            f.seek(start)
+            while length is None or length > 0:
+                chunk = f.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                if length is not None:
+                    length -= len(chunk)
+                yield chunk
+
+# Decode standard or URL-safe base64, optionally as a data: URI
+# Raises ValueError if the text is not valid base64
+def decode_base64(b64):
+    if not b64:
+        return ''
+    if b64.startswith('data:') and ',' in b64:
+        b64 = b64.split(',', 1)[1]
+    b64 = ''.join(b64.split())
+    if not _BASE64_RE.match(b64):
+        raise ValueError('Invalid base64 data')
+    b64 = b64.replace('+', '-').replace('/', '_') + '=' * (-len(b64) % 4)
+    try:
+        return base64.urlsafe_b64decode(str(b64))
+    except (TypeError, binascii.Error):
+        raise ValueError('Invalid base64 data')
+
+# Guess the content type of a blob from its first few bytes
+def sniff_content_type(head):
+    for magic, c_type in _MAGIC:
+        if head.startswith(magic):
+            return c_type
+    return 'application/octet-stream'
+
+# The store configured for this site
+def blob_store():
+    return BlobStore(settings.BLOB_ROOT)
@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from worx import models
+
+# Recount the denormalized counters of every report (see Report) from the
+# messages, images and subscriptions themselves, `batch_size` reports at a
+# time in id order. Each batch is a few grouped queries and an update for
+# each report whose counts were wrong, in one transaction so no message
+# can slip in between counting and storing. last_activity only moves
+# forward, to the report's latest message if that is newer.
+# `apps` gives the models to use (from a migration); by default the
+# current ones. Returns the number of reports checked and the ids of those
+# corrected.
+def recount_reports(batch_size=1000, apps=None):
+    get_model = apps.get_model if apps else lambda app, name: getattr(models, name)
+    Report, Message, MessageImage, ReportSubscription = [get_model('worx', name) for name in
+        ('Report', 'Message', 'MessageImage', 'ReportSubscription')]
+    # corrections mark the report updated (but the migration that first
+    # counted them predates updated_on)
+    stamp = 'updated_on' in [f.name for f in Report._meta.fields]
+    checked, corrected, after = 0, [], 0
+    while True:
+        with transaction.atomic():
+            reports = list(Report.objects.filter(id__gt=after).order_by('id').values_list('id',
+                'message_count', 'image_count', 'subscriber_count', 'last_activity')[:batch_size])
+            if not reports:
+                return checked, corrected
+            span = (reports[0][0], reports[-1][0])
+            # order_by() drops the default ordering, which would be grouped by too
+            messages = dict((row['about_report'], (row['n'], row['latest'])) for row in
+                Message.objects.filter(about_report__range=span).values('about_report')
+                .annotate(n=Count('id'), latest=Max('written_on')).order_by())
+            images = dict((row['on_message__about_report'], row['n']) for row in
+                MessageImage.objects.filter(on_message__about_report__range=span)
+                .values('on_message__about_report').annotate(n=Count('id')).order_by())
+            subscribers = dict((row['report'], row['n']) for row in
+                ReportSubscription.objects.filter(report__range=span).values('report')
+                .annotate(n=Count('id')).order_by())
+            for r_id, m_count, i_count, s_count, active in reports:
+                n_messages, latest = messages.get(r_id, (0, None))
+                changes = {}
+                if (m_count, i_count, s_count) != (n_messages, images.get(r_id, 0),
+                        subscribers.get(r_id, 0)):
+                    changes.update(message_count=n_messages, image_count=images.get(r_id, 0),
+                        subscriber_count=subscribers.get(r_id, 0))
+                if latest is not None and (active is None or latest > active):
+                    changes['last_activity'] = latest
+                if changes:
+                    if stamp:
+                        changes['updated_on'] = timezone.now()
+                    Report.objects.filter(id=r_id).update(**changes)
+                    corrected.append(r_id)
+        checked += len(reports)
+        if len(reports) < batch_size:
+            return checked, corrected
+        after = reports[-1][0]
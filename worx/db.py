@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections, router, DEFAULT_DB_ALIAS
+
+from contextlib import contextmanager
+import copy
+import os
+import random
+import shutil
+import tempfile
+import threading
+
+_state = threading.local()
+
+# Forget the writes of the previous request (connected to request_started)
+def unpin(sender, **kwargs):
+    _state.pinned = False
+
+# Sends writes to the default database and reads to a random one of
+# DATABASE_READ_REPLICAS. Once a request has written, its reads stay on the
+# default database too, so it always sees its own writes; as do reads in a
+# transaction.
+class ReadWriteRouter(object):
+
+    def replicas(self):
+        return getattr(settings, 'DATABASE_READ_REPLICAS', ())
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        if not replicas or getattr(_state, 'pinned', False) or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    # every alias holds the same data
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # replicas get their schema from the default database
+    def allow_migrate(self, db, model):
+        return db not in self.replicas()
+
+
+# Run the block against fresh copies of the given DATABASES (by default
+# the current ones), all in one new migrated SQLite file, for benchmarks
+# whose threads need to see each other's committed writes
+@contextmanager
+def temporary_database(databases=None, routers=None):
+    folder = tempfile.mkdtemp()
+    saved = copy.deepcopy(connections.databases)
+    saved_routers = router.routers
+    databases = copy.deepcopy(databases or connections.databases)
+    for db in databases.values():
+        db['NAME'] = os.path.join(folder, 'db.sqlite3')
+        db.pop('TEST_NAME', None)
+    try:
+        _use_databases(databases)
+        if routers is not None:
+            router.routers = routers
+        call_command('migrate', verbosity=0, interactive=False)
+        yield
+    finally:
+        _use_databases(saved)
+        router.routers = saved_routers
+        shutil.rmtree(folder)
+
+# Point every connection at the given databases (closing any open ones)
+def _use_databases(databases):
+    for alias in list(connections.databases):
+        if hasattr(connections._connections, alias):
+            connections[alias].close()
+            delattr(connections._connections, alias)
+    connections.databases.clear()
+    connections.databases.update(databases)
@@ -0,0 +1,89 @@
+import math
+
+# Mean radius of the earth, all distances in the API are kilometres
+EARTH_RADIUS_KM = 6371.0
+
+# Precision of the geohash stored against each report (~38m x 19m cells)
+GEOHASH_PRECISION = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Encode a lat/lng pair as a geohash string of the given precision
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_rng, lng_rng = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, starting with lng
+        rng, val = (lng_rng, lng) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return ''.join(chars)
+
+# Size of a geohash cell in degrees (lat, lng) for the given precision
+def cell_size(precision):
+    n_bits = precision * 5
+    lng_bits = (n_bits + 1) // 2
+    lat_bits = n_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+# Great circle distance in km between two points
+def haversine(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    d_lat = p2 - p1
+    d_lng = math.radians(lng2 - lng1)
+    a = math.sin(d_lat / 2) ** 2 + \
+        math.cos(p1) * math.cos(p2) * math.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+# Bounding box (min_lat, max_lat, min_lng, max_lng) containing the circle
+# NOTE: if the circle touches a pole or the anti-meridian the longitude
+# range is widened to the whole globe rather than split in two
+def bounding_box(lat, lng, radius):
+    d_lat = math.degrees(radius / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - d_lat, lat + d_lat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    # the circle reaches furthest east and west where meridians touch it,
+    # asin(sin(r) / cos(lat)) either side - wider than r / cos(lat), which
+    # would leave out the edges; with sin(r) >= cos(lat) it spans them all
+    sin_r, cos_lat = math.sin(radius / EARTH_RADIUS_KM), math.cos(math.radians(lat))
+    if sin_r >= cos_lat:
+        return min_lat, max_lat, -180.0, 180.0
+    d_lng = math.degrees(math.asin(sin_r / cos_lat))
+    min_lng, max_lng = lng - d_lng, lng + d_lng
+    if min_lng < -180.0 or max_lng > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lng, max_lng
+
+# Set of geohash prefixes whose cells together cover the bounding box
+# The finest precision whose cells are at least as big as the box is used,
+# so the box spans at most 2x2 cells and its corners name all of them.
+# Returns an empty list when the box is too big to be worth prefiltering.
+def covering_prefixes(box):
+    min_lat, max_lat, min_lng, max_lng = box
+    precision = 0
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        c_lat, c_lng = cell_size(p)
+        if c_lat >= max_lat - min_lat and c_lng >= max_lng - min_lng:
+            precision = p
+            break
+    if precision == 0:
+        return []
+    corners = [(min_lat, min_lng), (min_lat, max_lng),
+               (max_lat, min_lng), (max_lat, max_lng)]
+    return sorted(set(encode_geohash(la, ln, precision) for la, ln in corners))
+
+# Upper bound (exclusive) for a range scan over all hashes with this prefix
+# ('~' sorts after every character of the geohash alphabet)
+def prefix_upper_bound(prefix):
+    return prefix + '~'
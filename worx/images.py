@@ -0,0 +1,100 @@
+from django.conf import settings
+
+import io
+import struct
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # resizing needs Pillow; without it originals are used
+    Image = ImageOps = None
+
+# JPEG start of frame markers (the ones carrying the image size)
+_SOF_MARKERS = set(range(0xc0, 0xd0)) - set([0xc4, 0xc8, 0xcc])
+
+# Read the type and size of an uploaded image from its header
+# Returns (content type, width, height). Raises ValueError if the data is
+# not a JPEG, PNG or GIF, or has more pixels than IMAGE_MAX_PIXELS (so a
+# small file can't expand into a huge bitmap when it's decoded).
+def image_info(data):
+    if data.startswith('\x89PNG\r\n\x1a\n') and data[12:16] == 'IHDR':
+        _check_length(data, 24)
+        c_type, (width, height) = 'image/png', struct.unpack('>II', data[16:24])
+    elif data[:6] in ('GIF87a', 'GIF89a'):
+        _check_length(data, 10)
+        c_type, (width, height) = 'image/gif', struct.unpack('<HH', data[6:10])
+    elif data.startswith('\xff\xd8'):
+        c_type, (width, height) = 'image/jpeg', _jpeg_size(data)
+    else:
+        raise ValueError('Image data must be a JPEG, PNG or GIF image')
+    if width <= 0 or height <= 0:
+        raise ValueError('Image has no pixels')
+    if width * height > getattr(settings, 'IMAGE_MAX_PIXELS', 50000000):
+        raise ValueError('Image is too large')
+    return c_type, width, height
+
+# Helper to check the header holds the size, read from its first `length` bytes
+def _check_length(data, length):
+    if len(data) < length:
+        raise ValueError('Image data is truncated')
+
+# Walk the JPEG segments up to the first start of frame
+def _jpeg_size(data):
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != '\xff':
+            break
+        marker = ord(data[pos + 1])
+        if marker == 0xff: # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xd0 <= marker <= 0xd9: # no length follows
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            _check_length(data, pos + 9)
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    raise ValueError('Image data must be a JPEG, PNG or GIF image')
+
+# The image scaled down to fit within size x size (cropped to exactly that
+# square if crop), as JPEG - or PNG if it has transparency. None if Pillow
+# isn't installed. Raises ValueError if the data doesn't decode.
+def resize(data, size, crop=False):
+    if Image is None:
+        return None
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except (IOError, SyntaxError, struct.error) as e:
+        raise ValueError('Image does not decode: %s' % e)
+    has_alpha = img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+    if crop:
+        img = ImageOps.fit(img, (size, size), Image.ANTIALIAS)
+    else:
+        img.thumbnail((size, size), Image.ANTIALIAS)
+    out = io.BytesIO()
+    if has_alpha:
+        img.save(out, 'PNG', optimize=True)
+    else:
+        img.save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
+
+# Make the thumbnail and capped resolution variants of a stored image
+# Returns (thumbnail blob id, large blob id). Images already small enough
+# are their own variant; '' means a variant couldn't be made (no Pillow).
+def make_variants(store, blob_id):
+    data = store.read(blob_id)
+    c_type, width, height = image_info(data)
+    thumb_size = getattr(settings, 'IMAGE_THUMBNAIL_SIZE', 160)
+    max_size = getattr(settings, 'IMAGE_MAX_SIZE', 1280)
+    variants = []
+    for size, crop in ((thumb_size, True), (max_size, False)):
+        if width <= size and height <= size:
+            variants.append(blob_id)
+        else:
+            resized = resize(data, size, crop)
+            variants.append(store.put(resized) if resized else '')
+    return tuple(variants)
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections, close_old_connections, OperationalError
+from django.test import Client
+from django.test.utils import override_settings
+
+from civiworx import settings as development, database_production as production
+from worx.db import ReadWriteRouter, temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent reads and writes through the API (message lists, message ' \
+        'posts and logins) with the development and production database profiles, each on ' \
+        'a fresh temporary database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=8, help='Concurrent clients'),
+        make_option('--seconds', type='float', default=10.0, help='Run time per profile'),
+    )
+
+    REPORTS = 20
+    PASSWORD = 'bench-password'
+
+    def handle(self, *args, **options):
+        self.stdout.write('%12s %8s %10s %10s %10s %10s %10s' % ('profile', 'threads',
+            'ops/s', 'p50 ms', 'p95 ms', 'locked', 'errors'))
+        for name, settings_module in (('development', development), ('production', production)):
+            self.run_profile(name, settings_module, options['threads'], options['seconds'])
+
+    def run_profile(self, name, settings_module, threads, seconds):
+        replicas = getattr(settings_module, 'DATABASE_READ_REPLICAS', [])
+        # every client logs in from one address, so no rate limits
+        with override_settings(DATABASE_READ_REPLICAS=replicas, RATE_LIMIT_ENABLED=False):
+            with temporary_database(settings_module.DATABASES,
+                    [ReadWriteRouter()] if replicas else []):
+                reports, session_key = self.make_data()
+                close_old_connections()
+                results = self.run_clients(reports, session_key, threads, seconds)
+
+        latencies = sorted(r[0] for r in results)
+        locked = sum(1 for r in results if r[1] == 'locked')
+        errors = sum(1 for r in results if r[1] == 'error')
+        pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+        self.stdout.write('%12s %8d %10.1f %10.2f %10.2f %10d %10d' % (name, threads,
+            len(results) / seconds, pick(0.5), pick(0.95), locked, errors))
+
+    def make_data(self):
+        from api.models import Session
+        from api.passwords import make_password
+        from worx.models import Account, Profile, Report, Message
+        account = Account.objects.create(account_key='bench-db', passphrase=make_password(self.PASSWORD))
+        Profile.objects.create(account=account, name='Bench')
+        session = Session.objects.create(key='%064x' % random.getrandbits(128), account=account)
+        reports = []
+        for i in range(self.REPORTS):
+            report = Report(reported_by=account, title='report %d' % i, latitude=0, longitude=0)
+            report.save()
+            for j in range(20):
+                Message.objects.create(about_report=report, written_by=account, message_text='hi %d' % j)
+            reports.append(report.id)
+        return reports, session.key
+
+    # Clients reading lists, posting messages and logging in, as fast as they can
+    # Returns a (seconds, outcome) for every request made.
+    def run_clients(self, reports, session_key, threads, seconds):
+        results = []
+        lock = threading.Lock()
+        deadline = time.time() + seconds
+
+        def client():
+            c = Client()
+            rnd = random.Random()
+            mine = []
+            while time.time() < deadline:
+                pick = rnd.random()
+                report_id = rnd.choice(reports)
+                start = time.time()
+                outcome = 'ok'
+                try:
+                    if pick < 0.5:
+                        response = c.get('/api/report/%d/messages/' % report_id,
+                            HTTP_X_CWX_SESSION_KEY=session_key)
+                        ''.join(response.streaming_content)
+                    elif pick < 0.85:
+                        c.post('/api/report/%d/messages/' % report_id, {'message_text': 'load'},
+                            HTTP_X_CWX_SESSION_KEY=session_key)
+                    else:
+                        c.post('/api/auth/session/', {'username': 'bench-db',
+                            'password': self.PASSWORD})
+                except OperationalError as e:
+                    outcome = 'locked' if 'locked' in str(e) else 'error'
+                except Exception:
+                    outcome = 'error'
+                # what the end of a real request does (the test client doesn't)
+                close_old_connections()
+                mine.append((time.time() - start, outcome))
+            for alias in connections:
+                connections[alias].close()
+            with lock:
+                results.extend(mine)
+
+        workers = [threading.Thread(target=client) for t in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return results
@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.v1 import reports_near
+from worx.geo import encode_geohash, haversine
+from worx.models import Account, Report
+
+
+class Command(BaseCommand):
+    args = '<report count> [<report count> ...]'
+    help = 'Benchmark radius searches against growing numbers of reports. ' \
+        'Synthetic reports are written inside a transaction that is rolled back.'
+
+    QUERIES = 50
+    RADIUS = 2.0 # km
+
+    def handle(self, *args, **options):
+        sizes = [int(a) for a in args] or [1000, 10000, 100000]
+        self.stdout.write('%10s %14s %14s %10s' % ('reports', 'indexed ms', 'full scan ms', 'hits'))
+        for size in sizes:
+            with transaction.atomic():
+                self.run_size(size)
+                transaction.set_rollback(True)
+
+    # time QUERIES indexed searches and the equivalent full table scan
+    def run_size(self, size):
+        rnd = random.Random(size)
+        owner = Account.objects.create(account_key='bench-geo', passphrase='')
+        batch = []
+        for i in range(size):
+            lat, lng = rnd.uniform(-60, 60), rnd.uniform(-179, 179)
+            batch.append(Report(reported_by=owner, title='bench %d' % i,
+                latitude=lat, longitude=lng, geohash=encode_geohash(lat, lng)))
+        Report.objects.bulk_create(batch, batch_size=500)
+
+        points = [(rnd.uniform(-60, 60), rnd.uniform(-179, 179)) for q in range(self.QUERIES)]
+        hits = 0
+        start = time.time()
+        for lat, lng in points:
+            hits += len(reports_near(lat, lng, self.RADIUS))
+        indexed = (time.time() - start) * 1000 / self.QUERIES
+
+        start = time.time()
+        for lat, lng in points:
+            [r for r in Report.objects.values_list('id', 'latitude', 'longitude')
+                if haversine(lat, lng, r[1], r[2]) <= self.RADIUS]
+        scan = (time.time() - start) * 1000 / self.QUERIES
+
+        self.stdout.write('%10d %14.3f %14.3f %10d' % (size, indexed, scan, hits))
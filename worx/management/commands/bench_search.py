@@ -0,0 +1,64 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from worx import search
+from worx.models import Account, Report
+
+# Words the synthetic titles are made from, roughly civic report flavoured
+WORDS = ('pothole broken street light graffiti flooding drain blocked bin '
+    'overflowing tree fallen sign missing pavement cracked bench park bus stop '
+    'shelter damaged noise dumping rubbish leak water main road crossing').split()
+
+
+class Command(BaseCommand):
+    args = '<report count> [<report count> ...]'
+    help = 'Benchmark full text title searches against the old icontains scan. ' \
+        'Synthetic reports are written inside a transaction that is rolled back.'
+
+    # common words hit thousands of rows, place names only a handful
+    QUERIES = ['pothole', 'street light', 'blocked dra', 'elmhurst', 'kingsway drain']
+    PLACES = ['elmhurst', 'kingsway', 'ashdown', 'millbrook', 'harrowgate']
+    REPEAT = 10
+
+    def handle(self, *args, **options):
+        if not search.fts_available('report'):
+            raise CommandError('No full text index in this database')
+        sizes = [int(a) for a in args] or [1000, 10000, 100000]
+        self.stdout.write('%10s %22s %14s %14s' % ('reports', 'query', 'fts ms', 'icontains ms'))
+        for size in sizes:
+            with transaction.atomic():
+                self.run_size(size)
+                transaction.set_rollback(True)
+
+    def run_size(self, size):
+        rnd = random.Random(size)
+        owner = Account.objects.create(account_key='bench-search', passphrase='')
+        batch = []
+        for i in range(size):
+            title = ' '.join(rnd.choice(WORDS) for w in range(rnd.randint(2, 8)))
+            # add a place name to ~1 in 1000 titles, and a random one to the rest
+            if rnd.random() < 0.001:
+                title += ' ' + rnd.choice(self.PLACES)
+            else:
+                title += ' place%d' % rnd.randint(0, size)
+            batch.append(Report(reported_by=owner, title=title, latitude=0, longitude=0))
+        Report.objects.bulk_create(batch, batch_size=500)
+
+        for query in self.QUERIES:
+            start = time.time()
+            for r in range(self.REPEAT):
+                search.search('report', query, 50)
+            fts = (time.time() - start) * 1000 / self.REPEAT
+
+            # the old path, with one substring match per word
+            start = time.time()
+            for r in range(self.REPEAT):
+                r_query = Report.objects.all()
+                for word in query.split():
+                    r_query = r_query.filter(title__icontains=word)
+                list(r_query.order_by('id').values_list('id', flat=True)[:50])
+            scan = (time.time() - start) * 1000 / self.REPEAT
+            self.stdout.write('%10d %22s %14.3f %14.3f' % (size, query, fts, scan))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from worx.geo import encode_geohash
+
+
+def backfill_geohash(apps, schema_editor):
+    Report = apps.get_model('worx', 'Report')
+    for rep in Report.objects.all().only('id', 'latitude', 'longitude').iterator():
+        Report.objects.filter(id=rep.id).update(
+            geohash=encode_geohash(rep.latitude, rep.longitude))
+
+
+def noop(apps, schema_editor):
+    pass # the column is dropped by the reverse of AddField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0002_auto_20141009_0330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='geohash',
+            field=models.CharField(default='', max_length=12, db_index=True),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_geohash, noop),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from worx.blobs import blob_store
+
+
+# Move the base64 image columns into the blob store. Identical images hash
+# to the same id so they end up sharing a single file.
+def images_to_blobs(apps, schema_editor):
+    store = blob_store()
+    for model_name in ('Profile', 'MessageImage'):
+        model = apps.get_model('worx', model_name)
+        for obj in model.objects.exclude(img_data='').only('id', 'img_data').iterator():
+            try:
+                blob_id = store.put_base64(obj.img_data)
+            except ValueError:
+                blob_id = store.put(obj.img_data.encode('utf-8')) # keep it as-is
+            model.objects.filter(id=obj.id).update(img_blob=blob_id)
+
+
+def blobs_to_images(apps, schema_editor):
+    store = blob_store()
+    for model_name in ('Profile', 'MessageImage'):
+        model = apps.get_model('worx', model_name)
+        for obj in model.objects.exclude(img_blob='').only('id', 'img_blob').iterator():
+            model.objects.filter(id=obj.id).update(
+                img_data=store.read(obj.img_blob).encode('base64').replace('\n', ''))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0003_report_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='img_blob',
+            field=models.CharField(default='', max_length=64, blank=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='messageimage',
+            name='img_blob',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='messageimage',
+            name='img_data',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(images_to_blobs, blobs_to_images),
+        migrations.RemoveField(
+            model_name='profile',
+            name='img_data',
+        ),
+        migrations.RemoveField(
+            model_name='messageimage',
+            name='img_data',
+        ),
+    ]
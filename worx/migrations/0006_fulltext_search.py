@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.utils import OperationalError
+
+from worx.search import FTS_INDEXES, create_sql, drop_sql
+
+
+# The full text indexes are SQLite FTS5 tables. Other databases, or SQLite
+# builds without FTS5, go without and searches fall back to LIKE.
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    cursor = schema_editor.connection.cursor()
+    for name in sorted(FTS_INDEXES):
+        try:
+            for sql in create_sql(name):
+                cursor.execute(sql)
+        except OperationalError:
+            for sql in drop_sql(name):
+                cursor.execute(sql) # no FTS5, so leave nothing half built
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    cursor = schema_editor.connection.cursor()
+    for name in sorted(FTS_INDEXES):
+        for sql in drop_sql(name):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0005_message_report_written_on_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count, Min
+
+
+# Racing get_or_create calls may already have doubled up subscriptions,
+# keep the oldest of each so the unique constraint can be added
+def dedupe_subscriptions(apps, schema_editor):
+    ReportSubscription = apps.get_model('worx', 'ReportSubscription')
+    dupes = ReportSubscription.objects.values('account', 'report') \
+        .annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1)
+    for dupe in dupes:
+        ReportSubscription.objects.filter(account=dupe['account'], report=dupe['report']) \
+            .exclude(id=dupe['keep']).delete()
+
+
+def noop(apps, schema_editor):
+    pass # duplicates can't be restored, nor do they need to be
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0006_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='account_key',
+            field=models.CharField(max_length=255, db_index=True),
+        ),
+        migrations.RunPython(dedupe_subscriptions, noop),
+        migrations.AlterUniqueTogether(
+            name='reportsubscription',
+            unique_together=set([('account', 'report')]),
+        ),
+    ]
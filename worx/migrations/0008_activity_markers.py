@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Max
+from django.utils import timezone
+
+
+def backfill_last_activity(apps, schema_editor):
+    Report = apps.get_model('worx', 'Report')
+    for rep in Report.objects.annotate(latest=Max('messages__written_on')).iterator():
+        Report.objects.filter(id=rep.id).update(last_activity=rep.latest or rep.reported_on)
+
+
+def noop(apps, schema_editor):
+    pass # the column is dropped by the reverse of AddField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0007_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='updated_on',
+            field=models.DateTimeField(default=timezone.now, auto_now=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='last_activity',
+            field=models.DateTimeField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(backfill_last_activity, noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from worx.models import public_id_for
+
+
+# Existing accounts keep the identifier clients already know them by
+def backfill_public_id(apps, schema_editor):
+    Account = apps.get_model('worx', 'Account')
+    for account in Account.objects.only('id', 'account_key').iterator():
+        Account.objects.filter(id=account.id).update(public_id=public_id_for(account.account_key))
+
+
+def noop(apps, schema_editor):
+    pass # the column is dropped by the reverse of AddField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0008_activity_markers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='public_id',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_public_id, noop),
+    ]
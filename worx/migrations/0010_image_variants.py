@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# Existing images get their variants from the make_thumbnails command
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0009_account_public_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messageimage',
+            name='large_blob',
+            field=models.CharField(max_length=64, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='messageimage',
+            name='thumb_blob',
+            field=models.CharField(max_length=64, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='thumb_blob',
+            field=models.CharField(max_length=64, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# Room for salted PBKDF2 hashes; legacy SHA-256 hashes are replaced as
+# their accounts log in
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='passphrase',
+            field=models.CharField(max_length=128),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from collections import defaultdict
+
+
+# Place existing replies in their threads: one update for the replies to
+# each message that has any, working down from the messages replying to
+# nothing
+def backfill_thread_paths(apps, schema_editor):
+    Message = apps.get_model('worx', 'Message')
+    replies = defaultdict(list)
+    for m_id, reply_to in Message.objects.values_list('id', 'reply_to_id').iterator():
+        replies[reply_to].append(m_id)
+    level = [(m_id, '', 0) for m_id in replies.pop(None, [])]
+    while level:
+        below = []
+        for m_id, path, depth in level:
+            children = replies.pop(m_id, None)
+            if children:
+                child_path = path + '%010d/' % m_id
+                Message.objects.filter(reply_to_id=m_id).update(thread_path=child_path,
+                    thread_depth=depth + 1)
+                below.extend((c, child_path, depth + 1) for c in children)
+        level = below
+
+
+def noop(apps, schema_editor):
+    pass # the columns are dropped by the reverse of AddField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0011_account_passphrase_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='thread_depth',
+            field=models.PositiveSmallIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_path',
+            field=models.CharField(db_index=True, max_length=550, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(backfill_thread_paths, noop),
+    ]
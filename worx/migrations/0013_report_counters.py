@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from worx.counters import recount_reports
+
+
+def count_existing(apps, schema_editor):
+    recount_reports(apps=apps)
+
+
+def noop(apps, schema_editor):
+    pass # the columns are dropped by the reverse of AddField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0012_message_thread_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.RunPython(count_existing, noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0013_report_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='external_ref',
+            field=models.CharField(db_index=True, max_length=100, blank=True),
+            preserve_default=True,
+        ),
+    ]
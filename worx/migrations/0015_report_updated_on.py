@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+# Existing reports are stamped with when this runs, so their ETags change once
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worx', '0014_report_external_ref'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='updated_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_importjob'),
+        ('worx', '0015_report_updated_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='import_job',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='api.ImportJob', null=True),
+            preserve_default=True,
+        ),
+    ]
@@ -1,15 +1,33 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+import hashlib
+
+from worx.geo import encode_geohash
+
+# Identifier an account is shown by in place of its (private) account key
+def public_id_for(account_key):
+    return hashlib.sha256(account_key.encode('utf-8')).hexdigest()
 
 class Account(models.Model):
-    account_key = models.CharField(max_length=255)
-    passphrase = models.CharField(max_length=64) # SHA256
+    account_key = models.CharField(max_length=255, db_index=True)
+    passphrase = models.CharField(max_length=128) # see api/passwords.py
+    public_id = models.CharField(max_length=64) # fixed at creation
+
+    def save(self, *args, **kwargs):
+        if not self.public_id:
+            self.public_id = public_id_for(self.account_key)
+        super(Account, self).save(*args, **kwargs) # save
 
 class Profile(models.Model):
     account = models.OneToOneField(Account, related_name='profile')
     name = models.CharField(max_length=100)
     location = models.CharField(max_length=100, blank=True)
     bio = models.TextField(blank=True)
-    img_data = models.TextField(blank=True) # base64 encoded
+    img_blob = models.CharField(max_length=64, blank=True) # SHA256 in blob store
+    thumb_blob = models.CharField(max_length=64, blank=True) # made off the request thread
+    updated_on = models.DateTimeField(auto_now=True)
 
 class Report(models.Model):
     reported_by = models.ForeignKey(Account, related_name='reports')
@@ -17,16 +35,53 @@ class Report(models.Model):
     title = models.CharField(max_length=128)
     longitude = models.FloatField() # x
     latitude = models.FloatField()  # y
+    geohash = models.CharField(max_length=12, db_index=True) # spatial index
+    last_activity = models.DateTimeField(blank=True, null=True) # latest message/image
+    # when anything in the report's JSON (or its messages' images) last
+    # changed, for ETags; the hooks below move it with their UPDATEs
+    updated_on = models.DateTimeField(auto_now=True)
+    # kept up to date by the saves below (in the same transaction), and
+    # recounted by `manage.py repair_report_counts`
+    message_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+    subscriber_count = models.PositiveIntegerField(default=0)
+    # the identifier a bulk imported report had in the file it came from
+    # (see api/bulk.py), which later rows refer to it by
+    external_ref = models.CharField(max_length=100, blank=True, db_index=True)
+    # the bulk import that wrote the report, by which it reads back the ids
+    # the database gave the reports it inserted
+    import_job = models.ForeignKey('api.ImportJob', blank=True, null=True, related_name='+',
+        on_delete=models.SET_NULL)
 
     # overwrite save to force a subscription for the author
     # which they can remove later if they want
     def save(self, *args, **kwargs):
         new_rep = self.pk is None
-        super(Report, self).save(*args, **kwargs) # save
-        if new_rep:
-            new_sub = ReportSubscription(account=self.reported_by, report=self)
-            new_sub.save() # save the subscription
+        # keep the spatial index in step with the coordinates
+        self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+        if self.last_activity is None:
+            self.last_activity = timezone.now()
+        # saving a report loaded earlier mustn't put back stale counts
+        if not new_rep and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in REPORT_COUNTERS]
+        with transaction.atomic():
+            super(Report, self).save(*args, **kwargs) # save
+            if new_rep:
+                new_sub = ReportSubscription(account=self.reported_by, report=self)
+                new_sub.save() # save the subscription
+                self.subscriber_count += 1
 
+# Report fields only ever changed by UPDATEs relative to their current value
+REPORT_COUNTERS = ('last_activity', 'message_count', 'image_count', 'subscriber_count')
+
+
+# Deepest a reply can be in a thread (a message replying to nothing is at 0)
+THREAD_MAX_DEPTH = 50
+
+# A message's part of its replies' thread paths
+def thread_segment(message_id):
+    return '%010d/' % message_id
 
 class Message(models.Model):
     about_report = models.ForeignKey(Report, related_name='messages')
@@ -34,14 +89,72 @@ class Message(models.Model):
     written_on = models.DateTimeField(auto_now_add=True)
     reply_to = models.ForeignKey('Message', blank=True, null=True, related_name='replies')
     message_text = models.TextField()
+    # the segments of the messages this replies to, outermost first, so
+    # the replies under a message are a range of the index starting at
+    # its thread_path + thread_segment(id)
+    thread_path = models.CharField(max_length=THREAD_MAX_DEPTH * 11, blank=True, db_index=True)
+    thread_depth = models.PositiveSmallIntegerField(default=0)
     class Meta:
         ordering = ['-written_on']
+        # pages of a report's messages are read newest first
+        index_together = [('about_report', 'written_on')]
+
+    # The thread path of replies to this message
+    def replies_path(self):
+        return self.thread_path + thread_segment(self.id)
+
+    # overwrite save to mark the report as active and count the message
+    # (and place replies in their thread)
+    def save(self, *args, **kwargs):
+        new_msg = self.pk is None
+        if new_msg and self.reply_to_id is not None and not self.thread_path:
+            self.thread_path = self.reply_to.replies_path()
+            self.thread_depth = self.reply_to.thread_depth + 1
+        with transaction.atomic():
+            super(Message, self).save(*args, **kwargs) # save
+            if new_msg:
+                Report.objects.filter(id=self.about_report_id).update(
+                    last_activity=self.written_on, updated_on=self.written_on,
+                    message_count=F('message_count') + 1)
 
 class MessageImage(models.Model):
     on_message = models.ForeignKey(Message, related_name='images')
-    img_data = models.TextField() # base64 encoded
+    img_blob = models.CharField(max_length=64) # SHA256 in blob store
+    # smaller variants, made off the request thread ('' until then)
+    thumb_blob = models.CharField(max_length=64, blank=True)
+    large_blob = models.CharField(max_length=64, blank=True)
+
+    # overwrite save to mark the report as active and count the image
+    def save(self, *args, **kwargs):
+        new_img = self.pk is None
+        with transaction.atomic():
+            super(MessageImage, self).save(*args, **kwargs) # save
+            if new_img:
+                now = timezone.now()
+                Report.objects.filter(messages__id=self.on_message_id).update(
+                    last_activity=now, updated_on=now, image_count=F('image_count') + 1)
 
 class ReportSubscription(models.Model):
     account = models.ForeignKey(Account, related_name='watching')
     report = models.ForeignKey(Report, related_name='observers')
+    class Meta:
+        unique_together = [('account', 'report')]
+
+    # overwrite save and delete to count the report's subscribers (and
+    # mark the report updated, so its ETag changes with the count)
+    def save(self, *args, **kwargs):
+        new_sub = self.pk is None
+        with transaction.atomic():
+            super(ReportSubscription, self).save(*args, **kwargs) # save
+            if new_sub:
+                self.count_subscriber(1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            super(ReportSubscription, self).delete(*args, **kwargs)
+            self.count_subscriber(-1)
+
+    def count_subscriber(self, change):
+        Report.objects.filter(id=self.report_id).update(updated_on=timezone.now(),
+            subscriber_count=F('subscriber_count') + change)
 
@@ -0,0 +1,113 @@
+from django.db import connection, connections
+
+import re
+
+# Full text indexes: name -> (FTS5 table, content table, indexed column)
+# The FTS5 tables are "external content" tables over the model tables and
+# are kept in step with them by triggers (see migration 0006), so every
+# save, update and delete - including bulk ones - is indexed. SQLite
+# migrations that alter a model table rebuild it and lose its triggers, so
+# they're put back after every migrate (see ensure_triggers).
+FTS_INDEXES = {
+    'report': ('worx_report_fts', 'worx_report', 'title'),
+    'message': ('worx_message_fts', 'worx_message', 'message_text'),
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_available = {}
+
+# SQL to (re)create the triggers keeping an index in step with its table
+def trigger_sql(name):
+    fts, table, column = FTS_INDEXES[name]
+    values = dict(fts=fts, table=table, column=column)
+    return [
+        "CREATE TRIGGER IF NOT EXISTS %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(rowid, %(column)s) VALUES (new.id, new.%(column)s); END" % values,
+        "CREATE TRIGGER IF NOT EXISTS %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, %(column)s) "
+            "VALUES ('delete', old.id, old.%(column)s); END" % values,
+        "CREATE TRIGGER IF NOT EXISTS %(fts)s_au AFTER UPDATE OF %(column)s ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, %(column)s) "
+            "VALUES ('delete', old.id, old.%(column)s); "
+            "INSERT INTO %(fts)s(rowid, %(column)s) VALUES (new.id, new.%(column)s); END" % values,
+    ]
+
+# SQL to create an index, its triggers and fill it from existing rows
+def create_sql(name):
+    fts, table, column = FTS_INDEXES[name]
+    return ["CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='id')" % (
+        fts, column, table)] + trigger_sql(name) + \
+        ["INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts)]
+
+# SQL to remove an index and its triggers
+def drop_sql(name):
+    fts = FTS_INDEXES[name][0]
+    return ['DROP TRIGGER IF EXISTS %s_%s' % (fts, t) for t in ('ai', 'ad', 'au')] + \
+        ['DROP TABLE IF EXISTS %s' % fts]
+
+# Put back any triggers lost when migrations rebuilt a model table
+# (connected to post_migrate; row ids survive a rebuild so the index
+# itself is still good)
+def ensure_triggers(using, **kwargs):
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+    cursor = conn.cursor()
+    for name in sorted(FTS_INDEXES):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s",
+            [FTS_INDEXES[name][0]])
+        if cursor.fetchone() is not None:
+            for sql in trigger_sql(name):
+                cursor.execute(sql)
+
+# Is the named full text index present in this database?
+# (it needs SQLite built with FTS5, other databases fall back to LIKE)
+def fts_available(name):
+    key = (connection.alias, connection.settings_dict['NAME'], name)
+    if key not in _available:
+        found = False
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s",
+                [FTS_INDEXES[name][0]])
+            found = cursor.fetchone() is not None
+        _available[key] = found
+    return _available[key]
+
+# Turn free text into an FTS5 query: every term must appear, and the
+# last term also matches as a prefix (so results come up while typing)
+# Returns None if there are no searchable terms.
+def match_expression(text):
+    terms = _TOKEN_RE.findall(text)
+    if not terms:
+        return None
+    quoted = ['"%s"' % t for t in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+# Search the named index, best matches first
+# Returns a list of (rank, id) with rank the bm25 score (lower is better).
+# `after` is the (rank, id) of the last hit on the previous page, and
+# `within` optionally restricts hits with an extra (sql, params) condition
+# on the content table, which is aliased as "t".
+def search(name, text, limit, after=None, within=None):
+    fts, table, column = FTS_INDEXES[name]
+    expr = match_expression(text)
+    if expr is None:
+        return []
+    sql = ['SELECT %s.rowid, %s.rank FROM %s' % (fts, fts, fts)]
+    params = [expr]
+    if within is not None:
+        sql.append('JOIN %s t ON t.id = %s.rowid' % (table, fts))
+    sql.append('WHERE %s MATCH %%s' % fts)
+    if within is not None:
+        sql.append('AND ' + within[0])
+        params.extend(within[1])
+    if after is not None:
+        sql.append('AND (%s.rank > %%s OR (%s.rank = %%s AND %s.rowid > %%s))' % (fts, fts, fts))
+        params.extend([after[0], after[0], after[1]])
+    sql.append('ORDER BY %s.rank, %s.rowid LIMIT %%s' % (fts, fts))
+    params.append(limit)
+    cursor = connection.cursor()
+    cursor.execute(' '.join(sql), params)
+    return [(rank, r_id) for r_id, rank in cursor.fetchall()]
@@ -1,3 +1,212 @@
-from django.test import TestCase
+from django.db import connection, transaction
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+import hashlib
+import importlib
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from worx.geo import encode_geohash, haversine, bounding_box, covering_prefixes
+from worx.images import image_info
+from worx import db
+from worx.backends.sqlite3.base import DatabaseWrapper
+from worx.models import Account, Report, Message
+from api.v1 import reports_near
+
+
+class GeoTests(TestCase):
+
+    def test_geohash_known_value(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_haversine(self):
+        # London to Paris is roughly 344km
+        self.assertAlmostEqual(haversine(51.5074, -0.1278, 48.8566, 2.3522), 343.5, delta=1.0)
+
+    def test_covering_prefixes_contain_circle(self):
+        box = bounding_box(51.5, -0.12, 5.0)
+        prefixes = covering_prefixes(box)
+        self.assertTrue(1 <= len(prefixes) <= 4)
+        for lat, lng in [(51.5, -0.12), (51.54, -0.12), (51.5, -0.05)]:
+            g = encode_geohash(lat, lng)
+            self.assertTrue(any(g.startswith(p) for p in prefixes))
+
+    def test_reports_near_matches_full_scan(self):
+        owner = Account.objects.create(account_key='geo', passphrase='')
+        rnd = random.Random(1)
+        for i in range(300):
+            Report(reported_by=owner, title='r%d' % i,
+                latitude=51.5 + rnd.uniform(-0.5, 0.5),
+                longitude=-0.1 + rnd.uniform(-0.5, 0.5)).save()
+        found = reports_near(51.5, -0.1, 10.0)
+        expected = sorted((haversine(51.5, -0.1, r.latitude, r.longitude), r.id)
+            for r in Report.objects.all())
+        expected = [e for e in expected if e[0] <= 10.0]
+        self.assertEqual(found, expected)
+        self.assertTrue(len(found) > 0)
+
+    def test_bounding_box_contains_circle(self):
+        rnd = random.Random(1)
+        for lat, radius in [(51.5, 50.0), (70.0, 300.0), (-75.0, 1000.0), (85.0, 1000.0)]:
+            min_lat, max_lat, min_lng, max_lng = bounding_box(lat, 10.0, radius)
+            missed = 0
+            for i in range(5000):
+                p_lat, p_lng = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+                if haversine(lat, 10.0, p_lat, p_lng) <= radius:
+                    missed += not (min_lat <= p_lat <= max_lat and min_lng <= p_lng <= max_lng)
+            # and points on the circle itself, all round
+            for i in range(360):
+                p_lat, p_lng = self.destination(lat, 10.0, radius * 0.9999, i)
+                missed += not (min_lat <= p_lat <= max_lat and min_lng <= p_lng <= max_lng)
+            self.assertEqual(missed, 0, (lat, radius))
+
+    def test_reports_near_matches_full_scan_far_north(self):
+        owner = Account.objects.create(account_key='geo', passphrase='')
+        rnd = random.Random(2)
+        for i in range(300):
+            Report(reported_by=owner, title='r%d' % i, latitude=rnd.uniform(60, 80),
+                longitude=rnd.uniform(0, 60)).save()
+        found = reports_near(70.0, 30.0, 600.0)
+        expected = sorted((haversine(70.0, 30.0, r.latitude, r.longitude), r.id)
+            for r in Report.objects.all())
+        self.assertEqual(found, [e for e in expected if e[0] <= 600.0])
+
+    # the point `distance` km from (lat, lng) on the given bearing (degrees)
+    def destination(self, lat, lng, distance, bearing):
+        d, b = distance / 6371.0, math.radians(bearing)
+        p1, l1 = math.radians(lat), math.radians(lng)
+        p2 = math.asin(math.sin(p1) * math.cos(d) + math.cos(p1) * math.sin(d) * math.cos(b))
+        l2 = l1 + math.atan2(math.sin(b) * math.sin(d) * math.cos(p1),
+            math.cos(d) - math.sin(p1) * math.sin(p2))
+        return math.degrees(p2), (math.degrees(l2) + 540.0) % 360.0 - 180.0
+
+
+class AccountTests(TestCase):
+
+    def test_public_id_fixed_at_creation(self):
+        account = Account.objects.create(account_key='someone', passphrase='')
+        # the same identifier clients were shown before it was stored
+        self.assertEqual(account.public_id, hashlib.sha256('someone').hexdigest())
+        account.account_key = 'renamed'
+        account.save()
+        self.assertEqual(Account.objects.get().public_id, hashlib.sha256('someone').hexdigest())
+
+
+class ThreadPathTests(TestCase):
+
+    def test_backfill(self):
+        from django.apps import apps
+        account = Account.objects.create(account_key='someone', passphrase='')
+        report = Report.objects.create(reported_by=account, title='t', latitude=0, longitude=0)
+        a = Message.objects.create(about_report=report, written_by=account, message_text='a')
+        b = Message.objects.create(about_report=report, written_by=account, message_text='b', reply_to=a)
+        c = Message.objects.create(about_report=report, written_by=account, message_text='c', reply_to=b)
+        expected = list(Message.objects.order_by('id').values_list('thread_path', 'thread_depth'))
+        Message.objects.update(thread_path='', thread_depth=0)
+        migration = importlib.import_module('worx.migrations.0012_message_thread_path')
+        migration.backfill_thread_paths(apps, None)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('thread_path',
+            'thread_depth')), expected)
+        self.assertEqual(expected[2], ('%010d/%010d/' % (a.id, b.id), 2))
+
+
+class ImageTests(TestCase):
+
+    def test_image_info_from_headers(self):
+        png = '\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x01\x00\x00\x00\x00\x80'
+        self.assertEqual(image_info(png), ('image/png', 256, 128))
+        self.assertEqual(image_info('GIF89a\x20\x00\x10\x00'), ('image/gif', 32, 16))
+        # APP0 segment, then a baseline start of frame
+        jpeg = '\xff\xd8\xff\xe0\x00\x04ab\xff\xc0\x00\x11\x08\x01\xe0\x02\x80'
+        self.assertEqual(image_info(jpeg), ('image/jpeg', 640, 480))
+
+    def test_image_info_rejects(self):
+        for data in ('hello', '\xff\xd8\xff\xd9', 'GIF89a\x00\x00\x10\x00'):
+            self.assertRaises(ValueError, image_info, data)
+        with self.settings(IMAGE_MAX_PIXELS=1000):
+            self.assertRaises(ValueError, image_info, 'GIF89a\x20\x00\x40\x00')
+
+    def test_image_info_rejects_truncated_headers(self):
+        png = '\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x01\x00\x00\x00\x00\x80'
+        jpeg = '\xff\xd8\xff\xe0\x00\x04ab\xff\xc0\x00\x11\x08\x01\xe0\x02\x80'
+        for data in (png, 'GIF89a\x20\x00\x10\x00', jpeg):
+            for end in range(len(data) - 1, 0, -1):
+                self.assertRaises(ValueError, image_info, data[:end])
+
+
+class ProductionSettingsTests(SimpleTestCase):
+
+    NAMES = ('CIVIWORX_SECRET_KEY', 'CIVIWORX_ALLOWED_HOSTS')
+
+    def setUp(self):
+        saved = dict((k, os.environ[k]) for k in self.NAMES if k in os.environ)
+        self.addCleanup(self.restore, saved)
+
+    def restore(self, saved):
+        for k in self.NAMES:
+            os.environ.pop(k, None)
+        os.environ.update(saved)
+        sys.modules.pop('civiworx.settings_production', None)
+
+    # import the production settings afresh with just these variables set
+    def load(self, **env):
+        for k in self.NAMES:
+            os.environ.pop(k, None)
+        os.environ.update(env)
+        sys.modules.pop('civiworx.settings_production', None)
+        return importlib.import_module('civiworx.settings_production')
+
+    def test_secrets_required(self):
+        self.assertRaises(ImproperlyConfigured, self.load)
+        self.assertRaises(ImproperlyConfigured, self.load, CIVIWORX_SECRET_KEY='s3cret')
+        self.assertRaises(ImproperlyConfigured, self.load, CIVIWORX_ALLOWED_HOSTS='example.org')
+        production = self.load(CIVIWORX_SECRET_KEY='s3cret',
+            CIVIWORX_ALLOWED_HOSTS='example.org, www.example.org')
+        self.assertEqual(production.SECRET_KEY, 's3cret')
+        self.assertEqual(production.ALLOWED_HOSTS, ['example.org', 'www.example.org'])
+        self.assertEqual(production.DATABASES['default']['TRANSACTION_MODE'], 'IMMEDIATE')
+
+class DatabaseProfileTests(SimpleTestCase):
+
+    def test_reads_pinned_after_write(self):
+        router = db.ReadWriteRouter()
+        with self.settings(DATABASE_READ_REPLICAS=['replica']):
+            db.unpin(None)
+            self.assertEqual(router.db_for_read(Report), 'replica')
+            self.assertEqual(router.db_for_write(Report), 'default')
+            self.assertEqual(router.db_for_read(Report), 'default')
+            db.unpin(None) # the next request
+            self.assertEqual(router.db_for_read(Report), 'replica')
+            self.assertFalse(router.allow_migrate('replica', Report))
+        with self.settings(DATABASE_READ_REPLICAS=[]):
+            self.assertEqual(router.db_for_read(Report), 'default')
+
+    def test_reads_in_transaction_stay_on_default(self):
+        router = db.ReadWriteRouter()
+        db.unpin(None)
+        with self.settings(DATABASE_READ_REPLICAS=['replica']):
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Report), 'default')
+
+    def test_sqlite_backend_pragmas_and_immediate_transactions(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'db.sqlite3')
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=path,
+            PRAGMAS={'journal_mode': 'wal', 'synchronous': 'normal'},
+            TRANSACTION_MODE='IMMEDIATE'), alias='profile-test')
+        self.addCleanup(wrapper.close)
+        cursor = wrapper.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        self.assertEqual(cursor.fetchone()[0], 'wal')
+        # beginning a transaction takes the write lock straight away
+        wrapper._start_transaction_under_autocommit()
+        other = sqlite3.connect(path, timeout=0)
+        self.addCleanup(other.close)
+        self.assertRaises(sqlite3.OperationalError, other.execute, 'BEGIN IMMEDIATE')